@@ -0,0 +1,294 @@
+# animation.py - 动图 (GIF / WebP) 逐帧超分
+#
+# 帧按顺序流式解码，与前一个保留帧相同或几乎相同的帧不再推理，只把显示时长合并到保留帧上；
+# 唯一帧编码为 PNG 后提交到线程池，在途帧数受滑动窗口限制，结果按原顺序写出。
+# 同一时刻内存中只有窗口内的帧，与动图总帧数无关：GIF 逐帧写入输出文件，
+# WebP 需要一次性编码，超分后的帧先暂存到磁盘，编码时再逐帧读回。
+
+import io
+import os
+import logging
+import tempfile
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import GifImagePlugin, Image, ImageChops, ImageSequence, ImageStat
+
+import progress
+from ingest import ImageTooLargeError, IngestError, UnsupportedFormatError
+
+logger = logging.getLogger(__name__)
+
+ANIMATION_MAX_FRAMES = int(os.getenv("ANIMATION_MAX_FRAMES", "500"))        # 单个动图最多帧数
+ANIMATION_CONCURRENCY = int(os.getenv("ANIMATION_CONCURRENCY", "4"))       # 同时进行推理的帧数
+ANIMATION_DEDUP_DIFF = float(os.getenv("ANIMATION_DEDUP_DIFF", "1.0"))    # 与前一帧缩略图的平均像素差不超过该值时视为重复帧，0 表示只跳过完全相同的帧
+ANIMATION_MAX_OUTPUT_PIXELS = int(os.getenv("ANIMATION_MAX_OUTPUT_PIXELS", "250000000"))  # 所有帧的输出像素总数上限 (帧数 × 宽 × 高 × 放大倍数²)，0 表示不限
+
+ANIMATION_FORMATS = ('GIF', 'WEBP')
+MIMETYPES = {'GIF': 'image/gif', 'WEBP': 'image/webp'}
+# 没有声明时长的帧按浏览器的默认值处理
+DEFAULT_DURATION = 100
+THUMB_SIZE = 64
+# 输出文件超过该大小时暂存到磁盘
+SPOOL_MAX_BYTES = 4 * 1024 * 1024
+
+
+def probe(source):
+    """只解析文件头和帧表，返回 (格式, 帧数, 宽, 高)，读取后恢复文件位置"""
+    position = source.tell()
+    try:
+        with Image.open(source) as image:
+            return image.format, getattr(image, 'n_frames', 1), image.width, image.height
+    except Exception as e:
+        raise IngestError('Invalid image file') from e
+    finally:
+        source.seek(position)
+
+
+def check_limits(frames, width, height, scale, max_frames=ANIMATION_MAX_FRAMES,
+                 max_output_pixels=ANIMATION_MAX_OUTPUT_PIXELS):
+    """在提交任何推理之前按帧数和输出像素总数拒绝过长的动图（同步请求会一直占用请求线程）"""
+    if frames > max_frames:
+        raise ImageTooLargeError(f'Too many frames. Maximum {max_frames} allowed.')
+    output_pixels = frames * width * height * (scale or 1) ** 2
+    if max_output_pixels and output_pixels > max_output_pixels:
+        raise ImageTooLargeError(
+            f'Animation too large ({frames} frames of {width}x{height} at {scale or 1}x). '
+            f'Maximum {max_output_pixels} output pixels allowed.')
+
+
+def decode_frames(image, stats):
+    """逐帧解码，产出 (帧, 显示时长毫秒)；有透明通道的动图解码为 RGBA，否则为 RGB"""
+    mode = 'RGBA' if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info else 'RGB'
+    for frame in ImageSequence.Iterator(image):
+        stats['frames'] += 1
+        # WebP 的帧时长在解码该帧之后才写入 info
+        converted = frame.convert(mode)
+        duration = frame.info.get('duration')
+        yield converted, DEFAULT_DURATION if duration is None else duration
+
+
+def _thumbnail(frame):
+    return frame.convert('L').resize((THUMB_SIZE, THUMB_SIZE), Image.BOX)
+
+
+def _is_duplicate(kept, kept_thumb, frame, thumb, max_diff):
+    # getbbox() 对 RGBA 只看透明通道，用各通道的极值判断是否完全相同
+    if all(high == 0 for _, high in ImageChops.difference(kept, frame).getextrema()):
+        return True
+    return max_diff > 0 and ImageStat.Stat(ImageChops.difference(kept_thumb, thumb)).mean[0] <= max_diff
+
+
+def dedup_frames(frames, max_diff=ANIMATION_DEDUP_DIFF):
+    """合并与前一个保留帧相同或几乎相同的帧，产出 (帧, 合并后的时长, 合并的帧数)"""
+    kept = kept_thumb = None
+    duration = count = 0
+    for frame, frame_duration in frames:
+        thumb = _thumbnail(frame) if max_diff > 0 else None
+        if kept is not None and _is_duplicate(kept, kept_thumb, frame, thumb, max_diff):
+            duration += frame_duration
+            count += 1
+            frame.close()
+            continue
+        if kept is not None:
+            yield kept, duration, count
+        kept, kept_thumb, duration, count = frame, thumb, frame_duration, 1
+    if kept is not None:
+        yield kept, duration, count
+
+
+def _encode_frame(frame):
+    buffer = io.BytesIO()
+    frame.convert('RGB').save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def upscale_frames(frames, runner, concurrency=ANIMATION_CONCURRENCY, window=None):
+    """并发超分唯一帧，按原顺序产出 (结果字节或 None, 时长, 合并的帧数, 透明通道或 None)
+
+    已提交但尚未产出的帧不超过 window 个（默认为并发数的两倍）。
+    """
+    window = window or max(concurrency, 1) * 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='upscale-frame') as executor:
+        try:
+            for frame, duration, count in frames:
+                alpha = frame.getchannel('A') if frame.mode == 'RGBA' else None
+                frame_data = _encode_frame(frame)
+                frame.close()
+                # 帧在线程池中执行，复制上下文以沿用当前请求的进度通道和调度流
+                context = contextvars.copy_context()
+                pending.append((executor.submit(context.run, runner, frame_data), duration, count, alpha))
+                if len(pending) >= window:
+                    future, duration, count, alpha = pending.popleft()
+                    yield future.result(), duration, count, alpha
+            while pending:
+                future, duration, count, alpha = pending.popleft()
+                yield future.result(), duration, count, alpha
+        finally:
+            # 失败或客户端断开时取消尚未开始的帧
+            for future, *_ in pending:
+                future.cancel()
+
+
+def _open_result(result, size, alpha):
+    """解码超分结果，统一为第一帧的尺寸，并把原透明通道放大后贴回"""
+    with Image.open(io.BytesIO(result)) as upscaled:
+        frame = upscaled.convert('RGB')
+    if size is not None and frame.size != size:
+        frame = frame.resize(size, Image.LANCZOS)
+    if alpha is not None:
+        frame.putalpha(alpha.resize(frame.size, Image.LANCZOS))
+    return frame
+
+
+def _to_palette(frame):
+    """转换为 GIF 的调色板模式，返回 (图片, 透明色索引或 None)"""
+    if frame.mode != 'RGBA':
+        return frame.convert('P', palette=Image.ADAPTIVE, colors=256), None
+    # 最后一个索引留给透明像素
+    image = frame.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=255)
+    image.paste(255, mask=frame.getchannel('A').point(lambda value: 255 if value < 128 else 0))
+    return image, 255
+
+
+class GifWriter:
+    """逐帧写出 GIF，每帧使用自己的调色板，不需要把整段动画保存在内存中"""
+
+    def __init__(self, fp, loop=None):
+        self.fp = fp
+        self.loop = loop
+        self.frames = 0
+
+    def add(self, frame, duration):
+        image, transparency = _to_palette(frame)
+        if self.frames == 0:
+            info = {} if self.loop is None else {'loop': self.loop}
+            header, _ = GifImagePlugin.getheader(image.copy(), info=info)
+            for chunk in header:
+                self.fp.write(chunk)
+        params = {'duration': duration, 'include_color_table': True, 'disposal': 1}
+        if transparency is not None:
+            # 透明区域不能透出上一帧
+            params.update(transparency=transparency, disposal=2)
+        for chunk in GifImagePlugin.getdata(image, **params):
+            self.fp.write(chunk)
+        self.frames += 1
+
+    def close(self):
+        self.fp.write(b';')
+
+    def abort(self):
+        pass
+
+
+class _SpooledFrames:
+    """按需从磁盘读取的帧序列，Pillow 的动图编码器通过 seek 逐帧读取，其余属性委托给当前帧"""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.n_frames = len(paths)
+        self._frame = None
+        self._index = None
+
+    def seek(self, index):
+        self.close()
+        self._frame = Image.open(self.paths[index])
+        self._frame.load()
+        self._index = index
+
+    def tell(self):
+        return self._index
+
+    def close(self):
+        if self._frame is not None:
+            self._frame.close()
+            self._frame = None
+
+    def __getattr__(self, name):
+        if self._frame is None:
+            raise AttributeError(name)
+        return getattr(self._frame, name)
+
+
+class WebPWriter:
+    """WebP 动画只能一次编码：超分后的帧先暂存到磁盘，编码时逐帧读回"""
+
+    def __init__(self, fp, loop=0, quality=90):
+        self.fp = fp
+        self.loop = loop
+        self.quality = quality
+        self._dir = tempfile.TemporaryDirectory(prefix='animation-')
+        self.paths = []
+        self.durations = []
+
+    def add(self, frame, duration):
+        path = os.path.join(self._dir.name, f'{len(self.paths):05d}.png')
+        frame.save(path, format='PNG', compress_level=1)
+        self.paths.append(path)
+        self.durations.append(duration)
+
+    def close(self):
+        rest = _SpooledFrames(self.paths[1:])
+        try:
+            with Image.open(self.paths[0]) as first:
+                first.save(self.fp, format='WEBP', save_all=True, append_images=[rest] if rest.n_frames else [],
+                           duration=self.durations, loop=self.loop, quality=self.quality)
+        finally:
+            rest.close()
+            self._dir.cleanup()
+
+    def abort(self):
+        self._dir.cleanup()
+
+
+def upscale_animation(source, runner, output_format=None, max_frames=ANIMATION_MAX_FRAMES,
+                      max_diff=ANIMATION_DEDUP_DIFF, concurrency=ANIMATION_CONCURRENCY):
+    """逐帧超分动图，返回 (结果文件对象, 统计信息)，任一帧失败时结果为 None
+
+    source 为文件对象或路径；runner(帧的 PNG 字节) 返回超分结果字节。
+    output_format 为 'GIF' / 'WEBP'，默认与输入相同。
+    """
+    try:
+        image = Image.open(source)
+    except Exception as e:
+        raise IngestError('Invalid image file') from e
+    with image:
+        if image.format not in ANIMATION_FORMATS:
+            raise UnsupportedFormatError('Animation must be GIF or WebP')
+        total = getattr(image, 'n_frames', 1)
+        if total > max_frames:
+            raise ImageTooLargeError(f'Too many frames. Maximum {max_frames} allowed.')
+        output_format = output_format or image.format
+        stats = {'frames': 0, 'unique_frames': 0, 'format': output_format.lower()}
+        progress.emit('frames', total=total)
+
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        loop = image.info.get('loop', 0 if image.format == 'WEBP' else None)
+        writer = GifWriter(output, loop) if output_format == 'GIF' else WebPWriter(output, 0 if loop is None else loop)
+        size = None
+        try:
+            unique = dedup_frames(decode_frames(image, stats), max_diff)
+            for result, duration, count, alpha in upscale_frames(unique, runner, concurrency):
+                if not result:
+                    logger.error(f"动图第 {stats['unique_frames'] + 1} 个唯一帧超分失败")
+                    writer.abort()
+                    output.close()
+                    return None, stats
+                frame = _open_result(result, size, alpha)
+                size = frame.size
+                writer.add(frame, duration)
+                frame.close()
+                stats['unique_frames'] += 1
+                progress.emit('frame', done=stats['frames'], unique=stats['unique_frames'], total=total)
+            writer.close()
+        except BaseException:
+            writer.abort()
+            output.close()
+            raise
+
+    stats['width'], stats['height'] = size
+    logger.info(f"动图超分完成: {stats['frames']} 帧，其中 {stats['unique_frames']} 个唯一帧")
+    output.seek(0)
+    return output, stats
@@ -1,12 +1,42 @@
 import os
 import io
+import gc
+import hmac
 import base64
-import requests
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, send_from_directory, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
 from PIL import Image
 import logging
 from datetime import datetime
 import time
+import threading
+
+from inference_client import get_inference_client
+from jobs import JobManager, QueueFullError, FAILED
+from job_queue import JOB_BACKEND, DurableJobManager, create_job_queue, create_job_storage
+from result_cache import create_result_cache, make_cache_key
+from phash import NearDuplicateIndex, fingerprint
+from ingest import IngestError, MemoryProbe, PEAK_MEMORY_BYTES, check_file, check_image, process_peak_rss
+from encoding import OutputEncoder, make_preview, negotiate, parse_quality
+from tiling import check_output_pixels, image_size, should_tile, tile_limits, upscale_tiled
+from singleflight import SingleFlight
+from retry_policy import CircuitOpenError
+from preprocess import PREPROCESS_ENABLED, PREPROCESS_MAX_OUTPUT_PIXELS, InvalidImageError, normalize_image
+from animation import ANIMATION_CONCURRENCY, ANIMATION_FORMATS, MIMETYPES, check_limits, probe, upscale_animation
+from batch import BATCH_CONCURRENCY, BATCH_MAX_ITEMS, BatchError, read_zip_items, run_batch, ndjson_stream, zip_stream
+from backends import HFBackend, LocalBackend, register_backend, get_backend, available_backends
+from warmup import WARMUP_ENABLED, WarmupScheduler
+from models import AUTO, ModelRouter, load_model_specs, register_models
+import progress
+from progress import ProgressRegistry, sse_stream
+from uploads import UploadError, OffsetMismatchError, UploadStore
+from rate_limit import (
+    BATCH, INTERACTIVE, RateLimitedError, bind_flow, client_key_digest, create_rate_limiter, current_flow,
+    make_flow, upstream_scheduler,
+)
+from profiling import Profiler
+import metrics
+from metrics import BYTES, ERRORS, time_stage
 
 app = Flask(__name__)
 
@@ -15,164 +45,1039 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Hugging Face配置 - 使用支持Inference API的RealESRGAN模型
-HF_API_URL = "https://api-inference.huggingface.co/models/ai-forever/Real-ESRGAN"
+HF_API_URL = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models/ai-forever/Real-ESRGAN")
 HF_API_TOKEN = os.getenv("HF_API_TOKEN", "")
 
-def upscale_image_with_hf(image_data, max_retries=3):
+# 上传大小限制(MB)
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "20"))
+
+# 应用前面可信的反向代理层数 (Render / Heroku 的路由为 1)，据此从 X-Forwarded-For 取真实客户端 IP；
+# 为 0 时不信任转发头，避免客户端伪造来源 IP
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+def proxy_fix(wsgi_app):
+    """按 TRUSTED_PROXY_HOPS 包装 WSGI 应用，使 request.remote_addr / scheme 为代理转发前的值"""
+    if not TRUSTED_PROXY_HOPS:
+        return wsgi_app
+    return ProxyFix(wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+app.wsgi_app = proxy_fix(app.wsgi_app)
+
+# 管理接口 (/admin/*) 的令牌，未设置时管理接口不可用
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# 注册可用的推理后端
+register_backend(HFBackend(HF_API_URL, HF_API_TOKEN))
+register_backend(LocalBackend())
+
+# 模型注册表：每个模型有独立的地址、放大倍数、输入上限和超时，model=auto 时按实测耗时路由
+MODEL_SPECS = load_model_specs()
+model_router = ModelRouter(register_models(MODEL_SPECS, HF_API_TOKEN, default_url=HF_API_URL))
+
+# 模型预热：启动时及之后定时发送极小的推理请求，避免用户遇到冷启动（在 start_background_tasks 中启动）
+warmup = WarmupScheduler(get_backend('hf'))
+
+def upscale_image_with_hf(image_data, max_retries=None):
     """使用Hugging Face API进行超分辨率处理"""
-    import time
+    return get_backend('hf').upscale(image_data, max_retries=max_retries)
 
-    for attempt in range(max_retries):
-        try:
-            from requests.adapters import HTTPAdapter
-            from urllib3.util.retry import Retry
-
-            # 创建会话并配置重试策略
-            session = requests.Session()
-            retry_strategy = Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[429, 500, 502, 503, 504],
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            session.mount("http://", adapter)
-            session.mount("https://", adapter)
-
-            headers = {
-                "Authorization": f"Bearer {HF_API_TOKEN}",
-                "Content-Type": "application/octet-stream",
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
-            }
-
-            logger.info(f"尝试第 {attempt + 1} 次调用 Hugging Face API...")
-
-            # 发送请求到Hugging Face
-            response = session.post(
-                HF_API_URL,
-                headers=headers,
-                data=image_data,
-                timeout=(30, 180),  # (连接超时, 读取超时)
-                stream=False
-            )
+# 输出重新编码在专用线程池中进行
+output_encoder = OutputEncoder()
+
+# 超分结果缓存，相同输入直接返回之前的结果
+result_cache = create_result_cache()
+
+# 感知哈希索引：重新压缩、去掉 EXIF 或尺寸略有不同的同一张图片复用之前的结果
+near_index = NearDuplicateIndex()
+
+# 相同输入的并发请求合并为一次推理（同步与异步模式共用计数）
+singleflight = SingleFlight()
+
+def lookup_cached_result(image_data, backend, info):
+    """查询结果缓存，返回 (缓存键, 缓存结果或 None, 输入的感知哈希)
+
+    字节完全相同的输入未命中时，再按感知哈希查找近似重复的输入并复用其结果。
+    """
+    with time_stage('cache_lookup'):
+        cache_key = make_cache_key(image_data, backend.model_id, preprocess=PREPROCESS_ENABLED)
+        cached = result_cache.get(cache_key)
+    fp = None
+    if cached is None and near_index.enabled:
+        with time_stage('near_lookup'):
+            fp = fingerprint(image_data, transpose=PREPROCESS_ENABLED)
+            cached, match = near_index.lookup(backend.model_id, fp, result_cache.get)
+        if cached is not None:
+            info['near_duplicate'] = match
+            # 同一变体再次出现时直接按字节命中
+            result_cache.put(cache_key, cached)
+            logger.info(f"复用近似重复输入的结果 (汉明距离 {match['distance']}，像素差 {match['diff']})")
+    info['cached'] = cached is not None
+    if cached is not None:
+        logger.info("命中超分结果缓存")
+        progress.emit('cache_hit')
+    return cache_key, cached, fp
+
+def store_result(cache_key, backend, fp, result):
+    """写入结果缓存，并把输入的感知哈希加入近似重复索引"""
+    result_cache.put(cache_key, result)
+    near_index.add(backend.model_id, cache_key, fp)
+
+def prepare_input(image_data, backend, info):
+    """推理前的输入处理"""
+    if PREPROCESS_ENABLED:
+        # 规范化输入：方向、元数据、颜色模式和编码
+        with time_stage('preprocess'):
+            image_data, info['preprocess'] = normalize_image(image_data, scale=backend.scale)
+        summary = info['preprocess']
+        progress.emit('preprocessed', width=summary['width_out'], height=summary['height_out'],
+                      bytes=summary['bytes_out'], actions=summary['actions'])
+    return image_data
+
+def emit_preview(image_data, backend):
+    """推理开始前推送低分辨率预览，只有当前请求订阅了进度时才生成"""
+    if progress.current() is None:
+        return
+    try:
+        with time_stage('preview'):
+            image, width, height = make_preview(image_data, backend.scale)
+    except Exception as e:
+        logger.warning(f"生成预览图失败: {str(e)}")
+        return
+    progress.emit('preview', image=image, width=width, height=height)
 
-            if response.status_code == 200:
-                logger.info("Hugging Face API调用成功")
-                return response.content
-            elif response.status_code == 503:
-                logger.warning(f"模型正在加载中，状态码: {response.status_code}")
-                if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 10  # 递增等待时间
-                    logger.info(f"等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
+def upscale_image(image_data, backend=None, info=None, preview=False):
+    """超分处理入口：优先查缓存，未命中时预处理并调用指定后端
+
+    info 字典用于返回预处理指标、是否命中缓存等附加信息；preview 为 True 时先推送预览图。
+    """
+    backend = backend or get_backend()
+    info = info if info is not None else {}
+    cache_key, cached, fp = lookup_cached_result(image_data, backend, info)
+    if cached is not None:
+        return cached
+    if preview:
+        emit_preview(image_data, backend)
+
+    def compute():
+        prepared = prepare_input(image_data, backend, info)
+        threshold, tile_size = tile_limits(backend)
+        progress.emit('inference', model=backend.name)
+        with time_stage('inference'):
+            if should_tile(prepared, threshold):
+                # 大图 (超过模型单次输入上限) 切块并发推理，再羽化拼接
+                result = upscale_tiled(prepared, backend, tile_size=tile_size)
             else:
-                logger.error(f"HF API Error: {response.status_code} - {response.text}")
-                if attempt < max_retries - 1:
-                    time.sleep(5)  # 短暂等待后重试
-                    continue
-
-        except requests.exceptions.ConnectionError as e:
-            logger.error(f"连接错误 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 5
-                logger.info(f"等待 {wait_time} 秒后重试...")
-                time.sleep(wait_time)
-                continue
-        except requests.exceptions.Timeout as e:
-            logger.error(f"请求超时 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(10)
-                continue
-        except Exception as e:
-            logger.error(f"未知错误 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(5)
-                continue
+                result = backend.upscale(prepared)
+        if result:
+            store_result(cache_key, backend, fp, result)
+        return result
 
-    logger.error(f"所有 {max_retries} 次尝试都失败了")
-    return None
+    # 相同输入的并发请求只执行一次推理
+    upscaled_image, info['coalesced'] = singleflight.do(cache_key, compute)
+    return upscaled_image
+
+# 分块上传暂存在磁盘上
+upload_store = UploadStore()
+
+def run_job(payload, info):
+    info['model'] = payload['backend'].name
+    with bind_flow(payload.get('flow') or current_flow()):
+        preview = payload.get('preview', False)
+        if 'upload_id' not in payload:
+            return upscale_image(payload['image_data'], payload['backend'], info, preview)
+        # 分块上传的任务在开始执行时才从磁盘读取，排队期间不占用内存
+        try:
+            return upscale_image(upload_store.read(payload['upload_id']), payload['backend'], info, preview)
+        finally:
+            upload_store.discard(payload['upload_id'])
+
+# 按客户端限流（每张图片一个令牌）；上游调用的公平调度见 rate_limit.upstream_scheduler
+rate_limiter = create_rate_limiter()
+
+# 处理进度通道：任务与带 progress_id 的同步请求通过 SSE 推送处理阶段
+progress_registry = ProgressRegistry()
+
+# 异步任务默认在后台有界线程池中执行，避免阻塞请求线程；
+# JOB_BACKEND=sqlite 时写入持久化队列，由独立的 worker 进程 (worker.py) 执行
+if JOB_BACKEND == 'sqlite':
+    job_manager = DurableJobManager(create_job_queue(), create_job_storage())
+else:
+    job_manager = JobManager(run_job, progress_registry=progress_registry)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def read_uploaded_image():
+    """读取并校验上传的图片，返回 (图片字节, 错误响应)"""
+    # 首次访问 request.files 时才从连接读取并解析请求体
+    with time_stage('read'):
+        files = request.files
+    with time_stage('validate'):
+        image_data, error = validate_upload(files)
+    if image_data is not None:
+        BYTES.labels('in').inc(len(image_data))
+    return image_data, error
+
+def validate_upload(files, formats=None, read=True):
+    """校验上传的 image 字段，返回 (图片字节, 错误响应)；read 为 False 时返回文件流而不读入内存"""
+    # 检查是否有文件上传
+    if 'image' not in files:
+        return None, (jsonify({'error': 'No image file provided'}), 400)
+
+    file = files['image']
+    if file.filename == '':
+        return None, (jsonify({'error': 'No image selected'}), 400)
+
+    # 验证文件大小 (大图会分块处理，默认限制为20MB)
+    file.seek(0, os.SEEK_END)
+    file_length = file.tell()
+    file.seek(0)
+
+    if file_length > MAX_UPLOAD_MB * 1024 * 1024:
+        return None, (jsonify({'error': f'Image size too large. Maximum {MAX_UPLOAD_MB}MB allowed.'}), 400)
+
+    # 只解析文件头：格式或像素数不符合要求时不把请求体读入内存
+    try:
+        g.ingest = check_image(file.stream, formats=formats)
+    except IngestError as e:
+        return None, (jsonify({'error': str(e)}), e.status_code)
+
+    if not read:
+        return file.stream, None
+    # 读取图片（werkzeug 已把较大的上传暂存到磁盘，这里是唯一一次拷贝到内存）
+    return file.read(), None
+
+def detach_upload(file):
+    """取走上传文件的底层流，由调用方关闭
+
+    请求结束时 werkzeug 会关闭 request.files，而流式响应在那之后才读取这些文件。
+    """
+    stream = file.stream
+    file.stream = io.BytesIO()
+    return stream
+
+def resolve_backend(image_data=None):
+    """根据请求参数 model / backend / scale 选择推理后端，返回 (后端, 错误响应)
+
+    model=auto（或只指定 scale）时由路由按图片大小和各模型的实测耗时挑选，未指定 scale 时保持默认后端的倍数。
+    """
+    name = request.values.get('model') or request.values.get('backend')
+    scale = request.values.get('scale', type=int)
+
+    if name == AUTO or (name is None and scale):
+        # 没有指定放大倍数时保持默认后端的倍数，自动路由不应悄悄改变输出尺寸
+        scale = scale or get_backend().scale
+        size = image_size(image_data) if image_data else None
+        backend = model_router.choose(size[0] * size[1] if size else None, scale)
+        if backend is None:
+            return None, (jsonify({
+                'error': f'No model available for scale {scale}',
+                'available_scales': sorted({b.scale for b in model_router.backends})
+            }), 400)
+        return backend, None
+
+    backend = get_backend(name)
+    if backend is None:
+        return None, (jsonify({
+            'error': f'Unknown backend: {name}',
+            'available_backends': available_backends(),
+            'available_models': [spec.name for spec in MODEL_SPECS] + [AUTO]
+        }), 400)
+    if scale and backend.scale and backend.scale != scale:
+        return None, (jsonify({
+            'error': f'Model {backend.name} upscales by {backend.scale}x, not {scale}x'
+        }), 400)
+    return backend, None
+
+def check_output_size(image_data, backend):
+    """按文件头的尺寸检查放大后的像素数，超过拼接上限时在提交任何推理之前抛出 ImageTooLargeError (413)"""
+    size = image_size(image_data) if backend.scale else None
+    if size is None:
+        return
+    pixels = size[0] * size[1] * backend.scale ** 2
+    if PREPROCESS_ENABLED and PREPROCESS_MAX_OUTPUT_PIXELS:
+        # 预处理会先把输入缩小到这个输出像素数以内
+        pixels = min(pixels, PREPROCESS_MAX_OUTPUT_PIXELS)
+    check_output_pixels(pixels, backend.scale)
+
+# 常见图片格式的文件头
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+def sniff_mimetype(image_data):
+    """根据文件头判断图片的 MIME 类型"""
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if image_data[:len(signature)] == signature:
+            return mimetype
+    if image_data[:4] == b'RIFF' and image_data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+def wants_binary_response():
+    """客户端通过 response=binary 参数或 Accept: image/* 请求二进制结果"""
+    mode = request.args.get('response') or request.form.get('response')
+    if mode:
+        return mode == 'binary'
+    best = request.accept_mimetypes.best_match(['application/json', 'image/*'])
+    return best == 'image/*'
+
+def wants_preview():
+    return request.values.get('preview', '').lower() in ('1', 'true', 'yes')
+
+def negotiate_output():
+    """按 format / quality 参数和 Accept 请求头确定输出格式，返回 (格式名，保持原样时为 None, 质量)
+
+    参数无效时抛出 ValueError。JSON 模式下 Accept 是 application/json，只看 format 参数。
+    """
+    accept = request.accept_mimetypes if wants_binary_response() else None
+    return negotiate(request.values.get('format'), accept), parse_quality(request.values.get('quality'))
+
+def output_format_error():
+    """在开始处理之前校验输出格式参数，无效时返回 400 响应"""
+    try:
+        negotiate_output()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return None
+
+def encode_output(upscaled_image):
+    """按协商结果重新编码，返回 (图片字节, MIME 类型)"""
+    name, quality = negotiate_output()
+    if name is None:
+        return upscaled_image, sniff_mimetype(upscaled_image)
+    with time_stage('transcode'):
+        return output_encoder.encode(upscaled_image, name, quality)
+
+def upscale_response(upscaled_image, processing_time, info=None, encoded=None):
+    """构造超分结果响应：二进制模式直接返回图片字节，否则返回 JSON
+
+    encoded 为已经编码好的 (图片字节, MIME 类型)，异步模式在事件循环之外完成编码后传入。
+    """
+    encode_start = time.perf_counter()
+    progress.emit('encoding')
+    info = info or {}
+    if encoded is None:
+        try:
+            encoded = encode_output(upscaled_image)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    upscaled_image, mimetype = encoded
+
+    if wants_binary_response():
+        # 直接返回原始字节，不做 base64 编码和额外拷贝
+        response = Response(upscaled_image, mimetype=mimetype, direct_passthrough=True)
+        response.headers['Content-Length'] = str(len(upscaled_image))
+        response.headers['Vary'] = 'Accept'
+        response.headers['X-Processing-Time'] = f'{processing_time:.2f}'
+        response.headers['Server-Timing'] = f'upscale;dur={processing_time * 1000:.0f}'
+        response.headers['X-Cache'] = 'HIT' if info.get('cached') else 'MISS'
+        if 'preprocess' in info:
+            metrics = info['preprocess']
+            response.headers['X-Preprocess-Metrics'] = ', '.join(
+                f'{name}={metrics[name]}' for name in ('bytes_in', 'bytes_out', 'pixels_in', 'pixels_out')
+            )
+        return _observe_response(response, encode_start, len(upscaled_image))
+
+    # 将结果转换为base64编码以便前端显示
+    with time_stage('base64'):
+        encoded_image = base64.b64encode(upscaled_image).decode('utf-8')
+
+    data = {
+        'success': True,
+        'upscaled_image': f'data:{mimetype};base64,{encoded_image}',
+        'processing_time': round(processing_time, 2)
+    }
+    data.update(info)
+    with time_stage('serialize'):
+        response = jsonify(data)
+    return _observe_response(response, encode_start, len(upscaled_image))
+
+def _observe_response(response, encode_start, image_bytes):
+    """记录编码耗时，以及从响应构造完成到服务器写完响应体的耗时"""
+    write_start = time.perf_counter()
+    metrics.observe_stage('encode', write_start - encode_start)
+    BYTES.labels('out').inc(image_bytes)
+    response.call_on_close(lambda: metrics.observe_stage('write', time.perf_counter() - write_start))
+    return response
+
+def upstream_unavailable_response(error):
+    """上游熔断时快速失败，提示客户端稍后重试"""
+    response = jsonify({'error': 'Upscaling service is temporarily unavailable. Please retry later.'})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+def client_id():
+    """限流与公平调度使用的客户端标识：已配置的 API Key 按 Key，否则（包括未知的 Key）按来源 IP"""
+    api_key = request.headers.get('X-API-Key') or request.values.get('api_key')
+    if api_key:
+        digest = client_key_digest(api_key)
+        if rate_limiter.knows(digest):
+            return f"key:{digest}"
+    return f"ip:{request.remote_addr}"
+
+def request_flow(kind):
+    client = client_id()
+    return make_flow(client, kind, rate_limiter.weight(client))
+
+def rate_limited_response(error):
+    response = jsonify({'error': 'Too many requests. Please retry later.', 'retry_after': round(error.retry_after, 1)})
+    response.headers['Retry-After'] = error.retry_after_header
+    return response, 429
+
+def check_rate_limit(cost=1):
+    """扣除当前客户端的份额，超出时返回 429 响应"""
+    try:
+        rate_limiter.check(client_id(), cost)
+    except RateLimitedError as e:
+        return rate_limited_response(e)
+    return None
+
+def request_progress_id():
+    return request.headers.get('X-Progress-Id') or request.values.get('progress_id')
+
+def finish_progress(channel, response):
+    """根据响应状态发送结束事件"""
+    if channel is None:
+        return
+    if response.status_code < 400:
+        channel.emit(progress.DONE)
+    else:
+        data = response.get_json(silent=True) or {}
+        channel.emit(progress.FAILED, error=data.get('error'), status=response.status_code)
+
 @app.route('/upscale', methods=['POST'])
 def upscale():
+    """同步超分；带 progress_id 时可通过 /progress/<progress_id>/events 订阅处理进度"""
+    channel = progress_registry.get_or_create(request_progress_id())
+    with progress.bind(channel):
+        response = app.make_response(handle_upscale())
+    finish_progress(channel, response)
+    return response
+
+def handle_upscale():
     start_time = time.time()
+    error = check_rate_limit() or output_format_error()
+    if error:
+        return error
     try:
-        # 检查是否有文件上传
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
-        
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'error': 'No image selected'}), 400
-        
-        # 验证文件大小 (限制为5MB)
-        file.seek(0, os.SEEK_END)
-        file_length = file.tell()
-        file.seek(0)
-        
-        if file_length > 5 * 1024 * 1024:
-            return jsonify({'error': 'Image size too large. Maximum 5MB allowed.'}), 400
-        
-        # 读取图片
-        image_bytes = file.read()
+        image_bytes, error = read_uploaded_image()
+        if error:
+            ERRORS.labels('bad_request').inc()
+            return error
+        progress.emit('received', bytes=len(image_bytes))
+
+        backend, error = resolve_backend(image_bytes)
+        if error:
+            ERRORS.labels('bad_request').inc()
+            return error
+        check_output_size(image_bytes, backend)
         
-        # 调用Hugging Face API进行超分
-        upscaled_image = upscale_image_with_hf(image_bytes)
+        # 调用推理后端进行超分（带预处理和结果缓存）
+        info = {'model': backend.name}
+        with bind_flow(request_flow(INTERACTIVE)):
+            upscaled_image = upscale_image(image_bytes, backend, info, preview=wants_preview())
         
         if upscaled_image:
-            # 将结果转换为base64编码以便前端显示
-            encoded_image = base64.b64encode(upscaled_image).decode('utf-8')
-            
             processing_time = time.time() - start_time
             logger.info(f"Image upscaled successfully in {processing_time:.2f} seconds")
             
-            return jsonify({
-                'success': True,
-                'upscaled_image': f'image/jpeg;base64,{encoded_image}',
-                'processing_time': round(processing_time, 2)
-            })
+            return upscale_response(upscaled_image, processing_time, info)
         else:
+            ERRORS.labels('upscale_failed').inc()
             return jsonify({'error': 'Failed to upscale image. Please try again.'}), 500
             
+    except InvalidImageError as e:
+        ERRORS.labels('invalid_image').inc()
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+    except CircuitOpenError as e:
+        ERRORS.labels('circuit_open').inc()
+        return upstream_unavailable_response(e)
+    except RateLimitedError as e:
+        ERRORS.labels('rate_limited').inc()
+        return rate_limited_response(e)
     except Exception as e:
+        ERRORS.labels('internal').inc()
         logger.error(f"Error in upscale route: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/upscale/batch', methods=['POST'])
+def upscale_batch():
+    """批量超分：接收多张图片或 zip 包，并发处理并按完成顺序流式返回"""
+    backend, error = resolve_backend()
+    if error:
+        return error
+
+    max_item_bytes = MAX_UPLOAD_MB * 1024 * 1024
+    items = []
+    streams = []
+    archive = None
+
+    def release():
+        if archive is not None:
+            archive.close()
+        for stream in streams:
+            stream.close()
+
+    try:
+        for file in request.files.getlist('images'):
+            if file.filename == '':
+                continue
+            # 与 validate_upload 一样先按流的长度检查大小；内容在工作线程处理这一项时才读入内存
+            file.seek(0, os.SEEK_END)
+            file_length = file.tell()
+            file.seek(0)
+            if file_length > max_item_bytes:
+                raise BatchError(f'Image {file.filename} is too large. Maximum {MAX_UPLOAD_MB}MB allowed.')
+            streams.append(detach_upload(file))
+            items.append((file.filename, streams[-1].read))
+        if 'archive' in request.files:
+            streams.append(detach_upload(request.files['archive']))
+            archive, entries = read_zip_items(streams[-1], max_item_bytes=max_item_bytes)
+            items.extend(entries)
+        if len(items) > BATCH_MAX_ITEMS:
+            raise BatchError(f'Too many images. Maximum {BATCH_MAX_ITEMS} allowed.')
+    except BatchError as e:
+        release()
+        return jsonify({'error': str(e)}), 400
+
+    if not items:
+        return jsonify({'error': 'No image file provided'}), 400
+    error = check_rate_limit(len(items))
+    if error:
+        release()
+        return error
+
+    concurrency = min(request.values.get('concurrency', BATCH_CONCURRENCY, type=int) or 1, BATCH_CONCURRENCY)
+    logger.info(f"批量超分: {len(items)} 张图片, 并发数 {concurrency}")
+    flow = request_flow(BATCH)
+
+    def run_item(image_data, info):
+        # 先按文件头校验（无效或超大的图片只让这一项失败），再在请求的调度流中处理
+        check_image(image_data)
+        with bind_flow(flow):
+            return upscale_image(image_data, backend, info)
+
+    def run():
+        try:
+            yield from run_batch(items, run_item, concurrency)
+        finally:
+            release()
+
+    results = run()
+
+    if request.values.get('format') == 'zip':
+        response = Response(zip_stream(results, sniff_mimetype), mimetype='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=upscaled.zip'
+        return response
+    return Response(ndjson_stream(results, sniff_mimetype), mimetype='application/x-ndjson')
+
+@app.route('/upscale/animation', methods=['POST'])
+def upscale_animated():
+    """动图 (GIF / WebP) 超分；带 progress_id 时可订阅逐帧进度"""
+    channel = progress_registry.get_or_create(request_progress_id())
+    with progress.bind(channel):
+        response = app.make_response(handle_upscale_animation())
+    finish_progress(channel, response)
+    return response
+
+def handle_upscale_animation():
+    start_time = time.time()
+    output_format = (request.values.get('format') or '').upper() or None
+    if output_format is not None and output_format not in ANIMATION_FORMATS:
+        return jsonify({'error': 'format must be one of: gif, webp'}), 400
+
+    stream, error = validate_upload(request.files, formats=ANIMATION_FORMATS, read=False)
+    if error:
+        ERRORS.labels('bad_request').inc()
+        return error
+    backend, error = resolve_backend()
+    if error:
+        ERRORS.labels('bad_request').inc()
+        return error
+
+    # 提交任何推理之前按文件头的帧数检查上限并扣除份额：每一帧都可能是一次上游调用，与批量接口按图片数计一致
+    try:
+        _, frames, width, height = probe(stream)
+        check_limits(frames, width, height, backend.scale)
+    except IngestError as e:
+        ERRORS.labels('bad_request').inc()
+        return jsonify({'error': str(e)}), e.status_code
+    error = check_rate_limit(frames)
+    if error:
+        return error
+
+    concurrency = min(request.values.get('concurrency', ANIMATION_CONCURRENCY, type=int) or 1, ANIMATION_CONCURRENCY)
+    flow = request_flow(BATCH)
+
+    def run_frame(frame_data):
+        # 每个唯一帧走普通的超分流程（缓存、预处理、分块都适用）
+        with bind_flow(flow):
+            return upscale_image(frame_data, backend, {})
+
+    try:
+        output, stats = upscale_animation(stream, run_frame, output_format, concurrency=concurrency)
+    except InvalidImageError as e:
+        ERRORS.labels('invalid_image').inc()
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+    except CircuitOpenError as e:
+        ERRORS.labels('circuit_open').inc()
+        return upstream_unavailable_response(e)
+    except RateLimitedError as e:
+        ERRORS.labels('rate_limited').inc()
+        return rate_limited_response(e)
+    except Exception as e:
+        ERRORS.labels('internal').inc()
+        logger.error(f"Error in animation route: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+    if output is None:
+        ERRORS.labels('upscale_failed').inc()
+        return jsonify({'error': 'Failed to upscale image. Please try again.'}), 500
+
+    processing_time = time.time() - start_time
+    logger.info(f"动图超分完成: {stats['frames']} 帧 ({stats['unique_frames']} 个唯一帧), 耗时 {processing_time:.2f} 秒")
+    fmt = stats['format'].upper()
+    response = send_file(output, mimetype=MIMETYPES[fmt], download_name=f"upscaled.{stats['format']}")
+    response.headers['X-Frames'] = str(stats['frames'])
+    response.headers['X-Unique-Frames'] = str(stats['unique_frames'])
+    response.headers['X-Processing-Time'] = f'{processing_time:.2f}'
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """提交异步超分任务，立即返回任务ID"""
+    error = check_rate_limit()
+    if error:
+        return error
+    image_bytes, error = read_uploaded_image()
+    if error:
+        return error
+
+    backend, error = resolve_backend(image_bytes)
+    if error:
+        return error
+    try:
+        check_output_size(image_bytes, backend)
+    except IngestError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+    return enqueue_job({
+        'image_data': image_bytes, 'backend': backend, 'flow': request_flow(BATCH), 'preview': wants_preview(),
+    })
+
+def enqueue_job(payload):
+    """提交任务并返回 202 响应；队列满时返回 429"""
+    try:
+        job = job_manager.submit(payload)
+    except QueueFullError as e:
+        response = jsonify({'error': 'Server is busy. Please retry later.'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    return jsonify(job_links(job.to_dict())), 202
+
+def job_links(data):
+    """在任务信息中加入状态、结果和事件地址"""
+    data['status_url'] = url_for('job_status', job_id=data['job_id'])
+    data['result_url'] = url_for('job_result', job_id=data['job_id'])
+    if EVENTS_ADVERTISED:
+        data['events_url'] = url_for('job_events', job_id=data['job_id'])
+    return data
+
+# SSE 订阅在 WSGI 模式下会一直占用一个请求线程 (默认部署每个 worker 只有 GUNICORN_THREADS 个)，
+# 因此只在 ASGI 模式 (asgi.py 开启) 下向客户端提供 events_url，前端没有该地址时轮询任务状态；
+# 直接访问 WSGI 的事件接口时每个响应最多持续 SSE_MAX_SECONDS，之后由浏览器重连
+EVENTS_ADVERTISED = False
+
+def progress_events_response(channel):
+    """SSE 响应；客户端断线重连时带 Last-Event-ID 从断点继续"""
+    last_id = request.headers.get('Last-Event-ID', 0, type=int)
+    response = Response(sse_stream(channel, last_id, max_seconds=progress.SSE_MAX_SECONDS),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁止反向代理缓冲事件
+    return response
+
+def durable_events_stream(job_id, last_id=0):
+    """持久化任务的 SSE：worker 在其他进程中执行，通过轮询队列中的状态和最新阶段生成事件"""
+    yield 'retry: 2000\n\n'
+    idle_since = time.monotonic()
+    for event in job_manager.poll_events(job_id, timeout=progress.SSE_MAX_SECONDS):
+        if event is None:
+            if time.monotonic() - idle_since >= progress.SSE_HEARTBEAT:
+                idle_since = time.monotonic()
+                yield ': keep-alive\n\n'
+            continue
+        idle_since = time.monotonic()
+        if event['id'] > last_id:
+            yield progress.format_event(event)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """任务处理进度 (SSE)：queued、started、attempt、model_loading、tile、encoding、done / failed"""
+    if job_manager.durable:
+        if job_manager.get(job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+        last_id = request.headers.get('Last-Event-ID', 0, type=int)
+        response = Response(durable_events_stream(job_id, last_id), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    channel = progress_registry.get(job_id)
+    if channel is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return progress_events_response(channel)
+
+@app.route('/progress/<progress_id>/events')
+def progress_events(progress_id):
+    """同步请求的处理进度 (SSE)，可以在提交 /upscale 之前订阅"""
+    if not progress.valid_id(progress_id):
+        return jsonify({'error': 'Invalid progress id'}), 400
+    channel = progress_registry.subscribe(progress_id)
+    if channel is None:
+        return too_many_subscriptions_response()
+    return progress_events_response(channel)
+
+def too_many_subscriptions_response():
+    response = jsonify({'error': 'Too many pending progress subscriptions. Submit the request first or retry later.'})
+    response.headers['Retry-After'] = str(progress_registry.pending_ttl)
+    return response, 429
+
+def upload_error_response(error):
+    response = jsonify({'error': str(error)})
+    if isinstance(error, OffsetMismatchError):
+        response.headers['Upload-Offset'] = str(error.offset)
+    return response, error.status_code
+
+def upload_status_response(status, code=200):
+    response = jsonify(status)
+    response.status_code = code
+    response.headers['Upload-Offset'] = str(status['offset'])
+    response.headers['Upload-Length'] = str(status['size'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """创建分块上传会话：参数 size (字节数)，可选 filename、sha256 (整个文件的校验)"""
+    params = request.get_json(silent=True) or request.values
+    try:
+        size = int(params.get('size', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size must be an integer'}), 400
+    try:
+        status = upload_store.create(size, params.get('filename'), params.get('sha256'))
+    except UploadError as e:
+        return upload_error_response(e)
+    status['upload_url'] = url_for('upload_chunk', upload_id=status['upload_id'])
+    status['chunk_size'] = upload_store.chunk_max_bytes
+    return upload_status_response(status, 201)
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def upload_status(upload_id):
+    """查询已接收的字节数 (Upload-Offset)，用于断线后续传"""
+    try:
+        return upload_status_response(upload_store.status(upload_id))
+    except UploadError as e:
+        return upload_error_response(e)
+
+@app.route('/uploads/<upload_id>', methods=['PATCH'])
+def upload_chunk(upload_id):
+    """追加一个分块：请求头 Upload-Offset 为写入位置，可选 X-Chunk-SHA256 为本块的校验"""
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Upload-Offset header is required'}), 400
+    try:
+        # 请求体边读边写入磁盘，不整体读入内存
+        new_offset = upload_store.append(
+            upload_id, offset, request.stream, request.content_length,
+            checksum=request.headers.get('X-Chunk-SHA256'),
+        )
+    except UploadError as e:
+        return upload_error_response(e)
+    BYTES.labels('in').inc(new_offset - offset)
+    response = Response(status=204)
+    response.headers['Upload-Offset'] = str(new_offset)
+    return response
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """校验上传完整性并提交超分任务，参数与 /jobs 相同 (backend / model / scale)
+
+    重复调用 (例如客户端没收到响应而重试) 不会再次提交，返回第一次提交的任务。
+    """
+    try:
+        job_id = upload_store.claim_submission(upload_id)
+    except UploadError as e:
+        return upload_error_response(e)
+    if job_id == '':
+        return jsonify({'error': 'Upload is already being submitted'}), 409
+    if job_id is not None:
+        job = job_manager.get(job_id)
+        return jsonify(job_links(job.to_dict() if job else {'job_id': job_id})), 200
+
+    response, status = submit_upload(upload_id)
+    if status == 202:
+        upload_store.record_submission(upload_id, response.get_json()['job_id'])
+    else:
+        upload_store.release_submission(upload_id)
+    return response, status
+
+def submit_upload(upload_id):
+    error = check_rate_limit()
+    if error:
+        return error
+    try:
+        upload_store.complete(upload_id)
+        check_file(upload_store.data_path(upload_id))
+        head = upload_store.head(upload_id)
+        backend, error = resolve_backend(head)
+        if error is None:
+            check_output_size(head, backend)
+    except UploadError as e:
+        return upload_error_response(e)
+    except IngestError as e:
+        # 不是可处理的图片，保留也没有用
+        upload_store.discard(upload_id)
+        return jsonify({'error': str(e)}), e.status_code
+    if error:
+        return error
+    if not job_manager.durable:
+        return enqueue_job({
+            'upload_id': upload_id, 'backend': backend, 'flow': request_flow(BATCH), 'preview': wants_preview(),
+        })
+    # 持久化队列：数据文件直接移入共享存储，worker 可能在其他机器上
+    response, status = enqueue_job({
+        'image_path': upload_store.data_path(upload_id), 'backend': backend, 'flow': request_flow(BATCH),
+    })
+    if status == 202:
+        upload_store.discard(upload_id)
+    return response, status
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job.done:
+        return jsonify({'error': 'Job not finished', 'status': job.status}), 409
+    if job.status == FAILED:
+        return jsonify({'error': job.error}), 500
+    return upscale_response(job.result, job.finished_at - job.created_at, job.info)
+
+# 接收图片的路由，统计输入尺寸和峰值内存
+INGEST_ENDPOINTS = {'upscale', 'upscale_batch', 'upscale_animated', 'submit_job', 'complete_upload'}
+
+def report_ingest(endpoint, probe):
+    """记录请求的输入图片和峰值内存"""
+    peak = probe.peak()
+    if peak is not None:
+        PEAK_MEMORY_BYTES.labels(endpoint).observe(peak)
+    header = g.get('ingest')
+    if header is None and peak is None:
+        return
+    parts = []
+    if header is not None:
+        parts.append(f"输入 {header.format} {header.width}x{header.height} (解码约 {header.decoded_bytes / 1048576:.1f}MB)")
+    if peak is not None:
+        parts.append(f"堆峰值 {peak / 1048576:.1f}MB")
+    rss = process_peak_rss()
+    if rss is not None:
+        parts.append(f"进程 RSS 高水位 {rss / 1048576:.0f}MB")
+    logger.info(f"{endpoint}: " + ', '.join(parts))
+
+# 请求分析：阶段耗时分解和慢请求采样，可通过 /admin/profiling 在运行时开关
+profiler = Profiler()
+PROFILE_ENDPOINTS = INGEST_ENDPOINTS | {'job_result'}
+
+@app.before_request
+def track_request_start():
+    if not _background_started:
+        # 未通过 create_app / post_fork 启动的进程 (如 gunicorn app:app) 在第一个请求时补上
+        start_background_tasks()
+    g.request_start = time.perf_counter()
+    metrics.IN_FLIGHT.labels(request.endpoint or 'unknown').inc()
+    if request.endpoint in INGEST_ENDPOINTS:
+        g.memory_probe = MemoryProbe()
+    if request.endpoint in PROFILE_ENDPOINTS:
+        g.profile = profiler.begin(request.endpoint)
+
+@app.after_request
+def track_request_end(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.REQUESTS.labels(endpoint, response.status_code).inc()
+    if 'request_start' in g:
+        metrics.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    if 'memory_probe' in g:
+        report_ingest(endpoint, g.memory_probe)
+    if g.get('profile') is not None:
+        timing = g.profile.timer.server_timing()
+        if timing:
+            existing = response.headers.get('Server-Timing')
+            response.headers['Server-Timing'] = f'{existing}, {timing}' if existing else timing
+    return response
+
+@app.teardown_request
+def track_request_teardown(exc):
+    if 'memory_probe' in g:
+        # 请求异常结束、没有经过 after_request 时也要让出内存跟踪
+        g.memory_probe.close()
+    if 'request_start' in g:
+        metrics.IN_FLIGHT.labels(request.endpoint or 'unknown').dec()
+    if g.get('profile') is not None:
+        profiler.end(g.pop('profile'))
+
+def collect_runtime_metrics():
+    """/metrics 抓取时读取各模块已有的统计快照"""
+    retries, breakers = [], []
+    for name in available_backends():
+        backend_stats = get_backend(name).stats()
+        if 'retry' in backend_stats:
+            retries.extend(({'backend': name, 'event': event}, value)
+                           for event, value in backend_stats['retry'].items() if event != 'backoff_seconds')
+            breakers.append(({'backend': name}, int(backend_stats['breaker']['state'] != 'closed')))
+    cache = result_cache.stats()
+    flight = singleflight.snapshot()
+    pool = get_inference_client().stats()
+    queue = job_manager.stats()
+    return [
+        ('upstream_retry_events_total', 'counter', 'Retry engine events (attempts, retries, failures, ...)', retries),
+        ('upstream_circuit_open', 'gauge', 'Whether the circuit breaker is open or half-open', breakers),
+        metrics.counters_from_snapshot('result_cache_events_total', 'Result cache lookups and stores',
+                                       cache, 'event', ('memory_hits', 'disk_hits', 'misses', 'stores')),
+        metrics.counters_from_snapshot('singleflight_events_total', 'Coalesced identical requests',
+                                       flight, 'event', ('leaders', 'coalesced', 'leader_failures')),
+        metrics.counters_from_snapshot('inference_pool_events_total', 'Inference HTTP connection pool checkouts',
+                                       pool, 'event', ('hits', 'misses')),
+        ('jobs_pending', 'gauge', 'Queued and running async jobs', [({}, queue['pending'])]),
+        ('process_peak_rss_bytes', 'gauge', 'Peak resident set size of this process',
+         [({}, rss)] if (rss := process_peak_rss()) is not None else []),
+    ]
+
+metrics.REGISTRY.register_collector(collect_runtime_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 文本格式的指标"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/health')
 def health_check():
-    return jsonify({
+    """存活检查；带 ?ready=1 时作为就绪检查，模型未预热好返回 503"""
+    model = warmup.snapshot()
+    payload = {
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'model': model
+    }
+    # 未启用预热时无法判断模型状态，不阻塞流量
+    if request.args.get('ready') and warmup.running and not model['ready']:
+        payload['status'] = 'warming'
+        return jsonify(payload), 503
+    return jsonify(payload)
+
+@app.route('/stats')
+def stats():
+    """运行时统计信息"""
+    return jsonify({
+        'inference_client': get_inference_client().stats(),
+        'jobs': job_manager.stats(),
+        'result_cache': result_cache.stats(),
+        'near_duplicate': near_index.stats(),
+        'singleflight': singleflight.snapshot(),
+        'router': model_router.snapshot(),
+        'rate_limit': {'clients': rate_limiter.stats(), 'upstream': upstream_scheduler.stats()},
+        'encoder': output_encoder.stats(),
+        'profiling': profiler.snapshot(),
+        'backends': {name: get_backend(name).stats() for name in available_backends()}
     })
 
+def admin_error():
+    """管理接口的鉴权：未配置 ADMIN_TOKEN 时不暴露接口"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    return None
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """查看或修改请求分析设置：enabled (true/false)、mode (stack / cprofile)、slow_ms；返回设置和已写入的采样文件"""
+    error = admin_error()
+    if error:
+        return error
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or request.values
+        enabled, slow_ms = params.get('enabled'), params.get('slow_ms')
+        if isinstance(enabled, str):
+            enabled = enabled.lower() in ('1', 'true', 'yes', 'on')
+        try:
+            if slow_ms is not None:
+                slow_ms = int(slow_ms)
+            profiler.update(enabled=enabled, mode=params.get('mode'), slow_ms=slow_ms)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify({'settings': profiler.snapshot(), 'files': profiler.list_files()})
+
+@app.route('/admin/profiling/<name>')
+def admin_profile_file(name):
+    """下载一个采样文件"""
+    error = admin_error()
+    if error:
+        return error
+    if name not in {entry['name'] for entry in profiler.list_files()}:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_from_directory(profiler.directory, name, as_attachment=True)
+
 @app.route('/info')
 def info():
     return jsonify({
         'app_name': 'AI Super Resolution',
         'description': 'Image upscaling using Hugging Face AI models',
-        'model': 'microsoft/swin2SR-classical-sr-x2-64'
+        'model': get_backend('hf').model_name,
+        'models': [spec.to_dict() for spec in MODEL_SPECS],
+        'backends': available_backends(),
+        'max_upload_mb': MAX_UPLOAD_MB,
+        'max_chunked_upload_mb': upload_store.max_bytes // (1024 * 1024),
+        'chunk_size': upload_store.chunk_max_bytes,
+        'rate_limit': rate_limiter.stats(),
+        'output_formats': output_encoder.stats()['formats'],
+        'default_backend': get_backend().name
     })
 
 @app.route('/test-api')
 def test_api():
-    """测试Hugging Face API连接"""
+    """测试Hugging Face API连接，可用 ?model= 指定要探测的模型"""
+    backend = get_backend(request.args.get('model') or 'hf')
+    if not isinstance(backend, HFBackend):
+        return jsonify({'error': 'Unknown model', 'available_models': [spec.name for spec in MODEL_SPECS]}), 400
     try:
-        import requests
         headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
 
         # 简单的GET请求测试API连接
-        response = requests.get(
-            "https://api-inference.huggingface.co/models/microsoft/swin2SR-classical-sr-x2-64",
+        response = get_inference_client().get(
+            backend.api_url,
             headers=headers,
             timeout=10
         )
 
         return jsonify({
             'api_status': 'connected',
+            'model': backend.model_name,
             'status_code': response.status_code,
             'token_valid': bool(HF_API_TOKEN),
             'response_headers': dict(response.headers)
@@ -184,7 +1089,48 @@ def test_api():
             'token_valid': bool(HF_API_TOKEN)
         }), 500
 
+# 进程启动
+#
+# 导入本模块时只创建对象：不启动线程、不打开 SQLite 连接和推理连接池、不扫描磁盘缓存，
+# 因此可以在 gunicorn master 中预加载 (见 gunicorn.conf.py)，fork 出的 worker 以写时复制的方式
+# 共用已导入的模块和只读状态，后台线程在各 worker 进程中启动。
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_tasks():
+    """启动当前进程的后台任务 (模型预热)，可重复调用，并发的首批请求只会启动一次"""
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    if WARMUP_ENABLED and HF_API_TOKEN:
+        warmup.start()
+
+def preload_shared_state():
+    """fork 之前执行一次：导入首次推理才会用到的依赖，注册图片格式插件，加载磁盘缓存索引"""
+    start = time.perf_counter()
+    import requests  # noqa: F401  推理客户端首次创建时才导入
+    Image.init()
+    result_cache.load_index()
+    # 预加载的对象不再参与垃圾回收的扫描，避免 worker 中的 GC 改写这些页面、破坏写时复制
+    gc.freeze()
+    logger.info(f"预加载完成，耗时 {time.perf_counter() - start:.2f}s")
+
+def create_app(preload=False):
+    """应用工厂，返回 WSGI 应用
+
+    preload=True 用于 gunicorn 预加载：在 master 中完成耗时的导入和加载，后台任务由 post_fork 在各 worker 中启动；
+    否则在当前进程直接启动后台任务。
+    """
+    if preload:
+        preload_shared_state()
+    else:
+        start_background_tasks()
+    return app
+
 if __name__ == '__main__':
     # Render部署配置
     port = int(os.environ.get('PORT', 5001))
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,381 @@
+# asgi.py - 异步 (ASGI) 服务模式
+#
+# 启动方式: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+#
+# POST /upscale 由异步处理函数直接处理：远程推理使用 httpx 异步连接池，
+# 重试等待使用 asyncio.sleep，等待期间不占用线程，单个进程可以同时挂起大量请求。
+# 进度事件流 (SSE) 也由异步代码直接推送，长时间挂起的订阅不占用线程。
+# 其余路由 (/、/health、/info、/jobs 等) 通过 WSGI 适配器交给原 Flask 应用处理。
+
+import re
+import json
+import time
+import tempfile
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import jsonify
+
+import app as flask_module
+from inference_client import close_async_inference_client
+from metrics import ERRORS, IN_FLIGHT, REQUESTS, REQUEST_SECONDS, observe_stage
+import progress
+from ingest import MemoryProbe
+from preprocess import InvalidImageError
+from rate_limit import INTERACTIVE, RateLimitedError, bind_flow
+from singleflight import AsyncSingleFlight
+from retry_policy import CircuitOpenError
+from tiling import should_tile, tile_limits, upscale_tiled
+
+logger = logging.getLogger(__name__)
+
+flask_app = flask_module.app
+
+# 与同步模式共用合并计数
+async_singleflight = AsyncSingleFlight(stats=flask_module.singleflight.stats)
+
+# 允许的请求体大小：图片上限再加上 multipart 表单的开销
+MAX_REQUEST_BYTES = flask_module.MAX_UPLOAD_MB * 1024 * 1024 + 64 * 1024
+# 请求体超过该大小时暂存到磁盘，而不是拼接成一整块内存
+SPOOL_MAX_BYTES = 1024 * 1024
+
+
+class _ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # asgiref 默认把所有 WSGI 调用放在同一个线程里串行执行，这里改为使用线程池
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False
+    )
+
+
+class _ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _ThreadedWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(
+            scope, receive, send
+        )
+
+
+wsgi_app = _ThreadedWsgiToAsgi(flask_app)
+
+# 进度订阅在这里以协程处理，不占用线程，可以向客户端提供 events_url
+flask_module.EVENTS_ADVERTISED = True
+
+
+async def upscale_image_async(image_data, backend, info, preview=False):
+    """upscale_image 的异步版本：远程推理不阻塞线程，CPU 密集步骤放到线程池"""
+    cache_key, cached, fp = await asyncio.to_thread(flask_module.lookup_cached_result, image_data, backend, info)
+    if cached is not None:
+        return cached
+    if preview:
+        await asyncio.to_thread(flask_module.emit_preview, image_data, backend)
+
+    async def compute():
+        prepared = await asyncio.to_thread(flask_module.prepare_input, image_data, backend, info)
+        inference_start = time.perf_counter()
+        threshold, tile_size = tile_limits(backend)
+        progress.emit('inference', model=backend.name)
+        if should_tile(prepared, threshold):
+            result = await asyncio.to_thread(upscale_tiled, prepared, backend, tile_size)
+        elif hasattr(backend, 'upscale_async'):
+            result = await backend.upscale_async(prepared)
+        else:
+            result = await asyncio.to_thread(backend.upscale, prepared)
+        observe_stage('inference', time.perf_counter() - inference_start)
+        if result:
+            await asyncio.to_thread(flask_module.store_result, cache_key, backend, fp, result)
+        return result
+
+    # 相同输入的并发请求只执行一次推理
+    upscaled_image, info['coalesced'] = await async_singleflight.do(cache_key, compute)
+    return upscaled_image
+
+
+async def upscale_view():
+    """异步版本的 /upscale，在 Flask 请求上下文中执行以复用校验和响应构造逻辑"""
+    start_time = time.time()
+    error = flask_module.check_rate_limit() or flask_module.output_format_error()
+    if error:
+        return error
+    try:
+        # multipart 解析、文件头校验、自动路由的解码和响应编码都是阻塞的 CPU / IO 操作，放到线程池中执行；
+        # asyncio.to_thread 会复制当前上下文，线程中同样可以使用 Flask 的请求上下文
+        image_bytes, error = await asyncio.to_thread(flask_module.read_uploaded_image)
+        if error:
+            ERRORS.labels('bad_request').inc()
+            return error
+        progress.emit('received', bytes=len(image_bytes))
+
+        backend, error = await asyncio.to_thread(flask_module.resolve_backend, image_bytes)
+        if error:
+            ERRORS.labels('bad_request').inc()
+            return error
+        flask_module.check_output_size(image_bytes, backend)
+
+        info = {'model': backend.name}
+        with bind_flow(flask_module.request_flow(INTERACTIVE)):
+            upscaled_image = await upscale_image_async(image_bytes, backend, info, flask_module.wants_preview())
+
+        if upscaled_image:
+            processing_time = time.time() - start_time
+            logger.info(f"Image upscaled successfully in {processing_time:.2f} seconds")
+            # 在编码线程池中完成编码，不阻塞事件循环
+            name, quality = flask_module.negotiate_output()
+            if name is None:
+                encoded = upscaled_image, flask_module.sniff_mimetype(upscaled_image)
+            else:
+                encoded = await flask_module.output_encoder.encode_async(upscaled_image, name, quality)
+            return await asyncio.to_thread(flask_module.upscale_response, upscaled_image, processing_time, info, encoded)
+        ERRORS.labels('upscale_failed').inc()
+        return jsonify({'error': 'Failed to upscale image. Please try again.'}), 500
+
+    except InvalidImageError as e:
+        ERRORS.labels('invalid_image').inc()
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+    except CircuitOpenError as e:
+        ERRORS.labels('circuit_open').inc()
+        return flask_module.upstream_unavailable_response(e)
+    except RateLimitedError as e:
+        ERRORS.labels('rate_limited').inc()
+        return flask_module.rate_limited_response(e)
+    except Exception as e:
+        ERRORS.labels('internal').inc()
+        logger.error(f"Error in async upscale route: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+async def _read_body(receive, limit):
+    """边接收边写入临时文件（小请求留在内存），返回定位到开头的文件对象；客户端断开时返回 None
+
+    没有 Content-Length (分块传输) 的请求在累计超过 limit 时抛出 _BodyTooLarge。
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    received = 0
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if received > limit:
+                raise _BodyTooLarge()
+            if received > SPOOL_MAX_BYTES:
+                # 超过阈值后写入的是磁盘文件，放到线程池中避免阻塞事件循环
+                await asyncio.to_thread(body.write, chunk)
+            else:
+                body.write(chunk)
+            if not message.get('more_body'):
+                body.seek(0)
+                return body
+    except BaseException:
+        body.close()
+        raise
+
+
+async def _send_response(send, response):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()],
+    })
+    for chunk in response.iter_encoded():
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+# 原生路由不经过 app.wsgi_app，同样按可信代理层数改写 environ
+_proxy_fix = flask_module.proxy_fix(lambda environ, start_response: environ)
+
+
+def _build_environ(scope, body):
+    instance = WsgiToAsgiInstance(None)
+    instance.scope = scope
+    return _proxy_fix(instance.build_environ(scope, body), None)
+
+
+def _content_length(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def handle_upscale(scope, receive, send):
+    # 原生处理的路由不经过 Flask 的请求钩子，这里自行记录请求指标
+    start = time.perf_counter()
+    IN_FLIGHT.labels('upscale').inc()
+    try:
+        status = await _handle_upscale(scope, receive, send)
+    finally:
+        IN_FLIGHT.labels('upscale').dec()
+    if status is not None:
+        REQUESTS.labels('upscale', status).inc()
+        REQUEST_SECONDS.labels('upscale').observe(time.perf_counter() - start)
+
+
+async def _send_too_large(send):
+    with flask_app.app_context():
+        response = flask_app.make_response((jsonify({
+            'error': f'Image size too large. Maximum {flask_module.MAX_UPLOAD_MB}MB allowed.'
+        }), 413))
+    await _send_response(send, response)
+    return response.status_code
+
+
+async def _handle_upscale(scope, receive, send):
+    # 过大的请求直接拒绝：声明了 Content-Length 的在读取前检查，分块传输的在累计超过上限时停止读取
+    content_length = _content_length(scope)
+    if content_length is not None and content_length > MAX_REQUEST_BYTES:
+        return await _send_too_large(send)
+
+    probe = MemoryProbe()
+    receive_start = time.perf_counter()
+    try:
+        body = await _read_body(receive, MAX_REQUEST_BYTES)
+    except _BodyTooLarge:
+        probe.close()
+        return await _send_too_large(send)
+    if body is None:
+        probe.close()
+        return None
+    observe_stage('receive', time.perf_counter() - receive_start)
+
+    environ = _build_environ(scope, body)
+    # Flask 的请求上下文基于 contextvars，每个协程任务互不影响
+    try:
+        with flask_app.request_context(environ):
+            channel = flask_module.progress_registry.get_or_create(flask_module.request_progress_id())
+            with progress.bind(channel):
+                result = await upscale_view()
+            response = flask_app.make_response(result)
+            flask_module.finish_progress(channel, response)
+            flask_module.report_ingest('upscale', probe)
+    finally:
+        probe.close()
+        body.close()
+    try:
+        await _send_response(send, response)
+    finally:
+        response.close()  # 触发 call_on_close，记录 write 阶段耗时
+    return response.status_code
+
+
+_EVENTS_PATH = re.compile(r'^/(jobs|progress)/([^/]+)/events$')
+_EVENTS_POLL_INTERVAL = 0.25
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def _send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def handle_events(scope, receive, send, kind, channel_id):
+    """异步推送进度事件：轮询通道而不是阻塞等待，订阅期间不占用线程"""
+    registry = flask_module.progress_registry
+    if kind == 'jobs':
+        channel = registry.get(channel_id)
+        if channel is None:
+            await _send_json(send, 404, {'error': 'Job not found'})
+            return
+    elif not progress.valid_id(channel_id):
+        await _send_json(send, 400, {'error': 'Invalid progress id'})
+        return
+    else:
+        channel = registry.subscribe(channel_id)
+        if channel is None:
+            await _send_json(send, 429, {
+                'error': 'Too many pending progress subscriptions. Submit the request first or retry later.'
+            }, [(b'retry-after', str(registry.pending_ttl).encode())])
+            return
+
+    try:
+        last_id = int(_header(scope, b'last-event-id') or 0)
+    except ValueError:
+        last_id = 0
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': b'retry: 2000\n\n', 'more_body': True})
+
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    idle = 0.0
+    try:
+        while not disconnected.done():
+            events = channel.events_after(last_id)
+            for event in events:
+                last_id = event['id']
+                await send({'type': 'http.response.body', 'body': progress.format_event(event).encode('utf-8'),
+                            'more_body': True})
+            if channel.closed and not channel.events_after(last_id):
+                break
+            if events:
+                idle = 0.0
+                continue
+            await asyncio.sleep(_EVENTS_POLL_INTERVAL)
+            idle += _EVENTS_POLL_INTERVAL
+            if idle >= progress.SSE_HEARTBEAT:
+                idle = 0.0
+                await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            flask_module.start_background_tasks()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_inference_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/upscale' and scope['method'] == 'POST':
+        await handle_upscale(scope, receive, send)
+    elif scope['type'] == 'http' and scope['method'] == 'GET' and _EVENTS_PATH.match(scope['path']):
+        kind, channel_id = _EVENTS_PATH.match(scope['path']).groups()
+        if kind == 'jobs' and flask_module.job_manager.durable:
+            # 持久化任务的进度需要轮询队列，交给 Flask 路由处理
+            await wsgi_app(scope, receive, send)
+        else:
+            await handle_events(scope, receive, send, kind, channel_id)
+    else:
+        await wsgi_app(scope, receive, send)
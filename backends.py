@@ -0,0 +1,391 @@
+# backends.py - 可插拔的超分推理后端
+#
+# hf    : 远程 Hugging Face Inference API（原有行为）
+# local : 本地 CPU 经典插值放大（Lanczos/Bicubic + 锐化），不依赖网络
+
+import io
+import os
+import json
+import time
+import threading
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from PIL import Image, ImageFilter
+
+import progress
+from inference_client import get_inference_client, get_async_inference_client
+from metrics import UPSTREAM_ATTEMPT_SECONDS, UPSTREAM_RESPONSES
+from rate_limit import RateLimitedError, upstream_scheduler
+from retry_policy import (
+    RETRY_MAX_ATTEMPTS, CircuitBreaker, Outcome, RetryMetrics, RetryPolicy,
+    call_with_retry, call_with_retry_async, parse_retry_after,
+)
+
+logger = logging.getLogger(__name__)
+
+UPSCALE_BACKEND = os.getenv("UPSCALE_BACKEND", "hf")                           # 默认后端
+LOCAL_UPSCALE_SCALE = int(os.getenv("LOCAL_UPSCALE_SCALE", "4"))               # 本地放大倍数
+LOCAL_MAX_OUTPUT_PIXELS = int(os.getenv("LOCAL_MAX_OUTPUT_PIXELS", "40000000"))  # 本地输出像素上限
+
+
+class UpscaleBackend:
+    """超分后端接口：upscale() 成功返回图片字节，失败返回 None"""
+
+    name = None
+    scale = None             # 放大倍数，未知时为 None
+    max_input_pixels = None  # 单次推理的最大输入像素数，超过时分块处理；None 表示使用全局分块阈值
+
+    @property
+    def model_id(self):
+        """标识后端使用的模型，参与结果缓存键的计算"""
+        raise NotImplementedError
+
+    def upscale(self, image_data):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+# 预热等内部调用不计入路由统计，否则路由会偏向预热最频繁的模型
+_tracking = contextvars.ContextVar('latency_tracking', default=True)
+
+
+@contextmanager
+def untracked():
+    """在当前上下文中发出的推理不计入 LatencyStats"""
+    token = _tracking.set(False)
+    try:
+        yield
+    finally:
+        _tracking.reset(token)
+
+
+def _ewma(current, value, alpha):
+    return value if current is None else current + alpha * (value - current)
+
+
+class LatencyStats:
+    """推理耗时和错误率的指数加权平均，供模型路由参考
+
+    同时记录单次耗时和按输入像素归一化的每百万像素耗时，后者不受请求图片大小分布的影响。
+    """
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self.latency = None
+        self.seconds_per_megapixel = None
+        self.error_rate = 0.0
+        self.samples = 0
+
+    def record(self, elapsed, ok, pixels=None):
+        with self._lock:
+            self.samples += 1
+            self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+            # 失败的耗时(超时、快速报错)不代表正常推理速度，只计入错误率
+            if ok and elapsed is not None:
+                self.latency = _ewma(self.latency, elapsed, self.alpha)
+                if pixels:
+                    self.seconds_per_megapixel = _ewma(self.seconds_per_megapixel, elapsed / (pixels / 1e6), self.alpha)
+
+    def expected(self, default):
+        with self._lock:
+            return self.latency if self.latency is not None else default
+
+    def per_megapixel(self):
+        with self._lock:
+            return self.seconds_per_megapixel
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'latency': None if self.latency is None else round(self.latency, 3),
+                'seconds_per_megapixel': None if self.seconds_per_megapixel is None
+                else round(self.seconds_per_megapixel, 3),
+                'error_rate': round(self.error_rate, 4),
+                'samples': self.samples,
+            }
+
+
+def _input_pixels(image_data):
+    """只解析图片头部获取像素数，失败时返回 None"""
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            return img.width * img.height
+    except Exception:
+        return None
+
+
+class HFBackend(UpscaleBackend):
+    """通过 Hugging Face Inference API 进行超分
+
+    重试、退避与熔断统一由 retry_policy 负责，同步与异步调用共用同一套策略；
+    每一次 HTTP 尝试都要先在 rate_limit 的公平队列中拿到上游调用槽位。
+    """
+
+    name = 'hf'
+
+    def __init__(self, api_url, api_token, max_retries=RETRY_MAX_ATTEMPTS, scale=4, read_timeout=180,
+                 name=None, max_input_pixels=None, expected_latency=None, scheduler=None):
+        if name:
+            self.name = name
+        self.max_input_pixels = max_input_pixels
+        self.expected_latency = expected_latency  # 没有实测数据时路由使用的预估耗时(秒)
+        self.latency = LatencyStats()
+        self.api_url = api_url
+        self.api_token = api_token
+        self.max_retries = max_retries
+        self.scale = scale
+        self.read_timeout = read_timeout
+        self.retry_policy = RetryPolicy(max_attempts=max_retries)
+        self.breaker = CircuitBreaker(api_url)
+        self.retry_metrics = RetryMetrics()
+        self.scheduler = scheduler or upstream_scheduler
+        self.model_name = api_url.rsplit('/models/', 1)[-1]  # 指标标签用的短名称
+        self.last_success_at = None  # 最近一次推理成功的时间 (time.monotonic)，供预热调度器判断模型是否在线
+
+    @property
+    def model_id(self):
+        return self.api_url
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_token}",
+            "Content-Type": "application/octet-stream",
+            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
+        }
+
+    def _classify(self, status_code, headers, content):
+        """把一次 HTTP 响应归类为成功、可重试或不可重试"""
+        if status_code == 200:
+            return Outcome(result=content)
+
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if status_code == 503:
+            # 模型冷启动时 HF 返回 {"error": "... is currently loading", "estimated_time": 20.0}
+            estimated_time = None
+            try:
+                estimated_time = float(json.loads(content).get('estimated_time'))
+            except (ValueError, TypeError, AttributeError):
+                pass
+            logger.warning(f"模型正在加载中，状态码: {status_code}, 预计 {estimated_time} 秒")
+            progress.emit('model_loading', model=self.name, eta=estimated_time)
+            hint = estimated_time if estimated_time is not None else retry_after
+            return Outcome(retryable=True, delay_hint=hint, failure=estimated_time is None,
+                           reason='HTTP 503 (model loading)')
+
+        logger.error(f"HF API Error: {status_code} - {content[:500]!r}")
+        if status_code == 429:
+            # 上游配额用尽：暂停该模型的所有调用，而不是每个请求各自重试
+            self.scheduler.pause(self.model_name, retry_after or self.retry_policy.base_delay)
+            return Outcome(retryable=True, delay_hint=retry_after, reason='HTTP 429')
+        if status_code >= 500:
+            return Outcome(retryable=True, delay_hint=retry_after, failure=True, reason=f'HTTP {status_code}')
+        # 其余 4xx（参数错误、Token 无效等）重试也不会成功
+        return Outcome(reason=f'HTTP {status_code}')
+
+    def _record_attempt(self, status, outcome, start):
+        """记录单次尝试的耗时和结果"""
+        if outcome.ok:
+            label = 'ok'
+        else:
+            label = 'retryable' if outcome.retryable else 'fatal'
+        UPSTREAM_ATTEMPT_SECONDS.labels(self.model_name, label).observe(time.perf_counter() - start)
+        UPSTREAM_RESPONSES.labels(self.model_name, status).inc()
+        return outcome
+
+    def _attempt(self, image_data, timeout):
+        import requests
+
+        start = time.perf_counter()
+        try:
+            response = get_inference_client().post(
+                self.api_url,
+                headers=self._headers(),
+                data=image_data,
+                timeout=(min(30, timeout), timeout),  # (连接超时, 读取超时)
+            )
+        except requests.exceptions.Timeout as e:
+            logger.error(f"请求超时: {str(e)}")
+            return self._record_attempt('timeout', Outcome(retryable=True, failure=True, reason='timeout'), start)
+        except requests.exceptions.ConnectionError as e:
+            logger.error(f"连接错误: {str(e)}")
+            return self._record_attempt('connection_error', Outcome(retryable=True, failure=True, reason='connection error'), start)
+        except Exception as e:
+            logger.error(f"未知错误: {str(e)}")
+            return self._record_attempt('error', Outcome(retryable=True, failure=True, reason=str(e)), start)
+        outcome = self._classify(response.status_code, response.headers, response.content)
+        return self._record_attempt(response.status_code, outcome, start)
+
+    async def _attempt_async(self, image_data, timeout):
+        import httpx
+
+        start = time.perf_counter()
+        try:
+            response = await get_async_inference_client().post(
+                self.api_url,
+                headers=self._headers(),
+                content=image_data,
+                timeout=httpx.Timeout(timeout, connect=min(30, timeout)),
+            )
+        except httpx.TimeoutException as e:
+            logger.error(f"请求超时: {str(e)}")
+            return self._record_attempt('timeout', Outcome(retryable=True, failure=True, reason='timeout'), start)
+        except httpx.TransportError as e:
+            logger.error(f"连接错误: {str(e)}")
+            return self._record_attempt('connection_error', Outcome(retryable=True, failure=True, reason='connection error'), start)
+        except Exception as e:
+            logger.error(f"未知错误: {str(e)}")
+            return self._record_attempt('error', Outcome(retryable=True, failure=True, reason=str(e)), start)
+        outcome = self._classify(response.status_code, response.headers, response.content)
+        return self._record_attempt(response.status_code, outcome, start)
+
+    def _scheduled_attempt(self, image_data, timeout, timing):
+        try:
+            self.scheduler.acquire(self.model_name)
+        except RateLimitedError:
+            self.breaker.release_trial()  # 没有真正发出请求，不占用熔断器的试探名额
+            raise
+        start = time.monotonic()
+        try:
+            outcome = self._attempt(image_data, timeout)
+        finally:
+            timing['seconds'] = time.monotonic() - start
+            self.scheduler.release(timing['seconds'])
+        return outcome
+
+    async def _scheduled_attempt_async(self, image_data, timeout, timing):
+        try:
+            await self.scheduler.acquire_async(self.model_name)
+        except RateLimitedError:
+            self.breaker.release_trial()
+            raise
+        start = time.monotonic()
+        try:
+            outcome = await self._attempt_async(image_data, timeout)
+        finally:
+            timing['seconds'] = time.monotonic() - start
+            self.scheduler.release(timing['seconds'])
+        return outcome
+
+    def upscale(self, image_data, max_retries=None):
+        """使用Hugging Face API进行超分辨率处理；熔断时抛出 CircuitOpenError，排队超时抛出 RateLimitedError"""
+        timing = {}
+        result = call_with_retry(
+            lambda timeout: self._scheduled_attempt(image_data, timeout, timing),
+            self.retry_policy, self.breaker, self.retry_metrics,
+            read_timeout=self.read_timeout, max_attempts=max_retries,
+        )
+        self._record_result(image_data, timing, result)
+        return result
+
+    async def upscale_async(self, image_data, max_retries=None):
+        """异步版本：等待重试时不占用线程"""
+        timing = {}
+        result = await call_with_retry_async(
+            lambda timeout: self._scheduled_attempt_async(image_data, timeout, timing),
+            self.retry_policy, self.breaker, self.retry_metrics,
+            read_timeout=self.read_timeout, max_attempts=max_retries,
+        )
+        self._record_result(image_data, timing, result)
+        return result
+
+    def _record_result(self, image_data, timing, result):
+        if result:
+            self.last_success_at = time.monotonic()
+        if _tracking.get():
+            # 只统计真实请求；耗时取最后一次 (成功的) 尝试本身，不含排队和重试退避，并按输入像素归一化
+            self.latency.record(timing.get('seconds'), bool(result), _input_pixels(image_data))
+
+    def stats(self):
+        return {
+            'model': self.model_name,
+            'scale': self.scale,
+            'retry': self.retry_metrics.snapshot(),
+            'breaker': self.breaker.snapshot(),
+            'latency': self.latency.snapshot(),
+        }
+
+
+class LocalBackend(UpscaleBackend):
+    """本地 CPU 经典插值放大
+
+    目前使用 Pillow 的 Lanczos/Bicubic 重采样加 USM 锐化；以后接入小型
+    ONNX/Torch CPU 模型时，可以作为新的 UpscaleBackend 子类注册。
+    """
+
+    name = 'local'
+
+    RESAMPLE = {
+        'lanczos': Image.LANCZOS,
+        'bicubic': Image.BICUBIC,
+    }
+
+    def __init__(self, scale=LOCAL_UPSCALE_SCALE, resample='lanczos', sharpen=True,
+                 max_output_pixels=LOCAL_MAX_OUTPUT_PIXELS):
+        if resample not in self.RESAMPLE:
+            raise ValueError(f"Unsupported resample method: {resample}")
+        self.scale = scale
+        self.resample = resample
+        self.sharpen = sharpen
+        self.max_output_pixels = max_output_pixels
+
+    @property
+    def model_id(self):
+        return f"local:{self.resample}:x{self.scale}:{'sharpen' if self.sharpen else 'plain'}"
+
+    def upscale(self, image_data):
+        try:
+            with Image.open(io.BytesIO(image_data)) as img:
+                source_format = img.format
+                if img.mode not in ('RGB', 'RGBA', 'L'):
+                    img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+                width, height = img.size
+                scale = self.scale
+                # 输出过大时降低放大倍数，避免占用过多内存
+                if width * height * scale * scale > self.max_output_pixels:
+                    scale = max(1.0, (self.max_output_pixels / (width * height)) ** 0.5)
+                    logger.warning(f"输出尺寸超过上限，本地放大倍数降为 {scale:.2f}")
+
+                size = (int(width * scale), int(height * scale))
+                result = img.resize(size, self.RESAMPLE[self.resample])
+                if self.sharpen:
+                    result = result.filter(ImageFilter.UnsharpMask(radius=2, percent=80, threshold=2))
+
+            buffer = io.BytesIO()
+            if source_format == 'JPEG' and result.mode in ('RGB', 'L'):
+                result.save(buffer, format='JPEG', quality=95)
+            else:
+                result.save(buffer, format='PNG')
+            return buffer.getvalue()
+        except Exception as e:
+            logger.error(f"本地超分失败: {str(e)}")
+            return None
+
+
+_backends = {}
+_aliases = {}
+
+
+def register_backend(backend):
+    _backends[backend.name] = backend
+    return backend
+
+
+def register_alias(alias, name):
+    """让另一个名称指向已注册的后端（例如默认模型同时可以用模型名访问）"""
+    _aliases[alias] = name
+
+
+def get_backend(name=None):
+    """按名称获取后端，未指定时使用 UPSCALE_BACKEND；名称未知时返回 None"""
+    name = name or UPSCALE_BACKEND
+    return _backends.get(_aliases.get(name, name))
+
+
+def available_backends():
+    return sorted(_backends)
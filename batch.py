@@ -0,0 +1,167 @@
+# batch.py - 批量超分：多图并发处理，按完成顺序流式返回结果
+
+import os
+import json
+import time
+import base64
+import functools
+import zipfile
+import logging
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))   # 单个批次同时处理的图片数
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))      # 单个批次最多图片数
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+
+
+class BatchError(ValueError):
+    """批量请求的输入不合法"""
+
+
+def read_zip_items(archive_file, max_items=BATCH_MAX_ITEMS, max_item_bytes=None):
+    """打开 zip 包并列出其中的图片，返回 (ZipFile, [(文件名, 读取函数)])
+
+    图片在处理时才解压，调用方在批次结束后关闭 ZipFile。
+    """
+    try:
+        archive = zipfile.ZipFile(archive_file)
+    except zipfile.BadZipFile:
+        raise BatchError('Invalid zip archive')
+
+    items = []
+    try:
+        for entry in archive.infolist():
+            name = entry.filename
+            if entry.is_dir() or os.path.basename(name).startswith('.') or '__MACOSX' in name:
+                continue
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            # 以声明的解压后大小做限制，防止 zip 炸弹
+            if max_item_bytes and entry.file_size > max_item_bytes:
+                raise BatchError(f'Image {name} is too large')
+            if len(items) >= max_items:
+                raise BatchError(f'Too many images. Maximum {max_items} allowed.')
+            items.append((name, functools.partial(archive.read, entry)))
+    except BatchError:
+        archive.close()
+        raise
+    return archive, items
+
+
+def run_batch(items, runner, concurrency=BATCH_CONCURRENCY):
+    """并发处理批量图片，按完成顺序逐个产出结果字典
+
+    items 为 [(文件名, 图片字节或读取函数)]；读取函数在工作线程中调用，同时在内存中的输入不超过并发数。
+    """
+    executor = ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='upscale-batch')
+    try:
+        futures = {}
+        for index, (filename, image_data) in enumerate(items):
+            futures[executor.submit(_run_item, runner, image_data)] = (index, filename)
+
+        for future in as_completed(futures):
+            index, filename = futures[future]
+            result = future.result()
+            result.update({'index': index, 'filename': filename})
+            yield result
+    finally:
+        # 客户端提前断开时取消尚未开始的图片
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_item(runner, source):
+    start_time = time.time()
+    info = {}
+    try:
+        image_data = source() if callable(source) else source
+        output = runner(image_data, info)
+        error = None if output else 'Failed to upscale image'
+    except ValueError as e:
+        output, error = None, str(e)
+    except Exception as e:
+        logger.error(f"批量任务中的图片处理失败: {str(e)}")
+        output, error = None, 'Internal server error'
+    return {
+        'status': 'succeeded' if output else 'failed',
+        'output': output,
+        'error': error,
+        'info': info,
+        'processing_time': round(time.time() - start_time, 2),
+    }
+
+
+def ndjson_stream(results, mimetype_of):
+    """NDJSON 输出：每完成一张图片输出一行，最后输出汇总行"""
+    start_time = time.time()
+    succeeded = failed = 0
+    for result in results:
+        line = {
+            'type': 'item',
+            'index': result['index'],
+            'filename': result['filename'],
+            'status': result['status'],
+            'processing_time': result['processing_time'],
+        }
+        line.update(result['info'])
+        if result['output']:
+            succeeded += 1
+            encoded_image = base64.b64encode(result['output']).decode('utf-8')
+            line['upscaled_image'] = f"data:{mimetype_of(result['output'])};base64,{encoded_image}"
+        else:
+            failed += 1
+            line['error'] = result['error']
+        yield json.dumps(line) + '\n'
+    yield json.dumps({
+        'type': 'summary',
+        'succeeded': succeeded,
+        'failed': failed,
+        'total_time': round(time.time() - start_time, 2),
+    }) + '\n'
+
+
+class _ChunkWriter:
+    """不可 seek 的写入目标，zipfile 写入的数据先暂存，再逐块产出"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_stream(results, mimetype_of):
+    """zip 输出：每完成一张图片写入一个文件，最后写入 manifest.json"""
+    writer = _ChunkWriter()
+    manifest = []
+    with zipfile.ZipFile(writer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for result in results:
+            entry = {
+                'index': result['index'],
+                'filename': result['filename'],
+                'status': result['status'],
+                'processing_time': result['processing_time'],
+            }
+            if result['output']:
+                base = os.path.splitext(os.path.basename(result['filename']))[0]
+                extension = mimetypes.guess_extension(mimetype_of(result['output'])) or '.bin'
+                entry['output'] = f"{result['index']:03d}_{base}_upscaled{extension}"
+                archive.writestr(entry['output'], result['output'])
+            else:
+                entry['error'] = result['error']
+            manifest.append(entry)
+            yield writer.drain()
+        archive.writestr('manifest.json', json.dumps(sorted(manifest, key=lambda e: e['index']), indent=2))
+    yield writer.drain()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# load_test.py - 离线压测：启动模拟推理服务和应用，按指定并发压测 /upscale
+#
+# 用法:
+#   python bench/load_test.py --server gunicorn --concurrency 16 --requests 400 --output results.json
+#   python bench/load_test.py --compare results.json           # 与上一次结果对比
+#   python bench/load_test.py --url http://127.0.0.1:5001      # 压测已启动的应用（不统计内存）
+#
+# 结果为 JSON：RPS、p50/p95/p99 延迟、按状态码统计的结果数、应用进程峰值内存以及当前提交号，
+# 便于在不同提交之间比较。
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import socket
+import signal
+import argparse
+import resource
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mock_server  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_COMMANDS = {
+    # 与 Procfile 保持一致
+    'gunicorn': ['gunicorn', '-c', 'gunicorn.conf.py', '-b', '127.0.0.1:{port}'],
+    'uvicorn': ['uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', '{port}', '--log-level', 'warning'],
+    'flask': [sys.executable, 'app.py'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_images(count, width, height):
+    """生成 count 张内容不同的 PNG，避免全部命中结果缓存"""
+    images = []
+    for _ in range(count):
+        img = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', compress_level=1)
+        images.append(buffer.getvalue())
+    return images
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return None
+    index = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'应用进程已退出，返回码 {process.returncode}')
+        try:
+            requests.get(f'{url}/health', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'应用在 {timeout} 秒内未启动')
+
+
+def start_app(server, port, mock_url, extra_env):
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'HF_API_URL': mock_url,
+        'HF_API_TOKEN': env.get('HF_API_TOKEN') or 'bench',
+        'WARMUP_ENABLED': 'false',
+    })
+    env.update(extra_env)
+    command = [part.format(port=port) for part in SERVER_COMMANDS[server]]
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop_app(process):
+    """停止应用并返回其进程树的峰值内存(MB)"""
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    # ru_maxrss 为所有已回收子进程(含 gunicorn worker)中的最大值：Linux 单位 KB，macOS 单位字节
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(maxrss / divisor, 1)
+
+
+def run_load(url, images, total, concurrency, response_mode, backend):
+    """以固定并发发送 total 个请求，返回每个请求的 (状态码, 延迟秒数) 和总耗时"""
+    local = threading.local()
+    counter = iter(range(total))
+    lock = threading.Lock()
+    results = []
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            data = {'response': response_mode}
+            if backend:
+                data['backend'] = backend
+            start = time.perf_counter()
+            try:
+                response = session().post(
+                    f'{url}/upscale',
+                    files={'image': (f'bench-{index}.png', images[index % len(images)], 'image/png')},
+                    data=data,
+                    timeout=600,
+                )
+                status = response.status_code
+                response.content  # 读完响应体，计入延迟
+            except requests.RequestException:
+                status = 'error'
+            elapsed = time.perf_counter() - start
+            with lock:
+                results.append((status, elapsed))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    return results, time.perf_counter() - start
+
+
+def summarize(results, duration):
+    latencies = sorted(elapsed for status, elapsed in results if status == 200)
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        'requests': len(results),
+        'succeeded': len(latencies),
+        'statuses': statuses,
+        'duration_s': round(duration, 3),
+        'rps': round(len(latencies) / duration, 2) if duration else 0.0,
+        'latency_ms': {
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+
+def compare(current, previous):
+    """打印与上一次结果的差异（百分比）"""
+    rows = [('rps', current['rps'], previous.get('rps'))]
+    for name in ('p50', 'p95', 'p99'):
+        rows.append((name, current['latency_ms'][name], previous.get('latency_ms', {}).get(name)))
+    rows.append(('peak_rss_mb', current.get('peak_rss_mb'), previous.get('peak_rss_mb')))
+    print(f"对比 {previous.get('commit')} -> {current.get('commit')}", file=sys.stderr)
+    for name, now, before in rows:
+        if now is None or not before:
+            change = 'n/a'
+        else:
+            change = f'{(now - before) / before * 100:+.1f}%'
+        print(f"  {name:12s} {before!s:>10} -> {now!s:>10}  ({change})", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='超分服务离线压测')
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='gunicorn', help='应用的启动方式')
+    parser.add_argument('--url', help='压测已启动的应用，不启动模拟服务和应用')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup-requests', type=int, default=4, help='正式计时前的预热请求数')
+    parser.add_argument('--image-size', default='256x256', help='输入图片尺寸 宽x高')
+    parser.add_argument('--distinct-images', type=int, default=0,
+                        help='不同输入图片的数量，0 表示每个请求都不同（不命中结果缓存）')
+    parser.add_argument('--response', choices=('json', 'binary'), default='json', help='请求的响应格式')
+    parser.add_argument('--backend', help='使用的推理后端 (默认使用应用配置)')
+    parser.add_argument('--env', action='append', default=[], help='传给应用的环境变量 KEY=VALUE，可重复')
+    parser.add_argument('--output', help='结果 JSON 写入文件')
+    parser.add_argument('--compare', help='与之前的结果 JSON 对比')
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+    total = args.requests + args.warmup_requests
+    images = make_images(args.distinct_images or total, width, height)
+    extra_env = dict(item.split('=', 1) for item in args.env)
+
+    process = mock = None
+    if args.url:
+        url = args.url.rstrip('/')
+    else:
+        mock, mock_config = mock_server.serve(0, **mock_server.config_from_args(args))
+        mock_url = f'http://127.0.0.1:{mock.server_address[1]}/models/mock'
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        process = start_app(args.server, port, mock_url, extra_env)
+
+    peak_rss = None
+    try:
+        wait_until_up(url, process)
+        # 预热请求使用最后几张图片，不与正式请求重复
+        run_load(url, images[-args.warmup_requests:] or images, args.warmup_requests,
+                 max(min(args.concurrency, args.warmup_requests), 1), args.response, args.backend)
+        results, duration = run_load(url, images[:args.requests] if not args.distinct_images else images,
+                                     args.requests, args.concurrency, args.response, args.backend)
+        try:
+            server_stats = requests.get(f'{url}/stats', timeout=5).json()
+        except (requests.RequestException, ValueError):
+            server_stats = None
+    finally:
+        if process is not None:
+            peak_rss = stop_app(process)
+        if mock is not None:
+            mock.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'server': None if args.url else args.server,
+            'url': args.url,
+            'concurrency': args.concurrency,
+            'image_size': [width, height],
+            'distinct_images': args.distinct_images or args.requests,
+            'response': args.response,
+            'backend': args.backend,
+            'env': extra_env,
+            'mock': None if args.url else mock_server.config_from_args(args),
+        },
+        **summarize(results, duration),
+        'peak_rss_mb': peak_rss,
+        'mock_stats': mock_config.counts if mock is not None else None,
+        'server_stats': server_stats,
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
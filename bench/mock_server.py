@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# mock_server.py - 本地模拟推理服务，用于离线压测
+#
+# 模拟 Hugging Face Inference API 的行为：可配置延迟、错误率、冷启动 503 和返回体大小。
+#
+# 用法: python bench/mock_server.py --port 8500 --latency 0.5 --error-rate 0.01 --cold-start 10
+# 然后以 HF_API_URL=http://127.0.0.1:8500/models/mock 启动应用
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+
+def noise_png(size_kb):
+    """生成约 size_kb KB 的 PNG（随机噪声几乎无法压缩，文件大小约等于像素字节数）"""
+    side = max(int((size_kb * 1024 / 3) ** 0.5), 1)
+    img = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+class MockConfig:
+    def __init__(self, latency=0.5, jitter=0.1, error_rate=0.0, cold_start=0.0,
+                 estimated_time=2.0, output_kb=512, mode='fixed', scale=4):
+        self.latency = latency              # 平均推理延迟(秒)
+        self.jitter = jitter                # 延迟的随机浮动比例
+        self.error_rate = error_rate        # 返回 500 的概率
+        self.cold_start = cold_start        # 启动后多少秒内返回 503 "模型加载中"
+        self.estimated_time = estimated_time
+        self.output_kb = output_kb
+        self.mode = mode                    # fixed: 返回固定图片；resize: 真实放大输入(更慢)
+        self.scale = scale
+        self.started_at = time.monotonic()
+        self.payload = noise_png(output_kb) if mode == 'fixed' else None
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'ok': 0, 'loading': 0, 'errors': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts['requests'] += 1
+            self.counts[name] += 1
+
+
+def _upscale(image_data, scale):
+    with Image.open(io.BytesIO(image_data)) as img:
+        img = img.convert('RGB')
+        result = img.resize((img.width * scale, img.height * scale), Image.NEAREST)
+    buffer = io.BytesIO()
+    result.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # 支持长连接，与真实推理服务一致
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status, data):
+            self._send(status, json.dumps(data).encode('utf-8'), 'application/json')
+
+        def do_GET(self):
+            if self.path == '/stats':
+                with config.lock:
+                    return self._send_json(200, config.counts)
+            self._send_json(200, {'status': 'ok'})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+            if time.monotonic() - config.started_at < config.cold_start:
+                config.count('loading')
+                return self._send_json(503, {
+                    'error': 'Model mock is currently loading',
+                    'estimated_time': config.estimated_time,
+                })
+
+            delay = config.latency * random.uniform(1 - config.jitter, 1 + config.jitter)
+            time.sleep(max(delay, 0))
+
+            if random.random() < config.error_rate:
+                config.count('errors')
+                return self._send_json(500, {'error': 'Mock inference failure'})
+
+            try:
+                payload = config.payload or _upscale(body, config.scale)
+            except Exception as e:
+                config.count('errors')
+                return self._send_json(400, {'error': str(e)})
+            config.count('ok')
+            self._send(200, payload, 'image/png')
+
+    return Handler
+
+
+def serve(port=0, **kwargs):
+    """在后台线程启动模拟服务，返回 (server, config)；port=0 时自动分配端口"""
+    config = MockConfig(**kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, config
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.5, help='平均推理延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0.1, help='延迟浮动比例')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 500 的概率')
+    parser.add_argument('--cold-start', type=float, default=0.0, help='启动后返回 503 的秒数')
+    parser.add_argument('--estimated-time', type=float, default=2.0, help='503 响应中的 estimated_time')
+    parser.add_argument('--output-kb', type=int, default=512, help='fixed 模式下返回图片的大小(KB)')
+    parser.add_argument('--mode', choices=('fixed', 'resize'), default='fixed', help='返回固定图片或真实放大输入')
+
+
+def config_from_args(args):
+    return {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'cold_start': args.cold_start,
+        'estimated_time': args.estimated_time,
+        'output_kb': args.output_kb,
+        'mode': args.mode,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟推理服务')
+    parser.add_argument('--port', type=int, default=8500)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, _ = serve(args.port, **config_from_args(args))
+    print(f"模拟推理服务已启动: http://127.0.0.1:{server.server_address[1]}/models/mock", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
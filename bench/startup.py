@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# startup.py - 启动耗时测试：从启动进程到 /health 第一次返回 200 的时间
+#
+# 用法:
+#   python bench/startup.py --server gunicorn --runs 5 --output startup.json
+#   python bench/startup.py --server flask --compare startup.json    # 与上一次结果对比
+#
+# 每轮启动一个新的应用进程（与 Procfile 相同的方式），以 10ms 间隔轮询 /health，
+# 同时在新的解释器中测量 import app 的耗时和导入后已加载的重型模块，便于在不同提交之间比较。
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import ROOT, SERVER_COMMANDS, free_port, git_commit, percentile, start_app, stop_app  # noqa: E402
+
+# 只有首次推理才需要的模块，导入 app 时不应加载
+HEAVY_MODULES = ('requests', 'urllib3', 'httpx', 'numpy')
+
+IMPORT_PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import app\n"
+    "elapsed = time.perf_counter() - start\n"
+    "import json, threading\n"
+    "print(json.dumps({'seconds': elapsed, 'threads': threading.active_count(),\n"
+    "                  'modules': [name for name in %r if name in sys.modules]}))\n"
+) % (HEAVY_MODULES,)
+
+
+def measure_import(env):
+    """在新的解释器中导入 app，返回 (耗时秒数, 导入后的线程数, 已加载的重型模块)"""
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE], cwd=ROOT, env=env,
+                                     stderr=subprocess.DEVNULL, text=True)
+    data = json.loads(output.strip().splitlines()[-1])
+    return data['seconds'], data['threads'], data['modules']
+
+
+def time_to_healthy(server, env, timeout=60, interval=0.01):
+    """启动应用并返回第一次健康响应的耗时（秒）"""
+    port = free_port()
+    url = f'http://127.0.0.1:{port}/health'
+    start = time.perf_counter()
+    process = start_app(server, port, env['HF_API_URL'], env)
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f'应用进程已退出，返回码 {process.returncode}')
+            try:
+                if requests.get(url, timeout=1).status_code == 200:
+                    return time.perf_counter() - start
+            except requests.RequestException:
+                pass
+            time.sleep(interval)
+        raise RuntimeError(f'应用在 {timeout} 秒内未就绪')
+    finally:
+        stop_app(process)
+
+
+def summarize_runs(values):
+    values = sorted(values)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        'runs': len(values),
+        'min_ms': ms(values[0]) if values else None,
+        'p50_ms': ms(percentile(values, 50)),
+        'max_ms': ms(values[-1]) if values else None,
+    }
+
+
+def compare(current, previous):
+    print(f"对比 {previous.get('commit')} -> {current.get('commit')}", file=sys.stderr)
+    for section in ('import', 'healthy'):
+        now = current[section]['p50_ms']
+        before = previous.get(section, {}).get('p50_ms')
+        change = 'n/a' if now is None or not before else f'{(now - before) / before * 100:+.1f}%'
+        print(f"  {section:8s} p50 {before!s:>8} -> {now!s:>8} ms  ({change})", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='应用启动耗时测试')
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='gunicorn', help='应用的启动方式')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--env', action='append', default=[], help='传给应用的环境变量 KEY=VALUE，可重复')
+    parser.add_argument('--output', help='结果 JSON 写入文件')
+    parser.add_argument('--compare', help='与之前的结果 JSON 对比')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # 不连接真实的推理服务：健康检查不依赖它
+    env.setdefault('HF_API_URL', 'http://127.0.0.1:9/models/none')
+    env.update(dict(item.split('=', 1) for item in args.env))
+
+    import_times, healthy_times = [], []
+    threads = modules = None
+    for _ in range(args.runs):
+        seconds, threads, modules = measure_import(env)
+        import_times.append(seconds)
+        healthy_times.append(time_to_healthy(args.server, env))
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'server': args.server,
+        'env': dict(item.split('=', 1) for item in args.env),
+        'import': summarize_runs(import_times),
+        'healthy': summarize_runs(healthy_times),
+        'threads_after_import': threads,
+        'heavy_modules_after_import': modules,
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
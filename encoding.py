@@ -0,0 +1,157 @@
+# encoding.py - 输出编码：按客户端协商的格式和质量重新编码超分结果，以及快速预览图
+#
+# 模型输出的通常是体积很大的 PNG。客户端可以通过 format 参数或 Accept 请求头要求
+# WebP / AVIF / JPEG / PNG，服务器在专用的编码线程池中重新编码，避免占满请求线程；
+# 没有明确要求时保持模型的原始输出，不做额外的编解码。
+
+import io
+import os
+import base64
+import asyncio
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+try:
+    import pillow_avif  # noqa: F401  旧版本 Pillow 需要该插件才能编码 AVIF
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "original")                 # 客户端未指定时的输出格式，original 表示保持模型输出
+OUTPUT_QUALITY = int(os.getenv("OUTPUT_QUALITY", "85"))                # 有损格式的默认质量 (1-100)
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "2"))                 # 编码线程池大小
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "3"))         # PNG 压缩级别，越高越慢
+PREVIEW_MAX_EDGE = int(os.getenv("PREVIEW_MAX_EDGE", "480"))           # 预览图最长边(像素)
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "50"))              # 预览图质量
+
+OutputFormat = namedtuple('OutputFormat', ['name', 'pil_format', 'mimetype'])
+
+FORMATS = {
+    'webp': OutputFormat('webp', 'WEBP', 'image/webp'),
+    'avif': OutputFormat('avif', 'AVIF', 'image/avif'),
+    'jpeg': OutputFormat('jpeg', 'JPEG', 'image/jpeg'),
+    'png': OutputFormat('png', 'PNG', 'image/png'),
+}
+_ALIASES = {'jpg': 'jpeg', 'original': None, 'auto': None}
+
+
+def available_formats():
+    """当前 Pillow 可以编码的输出格式"""
+    Image.init()
+    return [name for name, spec in FORMATS.items() if spec.pil_format in Image.SAVE]
+
+
+def parse_format(value):
+    """解析 format 参数，返回格式名，original 返回 None；不支持的格式抛出 ValueError"""
+    name = value.strip().lower()
+    if name.startswith('image/'):
+        name = name[len('image/'):]
+    name = _ALIASES.get(name, name)
+    if name is not None and name not in available_formats():
+        raise ValueError(f"Unsupported output format: {value}. Supported: original, {', '.join(available_formats())}")
+    return name
+
+
+def parse_quality(value):
+    if value in (None, ''):
+        return OUTPUT_QUALITY
+    try:
+        quality = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('quality must be an integer between 1 and 100')
+    if not 1 <= quality <= 100:
+        raise ValueError('quality must be an integer between 1 and 100')
+    return quality
+
+
+def _wildcard_rank(mimetype):
+    return 2 if mimetype == '*/*' else 1 if mimetype.endswith('/*') else 0
+
+
+def negotiate(requested=None, accept=None, default=OUTPUT_FORMAT):
+    """确定输出格式：format 参数优先，其次是 Accept 中明确列出且排在通配符之前的图片类型"""
+    if requested:
+        return parse_format(requested)
+    if accept is not None:
+        supported = {FORMATS[name].mimetype: name for name in available_formats()}
+        # 按质量从高到低检查，同质量时具体类型排在 image/* 之前、image/* 排在 */* 之前
+        # (不依赖客户端书写的顺序)；先遇到通配符说明客户端不在意格式
+        for mimetype, quality in sorted(accept, key=lambda item: (-item[1], _wildcard_rank(item[0]))):
+            if quality <= 0:
+                continue
+            if mimetype in supported:
+                return supported[mimetype]
+            if mimetype in ('image/*', '*/*'):
+                break
+    return parse_format(default)
+
+
+def encode_image(image_data, name, quality=OUTPUT_QUALITY):
+    """重新编码为指定格式，返回 (字节, MIME 类型)；原图已是该格式且为无损格式时直接返回"""
+    spec = FORMATS[name]
+    with Image.open(io.BytesIO(image_data)) as img:
+        if img.format == spec.pil_format and spec.name == 'png':
+            return image_data, spec.mimetype
+        img.load()
+        if spec.name == 'jpeg':
+            img = img.convert('RGB')
+        elif spec.name in ('webp', 'avif') and img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+        elif spec.name == 'png' and img.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I;16'):
+            img = img.convert('RGB')
+
+        options = {}
+        if spec.name == 'jpeg':
+            # 渐进式 JPEG：浏览器在下载过程中就能先显示模糊的全图
+            options = {'quality': quality, 'progressive': True}
+        elif spec.name == 'webp':
+            options = {'quality': quality, 'method': 4}
+        elif spec.name == 'avif':
+            options = {'quality': quality, 'speed': 8}
+        elif spec.name == 'png':
+            options = {'compress_level': PNG_COMPRESS_LEVEL}
+
+        buffer = io.BytesIO()
+        img.save(buffer, format=spec.pil_format, **options)
+        return buffer.getvalue(), spec.mimetype
+
+
+def make_preview(image_data, scale=1, max_edge=PREVIEW_MAX_EDGE, quality=PREVIEW_QUALITY):
+    """生成低分辨率预览图，返回 (data URL, 宽, 高)，用于在完整结果出来之前先展示"""
+    with Image.open(io.BytesIO(image_data)) as img:
+        width, height = img.size
+        target_w, target_h = width * scale, height * scale
+        ratio = min(1.0, max_edge / max(target_w, target_h))
+        size = (max(1, round(target_w * ratio)), max(1, round(target_h * ratio)))
+        img.draft('RGB', size)  # JPEG 解码时直接按比例缩小，速度快得多
+        preview = img.convert('RGB').resize(size, Image.BILINEAR)
+    name = 'webp' if 'webp' in available_formats() else 'jpeg'
+    buffer = io.BytesIO()
+    preview.save(buffer, format=FORMATS[name].pil_format, quality=quality)
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return f'data:{FORMATS[name].mimetype};base64,{encoded}', size[0], size[1]
+
+
+class OutputEncoder:
+    """在专用线程池中编码，限制同时进行的 CPU 密集编码数量"""
+
+    def __init__(self, workers=ENCODE_WORKERS):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='encode')
+
+    def encode(self, image_data, name, quality=OUTPUT_QUALITY):
+        return self._executor.submit(encode_image, image_data, name, quality).result()
+
+    async def encode_async(self, image_data, name, quality=OUTPUT_QUALITY):
+        """异步模式下等待编码不占用事件循环"""
+        return await asyncio.wrap_future(self._executor.submit(encode_image, image_data, name, quality))
+
+    def stats(self):
+        return {'workers': self.workers, 'formats': available_formats(), 'default': OUTPUT_FORMAT}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,23 @@
+# gunicorn.conf.py - Web 进程的 gunicorn 配置
+#
+# 启动方式: gunicorn -c gunicorn.conf.py
+#
+# 开启预加载时，应用在 master 中导入一次并完成耗时的准备 (app.preload_shared_state)，
+# worker 由 fork 产生，直接共用已导入的模块（写时复制），新 worker 启动时不需要重新导入，
+# 扩容或 worker 重启后能更快地响应第一个请求。线程、数据库连接和推理连接池不能跨 fork 共用，
+# 由各 worker 在 fork 之后自行创建。
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))           # worker 进程数
+threads = int(os.getenv("GUNICORN_THREADS", "4"))          # 每个 worker 的线程数
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"  # 在 master 中预加载应用
+wsgi_app = "app:create_app(preload=True)"
+
+
+def post_fork(server, worker):
+    # 预热线程等后台任务只在处理请求的 worker 中运行
+    import app
+
+    app.start_background_tasks()
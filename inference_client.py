@@ -0,0 +1,228 @@
+# inference_client.py - 进程级共享的推理 HTTP 客户端
+#
+# 所有对推理服务的调用共用一个长连接池，避免每次请求都重新进行 TCP+TLS 握手。
+# requests / urllib3 在首次创建客户端时才导入，不拖慢进程启动（gunicorn 预加载时在 master 中导入一次）。
+
+import os
+import socket
+import threading
+import logging
+import functools
+
+logger = logging.getLogger(__name__)
+
+# 连接池配置（均可通过环境变量覆盖）
+POOL_CONNECTIONS = int(os.getenv("INFERENCE_POOL_CONNECTIONS", "4"))    # 缓存的主机连接池个数
+POOL_MAXSIZE = int(os.getenv("INFERENCE_POOL_MAXSIZE", "16"))           # 每个主机保留的最大连接数
+POOL_BLOCK = os.getenv("INFERENCE_POOL_BLOCK", "false").lower() == "true"  # 达到每主机上限时是否阻塞等待
+KEEPALIVE_IDLE = int(os.getenv("INFERENCE_KEEPALIVE_IDLE", "60"))       # TCP keep-alive 空闲探测间隔(秒)，0 表示关闭
+ASYNC_MAX_CONNECTIONS = int(os.getenv("INFERENCE_ASYNC_MAX_CONNECTIONS", "100"))  # 异步模式下的最大并发连接数
+
+
+class PoolStats:
+    """连接池命中统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.misses = 0
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            checkouts, misses = self.checkouts, self.misses
+        hits = max(checkouts - misses, 0)
+        return {
+            'requests': checkouts,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / checkouts, 4) if checkouts else 0.0,
+        }
+
+
+def _counting_pool_class(base, stats):
+    """生成会记录连接复用情况的连接池类"""
+
+    class CountingPool(base):
+        def _get_conn(self, timeout=None):
+            stats.record_checkout()
+            return super()._get_conn(timeout)
+
+        def _new_conn(self):
+            # 池中没有可复用的连接，需要新建（一次完整握手）
+            stats.record_miss()
+            return super()._new_conn()
+
+    CountingPool.__name__ = f"Counting{base.__name__}"
+    return CountingPool
+
+
+def _keepalive_socket_options(idle):
+    from urllib3.connection import HTTPConnection
+
+    options = list(HTTPConnection.default_socket_options)
+    if idle <= 0:
+        return options
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # 不同平台支持的 TCP keep-alive 参数不同
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(idle // 4, 1)))
+    return options
+
+
+@functools.lru_cache(maxsize=None)
+def pooled_adapter_class():
+    """带命中统计和 TCP keep-alive 的 HTTPAdapter 类"""
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class PooledHTTPAdapter(HTTPAdapter):
+        def __init__(self, stats, keepalive_idle=KEEPALIVE_IDLE, **kwargs):
+            self.stats = stats
+            self.keepalive_idle = keepalive_idle
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+            pool_kwargs.setdefault("socket_options", _keepalive_socket_options(self.keepalive_idle))
+            super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _counting_pool_class(HTTPConnectionPool, self.stats),
+                "https": _counting_pool_class(HTTPSConnectionPool, self.stats),
+            }
+
+    return PooledHTTPAdapter
+
+
+class InferenceClient:
+    """长连接、线程安全的推理 HTTP 客户端"""
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 pool_block=POOL_BLOCK, keepalive_idle=KEEPALIVE_IDLE):
+        import requests
+
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keepalive_idle = keepalive_idle
+        self.pool_stats = PoolStats()
+
+        # 连接层不做重试，重试统一由 retry_policy 控制，避免两套重试相互叠加
+        adapter = pooled_adapter_class()(
+            self.pool_stats,
+            keepalive_idle=keepalive_idle,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=0,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def stats(self):
+        data = self.pool_stats.snapshot()
+        data.update({
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'keepalive_idle': self.keepalive_idle,
+        })
+        return data
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_inference_client():
+    """获取进程级共享的推理客户端（首次调用时创建）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient()
+                logger.info(
+                    f"推理客户端连接池已创建: pool_connections={POOL_CONNECTIONS}, "
+                    f"pool_maxsize={POOL_MAXSIZE}, block={POOL_BLOCK}"
+                )
+    return _client
+
+
+def reset_inference_client():
+    """关闭并丢弃当前共享客户端（用于测试或 fork 之后）"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+class AsyncInferenceClient:
+    """异步模式（ASGI）使用的推理客户端，基于 httpx 的连接池"""
+
+    def __init__(self, max_connections=ASYNC_MAX_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 keepalive_idle=KEEPALIVE_IDLE):
+        import httpx  # 只有异步模式才需要 httpx
+
+        self.max_connections = max_connections
+        self.pool_maxsize = pool_maxsize
+        self.keepalive_idle = keepalive_idle
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=pool_maxsize,
+            keepalive_expiry=keepalive_idle or None,
+        )
+        self.client = httpx.AsyncClient(limits=limits)
+        self.requests = 0
+
+    async def post(self, url, **kwargs):
+        self.requests += 1
+        return await self.client.post(url, **kwargs)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'max_connections': self.max_connections,
+            'max_keepalive_connections': self.pool_maxsize,
+            'keepalive_expiry': self.keepalive_idle,
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_async_client = None
+
+
+def get_async_inference_client():
+    """获取异步推理客户端（在事件循环内首次调用时创建）"""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncInferenceClient()
+        logger.info(f"异步推理客户端连接池已创建: max_keepalive_connections={POOL_MAXSIZE}")
+    return _async_client
+
+
+async def close_async_inference_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
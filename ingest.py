@@ -0,0 +1,170 @@
+# ingest.py - 上传图片的早期校验与内存统计
+#
+# 只解析文件头（Pillow 惰性 Image.open，不调用 load()）就能得到格式和尺寸：
+# 不支持的格式、像素数超限的图片（包括体积很小但解码后巨大的“解压炸弹”）
+# 在把请求体读入内存、进入预处理和付费推理之前就被拒绝。
+# 同时记录每个请求的输入像素数和峰值内存，便于发现占用异常的请求。
+
+import io
+import os
+import logging
+import threading
+import tracemalloc
+from collections import namedtuple
+
+from PIL import Image, UnidentifiedImageError
+
+from metrics import Counter, Histogram
+from preprocess import InvalidImageError
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+INGEST_MAX_PIXELS = int(os.getenv("INGEST_MAX_PIXELS", "40000000"))   # 单张输入图片的像素上限
+INGEST_FORMATS = [name.strip().upper() for name in os.getenv(
+    "INGEST_FORMATS", "JPEG,PNG,WEBP,GIF,BMP,TIFF").split(',') if name.strip()]  # 允许上传的图片格式
+MEMORY_TRACE = os.getenv("MEMORY_TRACE", "false").lower() == "true"   # 用 tracemalloc 统计请求期间的峰值内存（近似值，有额外开销）
+
+INPUT_PIXELS = Histogram(
+    'upscale_input_pixels', 'Pixel count of accepted input images (from the header)',
+    buckets=(65536, 262144, 1048576, 4194304, 16777216, 67108864))
+INGEST_REJECTED = Counter(
+    'upscale_ingest_rejected_total', 'Uploads rejected from the image header before decoding', ['reason'])
+PEAK_MEMORY_BYTES = Histogram(
+    'upscale_request_peak_memory_bytes', 'Approximate Python heap peak growth while a traced request ran (MEMORY_TRACE=true)',
+    ['endpoint'], buckets=(1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20, 1 << 30, 4 << 30))
+
+
+class IngestError(InvalidImageError):
+    status_code = 400
+
+
+class UnsupportedFormatError(IngestError):
+    status_code = 415
+
+
+class ImageTooLargeError(IngestError):
+    status_code = 413
+
+
+class ImageHeader(namedtuple('ImageHeader', ['format', 'width', 'height', 'mode'])):
+    """从文件头得到的图片信息"""
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+    @property
+    def decoded_bytes(self):
+        """完整解码后占用的内存估计"""
+        try:
+            bands = Image.getmodebands(self.mode)
+        except (KeyError, ValueError):
+            bands = 4
+        return self.pixels * bands
+
+
+def _open_header(fp, formats):
+    with Image.open(fp, formats=formats) as img:
+        return ImageHeader(img.format, img.width, img.height, img.mode)
+
+
+def sniff(source, formats=None):
+    """只读取文件头，返回 ImageHeader；source 为字节或可 seek 的文件对象，读取后恢复原位置"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        fp = io.BytesIO(source)
+    else:
+        fp = source
+    position = fp.tell()
+    formats = formats or INGEST_FORMATS
+    try:
+        return _open_header(fp, formats)
+    except UnidentifiedImageError:
+        pass
+    except Image.DecompressionBombError as e:
+        INGEST_REJECTED.labels('pixels').inc()
+        raise ImageTooLargeError('Image dimensions too large') from e
+    except Exception as e:
+        INGEST_REJECTED.labels('invalid').inc()
+        raise IngestError('Invalid image file') from e
+    finally:
+        fp.seek(position)
+
+    # 不在允许列表中：再不加限制地识别一次，只为给出准确的错误信息
+    try:
+        detected = _open_header(fp, None).format
+    except Exception:
+        detected = None
+    finally:
+        fp.seek(position)
+    if detected:
+        INGEST_REJECTED.labels('format').inc()
+        raise UnsupportedFormatError(
+            f"Unsupported image format: {detected}. Allowed: {', '.join(formats)}")
+    INGEST_REJECTED.labels('invalid').inc()
+    raise IngestError('Invalid image file')
+
+
+def check_image(source, max_pixels=INGEST_MAX_PIXELS, formats=None):
+    """校验格式和像素数，通过时返回 ImageHeader，否则抛出 IngestError"""
+    header = sniff(source, formats)
+    if max_pixels and header.pixels > max_pixels:
+        INGEST_REJECTED.labels('pixels').inc()
+        logger.warning(f"拒绝超大图片: {header.format} {header.width}x{header.height}")
+        raise ImageTooLargeError(
+            f'Image dimensions too large ({header.width}x{header.height}). Maximum {max_pixels} pixels allowed.')
+    INPUT_PIXELS.observe(header.pixels)
+    return header
+
+
+def check_file(path, **kwargs):
+    """校验磁盘上的图片文件（分块上传），只读取文件头"""
+    with open(path, 'rb') as f:
+        return check_image(f, **kwargs)
+
+
+# tracemalloc 只有一个进程级的峰值，同一时刻只跟踪一个请求，避免并发请求互相 reset_peak
+_trace_lock = threading.Lock()
+
+
+class MemoryProbe:
+    """请求期间的堆峰值内存（近似值）
+
+    开启 MEMORY_TRACE 时用 tracemalloc 统计 Python 堆的峰值增量。同一时刻只跟踪一个请求，
+    其他并发请求不跟踪 (peak() 返回 None)；跟踪期间并发请求的分配和释放同样会计入，
+    因此记录的是这段时间进程堆的峰值增量，而不是严格的单请求用量。始终同时记录进程 RSS 的高水位。
+    """
+
+    __slots__ = ('start_traced', 'peak_traced')
+
+    def __init__(self):
+        self.start_traced = self.peak_traced = None
+        if MEMORY_TRACE and _trace_lock.acquire(blocking=False):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.start_traced = tracemalloc.get_traced_memory()[0]
+
+    def close(self):
+        """结束跟踪并让出跟踪权，可重复调用"""
+        if self.start_traced is not None and self.peak_traced is None:
+            self.peak_traced = tracemalloc.get_traced_memory()[1]
+            _trace_lock.release()
+
+    def peak(self):
+        """结束跟踪并返回堆峰值增量（字节），未跟踪本请求时返回 None"""
+        self.close()
+        if self.start_traced is None:
+            return None
+        return max(self.peak_traced - self.start_traced, 0)
+
+
+def process_peak_rss():
+    """进程 RSS 高水位（字节），平台不支持时返回 None"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux 下单位为 KB
@@ -0,0 +1,600 @@
+# job_queue.py - 持久化任务队列与独立 worker
+#
+# 默认的 JobManager 在 Web 进程内的线程池中执行任务，重启或发布时进行中的任务全部丢失，
+# 也无法把推理放到其他机器上。设置 JOB_BACKEND=sqlite 后：
+# - Web 进程只负责把输入写入共享存储、在队列中登记任务，以及查询状态和读取结果；
+# - 独立的 worker 进程 (python worker.py) 以租约方式领取任务，定期续约，结果写入共享存储；
+# - worker 崩溃或失联时租约过期，任务被其他 worker 重新领取，超过最大尝试次数后标记为失败；
+# - 执行中的暂时性故障 (上游熔断、限流等) 按指数退避加抖动延后重新领取，与租约过期分开计数。
+#
+# JobQueue 定义了队列接口，SQLiteJobQueue 是单机（或共享磁盘）实现；
+# 换成 Redis / 数据库等实现时 Web 和 worker 的代码不需要改动。
+
+import os
+import json
+import time
+import random
+import uuid
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import logging
+
+from jobs import QUEUED, RUNNING, SUCCEEDED, FAILED, JOB_QUEUE_SIZE, JOB_RESULT_TTL, QueueFullError
+from rate_limit import Flow, bind_flow, current_flow
+
+logger = logging.getLogger(__name__)
+
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")                       # memory: 进程内线程池；sqlite: 持久化队列 + worker
+JOB_QUEUE_DB = os.getenv(
+    "JOB_QUEUE_DB", os.path.join(tempfile.gettempdir(), "super-resolution-jobs.sqlite3")
+)                                                                       # SQLite 队列文件
+JOB_STORAGE_DIR = os.getenv(
+    "JOB_STORAGE_DIR", os.path.join(tempfile.gettempdir(), "super-resolution-jobs")
+)                                                                       # 任务输入和结果的共享存储目录
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))        # 租约时长(秒)，worker 每 1/3 租约续约一次
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))             # 租约过期后最多重新执行的次数
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", str(JOB_QUEUE_SIZE * 10)))  # 排队和执行中任务上限，超出返回 429
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))  # 队列为空时 worker 的轮询间隔(秒)
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "5"))               # 暂时性故障后最多重新执行的次数
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))  # 暂时性故障后的首次退避(秒)，之后逐次翻倍
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))  # 退避时间上限(秒)
+
+LOST_WORKER_ERROR = 'Job failed repeatedly (worker lost). Please try again.'
+
+
+class FileJobStorage:
+    """共享目录存储：inputs/<job_id> 为输入图片，results/<job_id> 为结果"""
+
+    def __init__(self, directory=JOB_STORAGE_DIR):
+        self.directory = directory
+        for sub in ('inputs', 'results'):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+
+    def _path(self, kind, job_id):
+        return os.path.join(self.directory, kind, job_id)
+
+    def put(self, kind, job_id, data):
+        # 先写临时文件再原子替换，读取方不会看到写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.directory, kind), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(kind, job_id))
+
+    def put_file(self, kind, job_id, path):
+        """把已有文件移入存储（同一文件系统时不复制数据）"""
+        shutil.move(path, self._path(kind, job_id))
+
+    def get(self, kind, job_id):
+        try:
+            with open(self._path(kind, job_id), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, kind, job_id):
+        try:
+            os.remove(self._path(kind, job_id))
+        except FileNotFoundError:
+            pass
+
+
+class JobQueue:
+    """持久化任务队列接口"""
+
+    def enqueue(self, job_id, params):
+        raise NotImplementedError
+
+    def claim(self, worker_id, lease_seconds):
+        """领取一个任务并加租约，返回任务字典；没有可执行的任务时返回 None"""
+        raise NotImplementedError
+
+    def extend_lease(self, job_id, worker_id, lease_seconds):
+        """续约，租约已被他人接管时返回 False"""
+        raise NotImplementedError
+
+    def set_progress(self, job_id, worker_id, event):
+        raise NotImplementedError
+
+    def complete(self, job_id, worker_id, info):
+        raise NotImplementedError
+
+    def fail(self, job_id, worker_id, error, info=None):
+        raise NotImplementedError
+
+    def release(self, job_id, worker_id, error=None, delay=0):
+        """执行遇到暂时性故障时放弃任务，delay 秒后才能被重新领取；重试次数用完时以 error 标记为失败"""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def purge(self, older_than):
+        """删除在 older_than 之前结束的任务，返回被删除的任务 ID"""
+        raise NotImplementedError
+
+
+class SQLiteJobQueue(JobQueue):
+    """基于 SQLite 的队列，多个进程通过 BEGIN IMMEDIATE 事务互斥地领取任务"""
+
+    def __init__(self, path=JOB_QUEUE_DB, max_attempts=JOB_MAX_ATTEMPTS, max_retries=JOB_MAX_RETRIES,
+                 clock=time.time):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.max_retries = max_retries
+        self._clock = clock
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    info TEXT NOT NULL DEFAULT '{}',
+                    progress TEXT,
+                    retries INTEGER NOT NULL DEFAULT 0,
+                    not_before REAL,
+                    seq INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            # 旧版本创建的队列文件补上新增的列
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, definition in (('retries', 'INTEGER NOT NULL DEFAULT 0'), ('not_before', 'REAL'),
+                                       ('seq', 'INTEGER NOT NULL DEFAULT 0')):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+        # 建表用的连接不保留：队列可能在 gunicorn master 中创建，SQLite 连接不能跨 fork 使用
+        self.close()
+
+    def _connection(self):
+        # 每个线程一个连接；WAL 模式下读不阻塞写
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    class _Transaction:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def __enter__(self):
+            self.conn.execute('BEGIN IMMEDIATE')
+            return self.conn
+
+        def __exit__(self, exc_type, exc, tb):
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+            return False
+
+    def _transaction(self):
+        return self._Transaction(self._connection())
+
+    def close(self):
+        """关闭当前线程的连接，之后的调用会重新连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def enqueue(self, job_id, params):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), self._clock()),
+            )
+
+    def claim(self, worker_id, lease_seconds):
+        while True:
+            now = self._clock()
+            with self._transaction() as conn:
+                row = conn.execute(
+                    "SELECT id, attempts, retries FROM jobs "
+                    "WHERE (status = ? AND (not_before IS NULL OR not_before <= ?)) "
+                    "OR (status = ? AND lease_expires < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                # 主动释放 (暂时性故障) 的执行不算作 worker 失联
+                if row['attempts'] - row['retries'] >= self.max_attempts:
+                    # 多次执行都没有完成（worker 崩溃或失联），不再重试
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_owner = NULL, seq = seq + 1 "
+                        "WHERE id = ?",
+                        (FAILED, LOST_WORKER_ERROR, now, row['id']),
+                    )
+                    logger.warning(f"任务 {row['id']} 已尝试 {row['attempts']} 次，标记为失败")
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                    "started_at = COALESCE(started_at, ?), seq = seq + 1 WHERE id = ?",
+                    (RUNNING, worker_id, now + lease_seconds, now, row['id']),
+                )
+                return self._row_to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone())
+
+    def _update_owned(self, job_id, worker_id, assignments, values):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND lease_owner = ? AND status = ?",
+                (*values, job_id, worker_id, RUNNING),
+            )
+            return cursor.rowcount == 1
+
+    def extend_lease(self, job_id, worker_id, lease_seconds):
+        return self._update_owned(job_id, worker_id, "lease_expires = ?", (self._clock() + lease_seconds,))
+
+    def set_progress(self, job_id, worker_id, event):
+        return self._update_owned(job_id, worker_id, "progress = ?, seq = seq + 1", (json.dumps(event),))
+
+    def complete(self, job_id, worker_id, info):
+        return self._update_owned(
+            job_id, worker_id,
+            "status = ?, finished_at = ?, info = ?, lease_owner = NULL, lease_expires = NULL, seq = seq + 1",
+            (SUCCEEDED, self._clock(), json.dumps(info)),
+        )
+
+    def fail(self, job_id, worker_id, error, info=None):
+        return self._update_owned(
+            job_id, worker_id,
+            "status = ?, finished_at = ?, error = ?, info = ?, lease_owner = NULL, lease_expires = NULL, "
+            "seq = seq + 1",
+            (FAILED, self._clock(), error, json.dumps(info or {})),
+        )
+
+    def release(self, job_id, worker_id, error=None, delay=0):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT retries FROM jobs WHERE id = ? AND lease_owner = ? AND status = ?",
+                (job_id, worker_id, RUNNING),
+            ).fetchone()
+            if row is None:
+                return False
+            now = self._clock()
+            if row['retries'] + 1 > self.max_retries:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ?, error = ?, retries = retries + 1, "
+                    "lease_owner = NULL, lease_expires = NULL, seq = seq + 1 WHERE id = ?",
+                    (FAILED, now, error or 'Job failed repeatedly. Please try again.', job_id),
+                )
+                logger.warning(f"任务 {job_id} 已重试 {row['retries']} 次，标记为失败: {error}")
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, not_before = ?, retries = retries + 1, "
+                    "lease_owner = NULL, lease_expires = NULL, seq = seq + 1 WHERE id = ?",
+                    (QUEUED, now + delay, job_id),
+                )
+            return True
+
+    def get(self, job_id):
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def stats(self):
+        conn = self._connection()
+        statuses = {row['status']: row['count'] for row in conn.execute(
+            "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")}
+        now = self._clock()
+        workers = conn.execute(
+            "SELECT COUNT(DISTINCT lease_owner) FROM jobs WHERE status = ? AND lease_expires >= ?",
+            (RUNNING, now),
+        ).fetchone()[0]
+        avg_duration = conn.execute(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM jobs "
+            "WHERE status = ? ORDER BY finished_at DESC LIMIT 20)", (SUCCEEDED,),
+        ).fetchone()[0]
+        return {
+            'jobs': statuses,
+            'pending': statuses.get(QUEUED, 0) + statuses.get(RUNNING, 0),
+            'active_workers': workers,
+            'avg_duration': round(avg_duration, 2) if avg_duration else None,
+        }
+
+    def purge(self, older_than):
+        with self._transaction() as conn:
+            ids = [row['id'] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (SUCCEEDED, FAILED, older_than))]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+        return ids
+
+    @staticmethod
+    def _row_to_dict(row):
+        data = dict(row)
+        data['params'] = json.loads(data['params'])
+        data['info'] = json.loads(data['info'] or '{}')
+        data['progress'] = json.loads(data['progress']) if data['progress'] else None
+        return data
+
+
+class DurableJob:
+    """持久化任务的只读视图，接口与 jobs.Job 一致；结果在访问时才从共享存储读取"""
+
+    def __init__(self, row, storage):
+        self._storage = storage
+        self.id = row['id']
+        self.status = row['status']
+        self.created_at = row['created_at']
+        self.started_at = row['started_at']
+        self.finished_at = row['finished_at']
+        self.error = row['error']
+        self.info = row['info']
+        self.attempts = row['attempts']
+        self.progress = row['progress']
+        self.seq = row.get('seq') or 0
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    @property
+    def result(self):
+        return self._storage.get('results', self.id)
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': round(self.created_at, 3),
+            'attempts': self.attempts,
+        }
+        if self.started_at:
+            data['queue_time'] = round(self.started_at - self.created_at, 2)
+        if self.finished_at:
+            data['processing_time'] = round(self.finished_at - (self.started_at or self.created_at), 2)
+        if self.error:
+            data['error'] = self.error
+        if self.progress and not self.done:
+            data['progress'] = self.progress
+        data.update(self.info)
+        return data
+
+
+class DurableJobManager:
+    """Web 侧的持久化任务管理，接口与 jobs.JobManager 一致（submit / get / stats / shutdown）"""
+
+    durable = True
+
+    def __init__(self, queue, storage, max_pending=JOB_MAX_PENDING, result_ttl=JOB_RESULT_TTL):
+        self.queue = queue
+        self.storage = storage
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._last_purge = 0.0
+
+    def submit(self, payload):
+        """payload: image_data (字节) 或 image_path (移入共享存储的文件)，以及 backend"""
+        self._purge_expired()
+        stats = self.queue.stats()
+        if stats['pending'] >= self.max_pending:
+            workers = max(stats['active_workers'], 1)
+            raise QueueFullError(max(1, int((stats['avg_duration'] or 10.0) * stats['pending'] / workers)))
+
+        job_id = uuid.uuid4().hex
+        if 'image_path' in payload:
+            self.storage.put_file('inputs', job_id, payload['image_path'])
+        else:
+            self.storage.put('inputs', job_id, payload['image_data'])
+        backend = payload['backend']
+        params = {'backend': getattr(backend, 'name', backend)}
+        if payload.get('flow'):
+            params['flow'] = list(payload['flow'])  # worker 按提交者的份额参与上游公平调度
+        self.queue.enqueue(job_id, params)
+        logger.info(f"任务 {job_id} 已写入持久化队列，当前待处理任务数: {stats['pending'] + 1}")
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = self.queue.get(job_id)
+        return DurableJob(row, self.storage) if row else None
+
+    def stats(self):
+        data = self.queue.stats()
+        data['backend'] = 'durable'
+        data['max_pending'] = self.max_pending
+        return data
+
+    def shutdown(self, wait=True):
+        pass
+
+    def poll_events(self, job_id, interval=0.5, timeout=None):
+        """轮询任务状态生成进度事件（worker 在其他进程中执行，无法直接推送）
+
+        事件 ID 由队列中持久化的 seq (每次状态或进度变化加一) 推导，断线重连后仍然单调递增：
+        重连时重新生成的当前状态事件 ID 不变，会被 Last-Event-ID 过滤，之后的新事件 (包括结束事件) 都更大。
+        """
+        last_progress = None
+        last_status = None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                return
+            events = []
+            if job.status != last_status and job.status in (QUEUED, RUNNING):
+                events.append({'stage': 'queued' if job.status == QUEUED else 'started'})
+            if job.progress and job.progress != last_progress and not job.done:
+                events.append(dict(job.progress))
+            if job.status == SUCCEEDED:
+                events.append({'stage': 'done', 'processing_time': job.to_dict().get('processing_time')})
+            elif job.status == FAILED:
+                events.append({'stage': 'failed', 'error': job.error})
+            last_status, last_progress = job.status, job.progress
+            for offset, event in enumerate(events, 1):
+                event['id'] = job.seq * 3 + offset  # 每轮最多三个事件：状态、进度、结束
+                yield event
+            if job.done:
+                return
+            yield None  # 本轮没有新事件，调用方可以借此发送心跳
+            time.sleep(interval)
+
+    def _purge_expired(self):
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        for job_id in self.queue.purge(now - self.result_ttl):
+            self.storage.delete('inputs', job_id)
+            self.storage.delete('results', job_id)
+
+
+class _QueueProgressChannel:
+    """worker 中使用的进度通道：把最新的阶段写入队列，供 Web 侧查询（同一阶段的事件限频）"""
+
+    def __init__(self, queue, job_id, worker_id, min_interval=0.5):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.min_interval = min_interval
+        self._last_stage = None
+        self._last_write = 0.0
+
+    def emit(self, stage, **data):
+        now = time.monotonic()
+        if stage == self._last_stage and now - self._last_write < self.min_interval:
+            return
+        self._last_stage, self._last_write = stage, now
+        event = {'stage': stage, 'time': round(time.time(), 3)}
+        event.update(data)
+        try:
+            self.queue.set_progress(self.job_id, self.worker_id, event)
+        except sqlite3.Error as e:
+            logger.warning(f"写入任务进度失败: {str(e)}")
+
+
+class Worker:
+    """独立的任务执行进程：领取任务、续约、执行，结果写入共享存储
+
+    runner(image_data, backend_name, info) 返回结果字节，失败返回 None；
+    抛出 ValueError 表示输入无效，直接失败；其他异常会释放任务，退避后重试。
+    """
+
+    def __init__(self, queue, storage, runner, worker_id=None, lease_seconds=JOB_LEASE_SECONDS,
+                 poll_interval=WORKER_POLL_INTERVAL, retry_base=JOB_RETRY_BASE_SECONDS,
+                 retry_max=JOB_RETRY_MAX_SECONDS):
+        self.queue = queue
+        self.storage = storage
+        self.runner = runner
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._stop = threading.Event()
+        self.processed = 0
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        logger.info(f"worker {self.worker_id} 已启动")
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._stop.wait(self.poll_interval)
+        logger.info(f"worker {self.worker_id} 已停止")
+
+    def run_once(self):
+        """领取并执行一个任务，队列为空时返回 False"""
+        job = self.queue.claim(self.worker_id, self.lease_seconds)
+        if job is None:
+            return False
+
+        job_id = job['id']
+        lost = threading.Event()
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(self.lease_seconds / 3):
+                if not self.queue.extend_lease(job_id, self.worker_id, self.lease_seconds):
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=heartbeat, name=f'lease-{job_id[:8]}', daemon=True)
+        thread.start()
+        try:
+            self._execute(job, lost)
+        finally:
+            stop_heartbeat.set()
+            thread.join()
+            self.processed += 1
+        return True
+
+    def retry_delay(self, retries, error=None):
+        """指数退避加抖动；熔断或限流给出了剩余等待时间时不早于该时间"""
+        backoff = min(self.retry_base * 2 ** retries, self.retry_max) * random.uniform(0.5, 1.5)
+        return max(backoff, getattr(error, 'retry_after', 0) or 0)
+
+    def _execute(self, job, lost):
+        import progress
+
+        job_id = job['id']
+        info = {'worker': self.worker_id}
+        image_data = self.storage.get('inputs', job_id)
+        if image_data is None:
+            self.queue.fail(job_id, self.worker_id, 'Job input is missing', info)
+            return
+
+        logger.info(f"worker {self.worker_id} 开始执行任务 {job_id} (第 {job['attempts']} 次)")
+        channel = _QueueProgressChannel(self.queue, job_id, self.worker_id)
+        flow = job['params'].get('flow')
+        try:
+            with progress.bind(channel), bind_flow(Flow(*flow) if flow else current_flow()):
+                result = self.runner(image_data, job['params']['backend'], info)
+        except ValueError as e:
+            self.queue.fail(job_id, self.worker_id, str(e), info)
+            return
+        except Exception as e:
+            # 可能是暂时性故障（例如上游熔断），退避一段时间后再重新领取
+            delay = self.retry_delay(job.get('retries', 0), e)
+            logger.error(f"任务 {job_id} 执行出错，{delay:.1f} 秒后重试: {str(e)}")
+            self.queue.release(job_id, self.worker_id, str(e), delay)
+            return
+
+        if lost.is_set():
+            logger.warning(f"任务 {job_id} 的租约已被接管，丢弃本次结果")
+            return
+        if result is None:
+            self.queue.fail(job_id, self.worker_id, 'Failed to upscale image. Please try again.', info)
+            return
+        self.storage.put('results', job_id, result)
+        if self.queue.complete(job_id, self.worker_id, info):
+            self.storage.delete('inputs', job_id)
+        else:
+            logger.warning(f"任务 {job_id} 的租约已被接管，结果未登记")
+
+
+def check_shared_paths(queue_db=JOB_QUEUE_DB, storage_dir=JOB_STORAGE_DIR):
+    """Web 和 worker 必须使用同一个队列文件和存储目录；仍在系统临时目录下时返回提示（不同机器或容器之间不共享）"""
+    temp = os.path.realpath(tempfile.gettempdir())
+    local = [name for name, path in (('JOB_QUEUE_DB', queue_db), ('JOB_STORAGE_DIR', storage_dir))
+             if os.path.realpath(path).startswith(temp + os.sep)]
+    if not local:
+        return None
+    return (f"{' / '.join(local)} 位于系统临时目录，只有同一台机器上的 Web 和 worker 进程能共享；"
+            f"Web 和 worker 运行在不同的机器或容器 (如平台上的 web / worker 进程) 时需要指向共享磁盘")
+
+
+def create_job_queue():
+    warning = check_shared_paths()
+    if warning:
+        logger.warning(warning)
+    return SQLiteJobQueue()
+
+
+def create_job_storage():
+    return FileJobStorage()
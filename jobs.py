@@ -0,0 +1,178 @@
+# jobs.py - 异步超分任务管理（有界线程池 + 队列深度限制）
+
+import os
+import time
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import progress
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))            # 同时执行的任务数
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "8"))      # 允许排队等待的任务数
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "600"))    # 已完成任务结果保留时间(秒)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """任务队列已满"""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class Job:
+    """单个超分任务"""
+
+    def __init__(self, payload):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.info = {}  # 处理过程中产生的附加信息（预处理指标、是否命中缓存等）
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': round(self.created_at, 3),
+        }
+        if self.started_at:
+            data['queue_time'] = round(self.started_at - self.created_at, 2)
+        if self.finished_at:
+            data['processing_time'] = round(self.finished_at - (self.started_at or self.created_at), 2)
+        if self.error:
+            data['error'] = self.error
+        data.update(self.info)
+        return data
+
+
+class JobManager:
+    """在有界线程池中执行任务，超出队列深度时拒绝提交
+
+    runner(payload, info) 返回结果字节，失败返回 None；info 字典会合并到任务状态中。
+    传入 progress_registry 时每个任务有一个同 ID 的进度通道，runner 执行期间绑定到该通道。
+    """
+
+    durable = False  # 任务只保存在本进程内存中，见 job_queue.DurableJobManager
+
+    def __init__(self, runner, max_workers=JOB_WORKERS, max_queue=JOB_QUEUE_SIZE,
+                 result_ttl=JOB_RESULT_TTL, progress_registry=None):
+        self.runner = runner
+        self.progress_registry = progress_registry
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upscale-job')
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._avg_duration = 10.0  # 任务平均耗时估计，用于计算 Retry-After
+
+    def submit(self, payload):
+        with self._lock:
+            self._purge_expired()
+            if self._pending >= self.max_workers + self.max_queue:
+                raise QueueFullError(self._estimate_wait())
+            job = Job(payload)
+            self._jobs[job.id] = job
+            self._pending += 1
+            position = max(self._pending - self.max_workers, 0)
+            eta = self._estimate_wait() if position else 0
+        channel = self._channel(job)
+        if channel is not None:
+            channel.emit('queued', position=position, eta=eta)
+        self._executor.submit(self._run, job)
+        logger.info(f"任务 {job.id} 已提交，当前待处理任务数: {self._pending}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'pending': self._pending,
+                'jobs': statuses,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _channel(self, job):
+        if self.progress_registry is None:
+            return None
+        return self.progress_registry.get_or_create(job.id)
+
+    def _run(self, job):
+        channel = self._channel(job)
+        with progress.bind(channel):
+            progress.emit('started')
+            self._execute(job)
+        if channel is not None:
+            if job.status == SUCCEEDED:
+                channel.emit(progress.DONE, processing_time=round(job.finished_at - job.started_at, 2))
+            else:
+                channel.emit(progress.FAILED, error=job.error)
+
+    def _execute(self, job):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            result = self.runner(job.payload, job.info)
+            if result is None:
+                job.error = 'Failed to upscale image. Please try again.'
+                job.status = FAILED
+            else:
+                job.result = result
+                job.status = SUCCEEDED
+        except ValueError as e:
+            # 输入无效（例如无法解码的图片），错误信息可以直接返回给客户端
+            job.error = str(e)
+            job.status = FAILED
+        except Exception as e:
+            logger.error(f"任务 {job.id} 执行失败: {str(e)}")
+            job.error = 'Internal server error'
+            job.status = FAILED
+        finally:
+            job.payload = None
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+                duration = job.finished_at - job.started_at
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    def _estimate_wait(self):
+        # 队列中的任务按 workers 并行消化，估算下一个空位出现的时间
+        return max(1, int(self._avg_duration * self._pending / max(self.max_workers, 1)))
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.done and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
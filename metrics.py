@@ -0,0 +1,255 @@
+# metrics.py - Prometheus 文本格式的运行指标
+#
+# 只依赖标准库的极简实现：Counter / Gauge / Histogram，支持标签，线程安全。
+# 每次记录只是一次加锁的加法（直方图多一次二分查找），可以在生产环境常开。
+# 缓存、连接池、重试等模块已有的计数不重复记录，在抓取 /metrics 时通过 collector 读取快照。
+
+import time
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认延迟桶(秒)：覆盖从毫秒级的编码到分钟级的远程推理
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) + '.0'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Registry:
+    """指标注册表，render() 输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, collector):
+        """collector() 返回 [(名称, 类型, 说明, [(标签字典, 值), ...]), ...]，在抓取时调用"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for collector in collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        registry.register(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in sorted(children):
+            labels = list(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield self.name + suffix, labels + extra, value
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [('', [], self.value)]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        result, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            result.append(('_bucket', [('le', _format_value(float(bound)))], cumulative))
+        result.append(('_sum', [], total))
+        result.append(('_count', [], cumulative))
+        return result
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+
+# 超分链路的指标
+STAGE_SECONDS = Histogram(
+    'upscale_stage_seconds', 'Time spent in each stage of the upscale pipeline', ['stage'])
+UPSTREAM_ATTEMPT_SECONDS = Histogram(
+    'upstream_attempt_seconds', 'Duration of a single remote inference attempt', ['model', 'outcome'])
+UPSTREAM_RESPONSES = Counter(
+    'upstream_responses_total', 'Remote inference attempts by HTTP status or transport error', ['model', 'status'])
+BYTES = Counter(
+    'upscale_bytes_total', 'Image bytes received from clients and returned to them', ['direction'])
+ERRORS = Counter(
+    'upscale_errors_total', 'Failed upscale requests by error type', ['type'])
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests by endpoint and status code', ['endpoint', 'status'])
+REQUEST_SECONDS = Histogram(
+    'http_request_seconds', 'HTTP request latency by endpoint', ['endpoint'])
+IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests currently being processed', ['endpoint'])
+
+
+_stage_observers = []
+
+
+def add_stage_observer(observer):
+    """observer(stage, seconds) 在每次记录阶段耗时时调用，用于请求级的耗时分解 (见 profiling)"""
+    _stage_observers.append(observer)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    for observer in _stage_observers:
+        observer(stage, seconds)
+
+
+class time_stage:
+    """with time_stage('preprocess'): ... 记录该阶段耗时"""
+
+    __slots__ = ('stage', 'child', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.child = STAGE_SECONDS.labels(stage)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.child.observe(elapsed)
+        for observer in _stage_observers:
+            observer(self.stage, elapsed)
+        return False
+
+
+def counters_from_snapshot(name, documentation, snapshot, label, names, kind='counter'):
+    """把模块已有的统计快照转换成 collector 的一条指标"""
+    return (name, kind, documentation, [({label: key}, snapshot[key]) for key in names if key in snapshot])
+
+
+def render():
+    return REGISTRY.render()
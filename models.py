@@ -0,0 +1,131 @@
+# models.py - 模型注册表与按延迟选择模型的路由
+#
+# 每个模型有自己的地址、放大倍数、单次推理最大输入和超时，注册为独立的 HFBackend
+# （各自的熔断器和耗时统计）。客户端指定 model=auto 时，由路由按实测耗时、错误率
+# 和图片大小挑选预计最快的可用模型：小图交给轻量模型，大模型留给需要的时候。
+
+import os
+import json
+import math
+import logging
+
+from backends import HFBackend, get_backend, register_backend, register_alias
+from retry_policy import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+HF_API_BASE = os.getenv("HF_API_BASE", "https://api-inference.huggingface.co/models/")  # 模型只写仓库名时使用的地址前缀
+MODELS_CONFIG = os.getenv("MODELS_CONFIG", "")                           # 模型配置 JSON 文件，可覆盖或新增模型
+ROUTER_ERROR_PENALTY = float(os.getenv("ROUTER_ERROR_PENALTY", "4"))     # 错误率对预计耗时的惩罚系数
+
+AUTO = 'auto'
+
+# 内置模型：repo 为 Hugging Face 仓库名，expected_latency 为没有实测数据时的预估耗时(秒)
+DEFAULT_MODELS = [
+    {'name': 'real-esrgan', 'repo': 'ai-forever/Real-ESRGAN', 'scale': 4,
+     'max_input_pixels': 1024 * 1024, 'timeout': 180, 'expected_latency': 8},
+    {'name': 'swin2sr-x2', 'repo': 'microsoft/swin2SR-classical-sr-x2-64', 'scale': 2,
+     'max_input_pixels': 512 * 512, 'timeout': 120, 'expected_latency': 4},
+    {'name': 'sd-x4', 'repo': 'stabilityai/stable-diffusion-x4-upscaler', 'scale': 4,
+     'max_input_pixels': 512 * 512, 'timeout': 240, 'expected_latency': 30},
+]
+
+
+class ModelSpec:
+    """单个模型的配置"""
+
+    def __init__(self, name, url=None, repo=None, scale=4, max_input_pixels=None, timeout=180,
+                 expected_latency=None):
+        if not url and not repo:
+            raise ValueError(f'Model {name} needs a url or repo')
+        self.name = name
+        self.url = url or HF_API_BASE.rstrip('/') + '/' + repo
+        self.scale = int(scale)
+        self.max_input_pixels = int(max_input_pixels) if max_input_pixels else None
+        self.timeout = float(timeout)
+        self.expected_latency = float(expected_latency) if expected_latency else None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'url': self.url,
+            'scale': self.scale,
+            'max_input_pixels': self.max_input_pixels,
+            'timeout': self.timeout,
+        }
+
+
+def load_model_specs(path=MODELS_CONFIG):
+    """内置模型加上配置文件中的模型（同名覆盖）"""
+    entries = {entry['name']: dict(entry) for entry in DEFAULT_MODELS}
+    if path:
+        with open(path, encoding='utf-8') as f:
+            for entry in json.load(f):
+                entries[entry['name']] = entry
+        logger.info(f"已从 {path} 加载模型配置")
+    return [ModelSpec(**entry) for entry in entries.values()]
+
+
+def register_models(specs, api_token, default_url=None):
+    """为每个模型注册一个后端，返回参与自动路由的后端列表
+
+    地址与默认后端 (hf) 相同的模型不重复创建，以别名指向默认后端，共用熔断器和统计。
+    """
+    backends = []
+    for spec in specs:
+        default = get_backend('hf')
+        if default is not None and spec.url == default_url:
+            register_alias(spec.name, 'hf')
+            default.max_input_pixels = spec.max_input_pixels
+            default.expected_latency = spec.expected_latency
+            backends.append(default)
+            continue
+        backends.append(register_backend(HFBackend(
+            spec.url, api_token,
+            scale=spec.scale,
+            read_timeout=spec.timeout,
+            name=spec.name,
+            max_input_pixels=spec.max_input_pixels,
+            expected_latency=spec.expected_latency,
+        )))
+    return backends
+
+
+class ModelRouter:
+    """model=auto 时挑选预计耗时最短的健康模型"""
+
+    def __init__(self, backends, error_penalty=ROUTER_ERROR_PENALTY):
+        self.backends = list(backends)
+        self.error_penalty = error_penalty
+
+    def estimate(self, backend, pixels=None):
+        """预计耗时 × (1 + 惩罚系数 × 错误率)
+
+        图片大小已知且有实测数据时按每百万像素耗时估算，否则为平均单次耗时 × 需要的分块数。
+        """
+        per_megapixel = backend.latency.per_megapixel()
+        if pixels and per_megapixel is not None:
+            latency = per_megapixel * pixels / 1e6
+        else:
+            latency = backend.latency.expected(backend.expected_latency or 1.0)
+            if pixels and backend.max_input_pixels:
+                latency *= math.ceil(pixels / backend.max_input_pixels)
+        return latency * (1 + self.error_penalty * backend.latency.error_rate)
+
+    def choose(self, pixels=None, scale=None):
+        """返回选中的后端；没有符合放大倍数的模型时返回 None"""
+        candidates = [b for b in self.backends if scale is None or b.scale == scale]
+        if not candidates:
+            return None
+        # 熔断中的模型不参与选择；全部熔断时仍返回一个，由调用方得到 503
+        healthy = [b for b in candidates if b.breaker.state != CircuitBreaker.OPEN] or candidates
+        return min(healthy, key=lambda backend: self.estimate(backend, pixels))
+
+    def snapshot(self):
+        return [{
+            'name': backend.name,
+            'scale': backend.scale,
+            'state': backend.breaker.state,
+            'estimated_latency': round(self.estimate(backend), 3),
+            **backend.latency.snapshot(),
+        } for backend in self.backends]
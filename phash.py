@@ -0,0 +1,274 @@
+# phash.py - 基于感知哈希 (dHash) 的近似重复输入查找
+#
+# 结果缓存按输入字节的 sha256 寻址，同一张照片被聊天软件重新压缩、去掉 EXIF 或尺寸改变几个像素后
+# 字节完全不同，每个变体都会触发一次远程推理。dHash 把图片缩小为 9x8 灰度图，比较相邻像素的明暗
+# 得到 64 位指纹，这类变体的指纹只相差几位。
+#
+# 已完成超分的输入按模型分别存入 BK 树，按汉明距离做次线性的近邻查询。候选结果在复用前还要经过
+# 廉价的校验：宽高比一致、尺寸相差不超过 10%、16x16 灰度缩略图的平均像素差不超过阈值；
+# 尺寸不同时把缓存的结果缩放到当前输入对应的输出尺寸。
+
+import io
+import os
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from PIL import Image
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "false").lower() == "true"   # 是否复用近似重复输入的结果
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "6"))     # dHash 汉明距离阈值 (0-64)
+NEAR_DUPLICATE_MAX_DIFF = float(os.getenv("NEAR_DUPLICATE_MAX_DIFF", "6"))  # 校验时缩略图的平均像素差上限 (0-255)
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "20000"))  # 每个进程索引的输入数上限
+
+HASH_SIZE = 8
+THUMB_SIZE = 16
+# 校验时允许的宽高比差异和尺寸差异（相对值）
+MAX_ASPECT_DIFF = 0.01
+MAX_SCALE_DIFF = 0.1
+
+NEAR_DUPLICATE_LOOKUPS = Counter(
+    'near_duplicate_lookups_total', 'Perceptual-hash lookups after an exact cache miss', ['outcome'])
+NEAR_DUPLICATE_DISTANCE_HIST = Histogram(
+    'near_duplicate_distance', 'dHash Hamming distance of reused near-duplicate inputs',
+    buckets=(0, 1, 2, 4, 6, 8, 12, 16))
+
+# EXIF Orientation 对应的变换，与 ImageOps.exif_transpose 相同
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+Fingerprint = namedtuple('Fingerprint', ['hash', 'width', 'height', 'thumb'])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def fingerprint(image_data, transpose=True):
+    """计算 dHash 和校验用的灰度缩略图，无法解码时返回 None
+
+    transpose 为 True 时先按 EXIF 方向旋转（与预处理一致），宽高也按旋转后计算。
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            width, height = image.size
+            orientation = image.getexif().get(0x0112, 1) if transpose else 1
+            # JPEG 解码时直接按比例缩小，只需要很小的尺寸
+            image.draft('L', (THUMB_SIZE * 4, THUMB_SIZE * 4))
+            gray = image.convert('L')
+    except Exception as e:
+        logger.debug(f"无法计算感知哈希: {str(e)}")
+        return None
+    if orientation in _ORIENTATION_TRANSPOSE:
+        gray = gray.transpose(_ORIENTATION_TRANSPOSE[orientation])
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+
+    pixels = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1) + col
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    thumb = gray.resize((THUMB_SIZE, THUMB_SIZE), Image.BOX).tobytes()
+    return Fingerprint(value, width, height, thumb)
+
+
+def verify(source, target, max_diff):
+    """复用前的校验，返回缩略图平均像素差，不满足条件时返回 None"""
+    source_ratio = source.width / source.height
+    target_ratio = target.width / target.height
+    if abs(source_ratio - target_ratio) > MAX_ASPECT_DIFF * target_ratio:
+        return None
+    if abs(target.width / source.width - 1) > MAX_SCALE_DIFF:
+        return None
+    diff = sum(abs(a - b) for a, b in zip(source.thumb, target.thumb)) / len(target.thumb)
+    return diff if diff <= max_diff else None
+
+
+def adapt_result(result, source, target):
+    """输入尺寸不同时，把 source 对应的超分结果缩放到 target 对应的输出尺寸，保持原编码格式"""
+    if (source.width, source.height) == (target.width, target.height):
+        return result
+    with Image.open(io.BytesIO(result)) as image:
+        image_format = image.format or 'PNG'
+        size = (max(1, round(image.width * target.width / source.width)),
+                max(1, round(image.height * target.height / source.height)))
+        resized = image.resize(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        resized.save(buffer, format='JPEG', quality=95)
+    else:
+        resized.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+class _Node:
+    __slots__ = ('hash', 'children', 'entries')
+
+    def __init__(self, value):
+        self.hash = value
+        self.children = {}  # 汉明距离 -> 子节点
+        self.entries = []
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树，查询时利用三角不等式跳过不可能命中的子树"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value):
+        """插入一个哈希值，返回对应的节点（已存在时返回原节点）"""
+        if self.root is None:
+            self.root = _Node(value)
+            self.size = 1
+            return self.root
+        node = self.root
+        while True:
+            distance = hamming(value, node.hash)
+            if distance == 0:
+                return node
+            child = node.children.get(distance)
+            if child is None:
+                child = node.children[distance] = _Node(value)
+                self.size += 1
+                return child
+            node = child
+
+    def search(self, value, radius):
+        """返回 [(距离, 节点)]，按距离从小到大排列"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node.hash)
+            if distance <= radius:
+                found.append((distance, node))
+            for edge, child in node.children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def __len__(self):
+        return self.size
+
+
+IndexEntry = namedtuple('IndexEntry', ['cache_key', 'fingerprint'])
+
+
+class NearDuplicateIndex:
+    """已超分输入的感知哈希索引，每个模型 (namespace) 一棵 BK 树"""
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE, max_diff=NEAR_DUPLICATE_MAX_DIFF,
+                 max_entries=NEAR_DUPLICATE_MAX_ENTRIES, enabled=NEAR_DUPLICATE_ENABLED):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.max_diff = max_diff
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._trees = {}
+        self._entries = OrderedDict()  # (namespace, cache_key) -> (节点, 条目)，按加入顺序淘汰
+        self.counters = {'hits': 0, 'misses': 0, 'rejected': 0, 'stale': 0}
+
+    def add(self, namespace, cache_key, fp):
+        if not self.enabled or fp is None:
+            return
+        with self._lock:
+            if (namespace, cache_key) in self._entries:
+                return
+            entry = IndexEntry(cache_key, fp)
+            node = self._trees.setdefault(namespace, BKTree()).add(fp.hash)
+            node.entries.append(entry)
+            self._entries[(namespace, cache_key)] = (node, entry)
+            while len(self._entries) > self.max_entries:
+                _, (old_node, old_entry) = self._entries.popitem(last=False)
+                old_node.entries.remove(old_entry)
+            # 淘汰后留下的空节点过多时重建，保持查询开销与条目数相当
+            if sum(len(tree) for tree in self._trees.values()) > 2 * len(self._entries) + 64:
+                self._rebuild()
+
+    def discard(self, namespace, cache_key):
+        with self._lock:
+            item = self._entries.pop((namespace, cache_key), None)
+            if item is not None:
+                # BK 树不支持删除节点，只移除节点上的条目
+                node, entry = item
+                node.entries.remove(entry)
+
+    def _rebuild(self):
+        trees, entries = {}, OrderedDict()
+        for key, (_, entry) in self._entries.items():
+            node = trees.setdefault(key[0], BKTree()).add(entry.fingerprint.hash)
+            node.entries.append(entry)
+            entries[key] = (node, entry)
+        self._trees, self._entries = trees, entries
+
+    def candidates(self, namespace, fp):
+        """汉明距离阈值内的 [(距离, 条目)]，按距离从小到大排列"""
+        with self._lock:
+            tree = self._trees.get(namespace)
+            if tree is None:
+                return []
+            return [(distance, entry) for distance, node in tree.search(fp.hash, self.max_distance)
+                    for entry in node.entries]
+
+    def lookup(self, namespace, fp, load):
+        """查找可复用的近似重复结果，返回 (结果字节, 匹配信息) 或 (None, None)
+
+        load(cache_key) 读取缓存的结果，结果已被淘汰时返回 None。
+        """
+        if not self.enabled or fp is None:
+            return None, None
+        candidates = self.candidates(namespace, fp)
+        outcome = 'misses' if not candidates else 'rejected'
+        for distance, entry in candidates:
+            diff = verify(entry.fingerprint, fp, self.max_diff)
+            if diff is None:
+                continue
+            result = load(entry.cache_key)
+            if result is None:
+                self.discard(namespace, entry.cache_key)
+                outcome = 'stale'
+                continue
+            try:
+                result = adapt_result(result, entry.fingerprint, fp)
+            except Exception as e:
+                logger.warning(f"调整近似重复结果的尺寸失败: {str(e)}")
+                continue
+            self._count('hits')
+            NEAR_DUPLICATE_DISTANCE_HIST.observe(distance)
+            return result, {'distance': distance, 'diff': round(diff, 2)}
+        self._count(outcome)
+        return None, None
+
+    def _count(self, outcome):
+        NEAR_DUPLICATE_LOOKUPS.labels(outcome).inc()
+        with self._lock:
+            self.counters[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            data = dict(self.counters)
+            lookups = sum(data.values())
+            data.update({
+                'enabled': self.enabled,
+                'hit_rate': round(data['hits'] / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_distance': self.max_distance,
+                'max_diff': self.max_diff,
+            })
+            return data
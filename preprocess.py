@@ -0,0 +1,221 @@
+# preprocess.py - 推理前的图片规范化，减小上传和推理的数据量
+#
+# 应用 EXIF 方向、把嵌入 ICC 配置文件的图片转换到 sRGB、统一颜色模式（不透明图片去掉 alpha），
+# 再以无损或保持原量化表的方式重新编码并去掉 EXIF/ICC 等元数据；可选按目标放大倍数限制输入尺寸。
+# 像素没有变化时不重新编码：JPEG / PNG 按段删除元数据，压缩数据原样保留；其他格式只有携带元数据时才无损转为 PNG。
+
+import io
+import os
+import time
+import struct
+import logging
+
+from PIL import Image, ImageOps, JpegImagePlugin
+
+try:
+    from PIL import ImageCms  # Pillow 编译时没有 LittleCMS 则不可用，此时不做颜色空间转换
+except ImportError:
+    ImageCms = None
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+PREPROCESS_MAX_OUTPUT_PIXELS = int(os.getenv("PREPROCESS_MAX_OUTPUT_PIXELS", "0"))  # 0 表示不限制
+
+
+# 只携带元数据、不影响解码的 JPEG 段：APP1-APP13、APP15 (EXIF、XMP、ICC、Photoshop 等) 和 COM；
+# APP0 (JFIF) 和 APP14 (Adobe，决定颜色变换) 保留
+_JPEG_METADATA_MARKERS = set(range(0xE1, 0xEE)) | {0xEF, 0xFE}
+# PNG 的文本、EXIF、修改时间和 ICC 配置文件块
+_PNG_METADATA_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'tIME', b'iCCP'}
+# Pillow 解码后放在 info 中的元数据
+_METADATA_KEYS = ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp', 'comment')
+
+
+class InvalidImageError(ValueError):
+    """上传的内容无法作为图片解码"""
+
+
+def _has_alpha(img):
+    if img.mode in ('RGBA', 'LA'):
+        return True
+    return img.mode == 'P' and 'transparency' in img.info
+
+
+def _canonical_mode(img, actions):
+    """转换为 RGB，只有真正存在透明像素时才保留 RGBA"""
+    if _has_alpha(img):
+        rgba = img.convert('RGBA')
+        if rgba.getchannel('A').getextrema()[0] == 255:
+            actions.append('drop_alpha')
+            return rgba.convert('RGB')
+        if img.mode != 'RGBA':
+            actions.append(f'convert_{img.mode}_RGBA')
+        return rgba
+    if img.mode != 'RGB':
+        actions.append(f'convert_{img.mode}_RGB')
+        return img.convert('RGB')
+    return img
+
+
+def _to_srgb(img, icc_profile, actions):
+    """按嵌入的 ICC 配置文件把像素转换到 sRGB，之后去掉配置文件颜色才不会变"""
+    if ImageCms is None:
+        logger.warning("Pillow 不支持 ICC 颜色管理，按 sRGB 处理")
+        return img
+    try:
+        profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        if 'srgb' in ImageCms.getProfileDescription(profile).lower():
+            return img
+        if img.mode not in ('RGB', 'RGBA', 'CMYK', 'L'):
+            img = img.convert('RGBA' if _has_alpha(img) else 'RGB')
+        output_mode = 'RGBA' if img.mode == 'RGBA' else 'RGB'
+        converted = ImageCms.profileToProfile(img, profile, ImageCms.createProfile('sRGB'), outputMode=output_mode)
+    except (ImageCms.PyCMSError, OSError, ValueError) as e:
+        logger.warning(f"ICC 配置文件转换失败，按 sRGB 处理: {str(e)}")
+        return img
+    actions.append('icc_to_srgb')
+    return converted
+
+
+def _jpeg_params(source):
+    """沿用原图的量化表和色度抽样，避免按固定质量重新编码造成额外损失"""
+    params = {'quality': 95}
+    if len(getattr(source, 'quantization', None) or {}) >= 2:  # 灰度 JPEG 只有一张表，不能用于彩色输出
+        params = {'qtables': source.quantization}
+        sampling = JpegImagePlugin.get_sampling(source)
+        if sampling >= 0:
+            params['subsampling'] = sampling
+    return params
+
+
+def _strip_jpeg(data):
+    """逐段复制 JPEG 并去掉元数据段，熵编码数据原样保留；EOI 之后附加的内容 (如 MPF 缩略图) 一并丢弃"""
+    output = [data[:2]]
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError('Malformed JPEG segment')
+        marker = data[pos + 1]
+        if marker == 0xFF:  # 段之间的填充字节
+            pos += 1
+            continue
+        if marker == 0xDA:  # SOS：之后是压缩数据，熵编码数据中不会出现 FFD9
+            scan = data[pos:]
+            end = scan.find(b'\xff\xd9')
+            output.append(scan if end < 0 else scan[:end + 2])
+            return b''.join(output)
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:  # 没有长度字段的标记
+            output.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        end = pos + 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker not in _JPEG_METADATA_MARKERS:
+            output.append(data[pos:end])
+        pos = end
+    raise ValueError('JPEG has no scan data')
+
+
+def _strip_png(data):
+    """逐块复制 PNG 并去掉元数据块，IDAT 原样保留"""
+    output = [data[:8]]
+    pos = 8
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        end = pos + 12 + length
+        if kind not in _PNG_METADATA_CHUNKS:
+            output.append(data[pos:end])
+        pos = end
+        if kind == b'IEND':
+            break
+    return b''.join(output)
+
+
+def _strip_metadata(image_data, source_format, img, has_metadata):
+    """像素没有变化时去掉元数据，返回 (图片字节, 格式)；JPEG / PNG 不重新编码像素"""
+    strip = {'JPEG': _strip_jpeg, 'PNG': _strip_png}.get(source_format)
+    if strip is not None:
+        try:
+            output = strip(image_data)
+        except (ValueError, struct.error) as e:
+            logger.warning(f"按段去除元数据失败，改为重新编码: {str(e)}")
+        else:
+            # 没有可去掉的内容时结果与原图相同，直接使用原图
+            return (output if len(output) < len(image_data) else image_data), source_format
+    if not has_metadata:
+        return image_data, source_format
+    # 其他格式无法按段删除：无损转为 PNG，即使体积变大也不把元数据送去推理和缓存
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG', icc_profile=None)
+    return buffer.getvalue(), 'PNG'
+
+
+def normalize_image(image_data, scale=None, max_output_pixels=PREPROCESS_MAX_OUTPUT_PIXELS):
+    """规范化图片，返回 (新的图片字节, 前后对比指标)"""
+    start_time = time.time()
+    try:
+        source = Image.open(io.BytesIO(image_data))
+        source.load()
+    except Exception as e:
+        raise InvalidImageError('Invalid image file') from e
+
+    source_format = source.format
+    width_in, height_in = source.size
+    mode_in = source.mode
+    has_metadata = any(source.info.get(key) for key in _METADATA_KEYS)
+    actions = []
+
+    img = source
+    if source.getexif().get(0x0112, 1) != 1:  # EXIF Orientation 标签
+        img = ImageOps.exif_transpose(source)
+        actions.append('exif_orientation')
+    if source.info.get('icc_profile'):
+        img = _to_srgb(img, source.info['icc_profile'], actions)
+    img = _canonical_mode(img, actions)
+
+    # 按目标放大倍数限制输入尺寸，避免输出过大
+    if scale and max_output_pixels and img.width * img.height * scale * scale > max_output_pixels:
+        ratio = (max_output_pixels / (img.width * img.height * scale * scale)) ** 0.5
+        size = (max(1, int(img.width * ratio)), max(1, int(img.height * ratio)))
+        img = img.resize(size, Image.LANCZOS)
+        actions.append('downscale')
+
+    if not actions:
+        # 像素没有变化：只去掉元数据，不为此重新编码
+        output, output_format = _strip_metadata(image_data, source_format, img, has_metadata)
+        if output is not image_data:
+            actions.append('strip_metadata')
+    else:
+        buffer = io.BytesIO()
+        # 像素已在 sRGB 中，显式去掉 ICC 配置文件和注释 (否则 Pillow 会沿用 img.info 中的值)
+        if source_format == 'JPEG' and img.mode == 'RGB':
+            img.save(buffer, format='JPEG', icc_profile=None, comment=None, **_jpeg_params(source))
+            output_format = 'JPEG'
+        else:
+            img.save(buffer, format='PNG', icc_profile=None)
+            output_format = 'PNG'
+        output = buffer.getvalue()
+        if has_metadata:
+            actions.append('strip_metadata')
+
+    metrics = {
+        'bytes_in': len(image_data),
+        'bytes_out': len(output),
+        'width_in': width_in,
+        'height_in': height_in,
+        'width_out': img.width,
+        'height_out': img.height,
+        'pixels_in': width_in * height_in,
+        'pixels_out': img.width * img.height,
+        'mode_in': mode_in,
+        'mode_out': img.mode,
+        'format_in': source_format,
+        'format_out': output_format,
+        'actions': actions,
+        'elapsed_ms': round((time.time() - start_time) * 1000, 1),
+    }
+    logger.info(
+        f"预处理完成: {metrics['bytes_in']} -> {metrics['bytes_out']} 字节, "
+        f"{width_in}x{height_in} -> {img.width}x{img.height}, 操作: {actions or '无'}"
+    )
+    return output, metrics
@@ -0,0 +1,318 @@
+# profiling.py - 按需开启的请求耗时分解与慢请求采样
+#
+# 开启后每个接收图片的请求都有一个阶段计时器：metrics.time_stage 记录的各阶段
+# (read 即 multipart 解析、preprocess、inference、base64、serialize ...) 同时累加到当前请求上，
+# 通过 Server-Timing 响应头返回；总耗时超过阈值的请求把采样结果写入磁盘：
+#   stack    - 后台线程按固定间隔采样请求线程的调用栈，输出 collapsed 格式 (flamegraph.pl / speedscope 可直接打开)
+#   cprofile - 使用 cProfile 记录完整调用统计，输出 .prof (python -m pstats / snakeviz)
+# 开关、模式和阈值保存在 PROFILE_DIR/settings.json 中，可以通过 /admin/profiling 在运行时修改，
+# gunicorn 的所有 worker 进程都会读到新设置，不需要重启。设置文件优先于环境变量，但文件中记录了写入时的
+# 环境变量取值：重新部署时修改了 PROFILING_ENABLED / PROFILE_MODE / PROFILE_SLOW_MS，旧文件即失效，以环境变量为准。
+
+import os
+import sys
+import json
+import time
+import uuid
+import cProfile
+import logging
+import tempfile
+import threading
+import contextvars
+from collections import Counter as StackCounter, namedtuple
+
+import metrics
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"   # 启动时是否开启请求分析
+PROFILE_MODE = os.getenv("PROFILE_MODE", "stack")                               # 慢请求采样方式: stack / cprofile
+PROFILE_SLOW_MS = int(os.getenv("PROFILE_SLOW_MS", "2000"))                     # 超过该耗时(毫秒)的请求写入采样文件
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))            # stack 模式的采样间隔(毫秒)
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "super-resolution-profiles"))  # 采样文件和设置的目录
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))                   # 最多保留的采样文件数，超出时删除最旧的
+
+MODES = ('stack', 'cprofile')
+# 设置文件的检查间隔，避免每个请求都访问磁盘
+SETTINGS_RELOAD_SECONDS = 1.0
+
+SLOW_REQUESTS = Counter(
+    'profiling_slow_requests_total', 'Requests slower than PROFILE_SLOW_MS while profiling was enabled', ['endpoint'])
+
+
+class StageTimer:
+    """单个请求内各阶段的累计耗时（分块推理时各线程会同时写入）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self):
+        with self._lock:
+            return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages.items())
+
+    def summary(self):
+        with self._lock:
+            return ', '.join(f'{stage}={seconds * 1000:.0f}ms' for stage, seconds in self.stages.items())
+
+
+_current_timer = contextvars.ContextVar('profiling_timer', default=None)
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+def record_stage(stage, seconds):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.record(stage, seconds)
+
+
+metrics.add_stage_observer(record_stage)
+
+
+ProfilerSettings = namedtuple('ProfilerSettings', ['enabled', 'mode', 'slow_ms'])
+
+
+def validate_settings(settings):
+    if settings.mode not in MODES:
+        raise ValueError(f"mode must be one of: {', '.join(MODES)}")
+    if not isinstance(settings.slow_ms, int) or isinstance(settings.slow_ms, bool) or settings.slow_ms < 0:
+        raise ValueError('slow_ms must be a non-negative integer')
+    return settings
+
+
+class SettingsFile:
+    """保存在磁盘上的运行时设置，各进程按修改时间重新加载
+
+    文件同时记录写入时的默认值 (来自环境变量)，与当前默认值不同时视为旧部署留下的文件，不再生效。
+    """
+
+    def __init__(self, path, defaults):
+        self.path = path
+        self.defaults = defaults
+        self._lock = threading.Lock()
+        self._settings = defaults
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def load(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < SETTINGS_RELOAD_SECONDS:
+                return self._settings
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                self._settings, self._mtime = self.defaults, None
+                return self._settings
+            if mtime != self._mtime:
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                    if data.get('defaults') != self.defaults._asdict():
+                        logger.info("分析设置文件写入后环境变量已改变，使用环境变量中的设置")
+                        self._settings = self.defaults
+                    else:
+                        self._settings = validate_settings(self.defaults._replace(
+                            **{field: data[field] for field in ProfilerSettings._fields if field in data}))
+                except (OSError, ValueError, TypeError) as e:
+                    logger.warning(f"分析设置文件无效，保持当前设置: {e}")
+                self._mtime = mtime
+            return self._settings
+
+    def save(self, settings):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(settings._asdict(), defaults=self.defaults._asdict()), f)
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._settings = settings
+            self._checked_at = 0.0
+
+
+class StackSampler:
+    """后台线程定时读取目标线程的调用栈，统计 collapsed 格式的栈出现次数"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class RequestProfile:
+    def __init__(self, endpoint, timer, mode, slow_ms, collector):
+        self.endpoint = endpoint
+        self.timer = timer
+        self.mode = mode
+        self.slow_ms = slow_ms
+        self.collector = collector
+        self.start = time.perf_counter()
+
+
+class Profiler:
+    """按请求开始/结束采样，慢请求的结果写入 directory"""
+
+    def __init__(self, directory=PROFILE_DIR, enabled=PROFILING_ENABLED, mode=PROFILE_MODE,
+                 slow_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, max_files=PROFILE_MAX_FILES):
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        self.max_files = max_files
+        self.settings_file = SettingsFile(
+            os.path.join(directory, 'settings.json'),
+            validate_settings(ProfilerSettings(enabled, mode, slow_ms)),
+        )
+        # cProfile 同一时刻只能有一个在运行，其他请求只记录阶段耗时
+        self._cprofile_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {'profiled': 0, 'slow': 0, 'written': 0, 'cprofile_skipped': 0}
+
+    @property
+    def settings(self):
+        return self.settings_file.load()
+
+    def update(self, enabled=None, mode=None, slow_ms=None):
+        """修改运行时设置，参数无效时抛出 ValueError"""
+        settings = self.settings
+        if enabled is not None:
+            settings = settings._replace(enabled=bool(enabled))
+        if mode is not None:
+            settings = settings._replace(mode=mode)
+        if slow_ms is not None:
+            settings = settings._replace(slow_ms=slow_ms)
+        self.settings_file.save(validate_settings(settings))
+        logger.info(f"请求分析设置已更新: {settings._asdict()}")
+        return settings
+
+    def begin(self, endpoint):
+        """请求开始时调用，未开启时返回 None"""
+        settings = self.settings
+        if not settings.enabled:
+            return None
+        collector = None
+        if settings.mode == 'cprofile':
+            if self._cprofile_lock.acquire(blocking=False):
+                collector = cProfile.Profile()
+                try:
+                    collector.enable()
+                except ValueError:  # 其他分析器 (如调试器) 已在运行
+                    self._cprofile_lock.release()
+                    collector = None
+            else:
+                self._bump('cprofile_skipped')
+        else:
+            collector = StackSampler(threading.get_ident(), self.interval)
+            collector.start()
+        timer = StageTimer()
+        _current_timer.set(timer)
+        self._bump('profiled')
+        return RequestProfile(endpoint, timer, settings.mode, settings.slow_ms, collector)
+
+    def end(self, profile):
+        """请求结束时调用：停止采样，慢请求写入文件并记录阶段耗时"""
+        _current_timer.set(None)
+        elapsed_ms = (time.perf_counter() - profile.start) * 1000
+        collector = profile.collector
+        if isinstance(collector, cProfile.Profile):
+            collector.disable()
+            self._cprofile_lock.release()
+        elif collector is not None:
+            collector.stop()
+        if elapsed_ms < profile.slow_ms:
+            return None
+        SLOW_REQUESTS.labels(profile.endpoint).inc()
+        self._bump('slow')
+        path = None
+        if collector is not None:
+            path = self._write(profile, collector, elapsed_ms)
+        logger.info(f"慢请求 {profile.endpoint} {elapsed_ms:.0f}ms: {profile.timer.summary() or '无阶段记录'}"
+                    + (f"，采样已写入 {path}" if path else ''))
+        return path
+
+    def _write(self, profile, collector, elapsed_ms):
+        suffix = 'prof' if profile.mode == 'cprofile' else 'txt'
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{profile.endpoint}-{elapsed_ms:.0f}ms-{uuid.uuid4().hex[:6]}.{suffix}"
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if isinstance(collector, cProfile.Profile):
+                collector.dump_stats(path)
+            else:
+                collector.dump(path)
+        except OSError as e:
+            logger.warning(f"写入采样文件失败: {e}")
+            return None
+        self._bump('written')
+        self._rotate()
+        return path
+
+    def _rotate(self):
+        files = self.list_files()
+        for entry in files[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, entry['name']))
+            except OSError:
+                pass
+
+    def list_files(self):
+        """已写入的采样文件，最新的在前"""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(('.prof', '.txt'))]
+        except FileNotFoundError:
+            return []
+        files = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            files.append({'name': name, 'bytes': stat.st_size, 'mtime': stat.st_mtime})
+        files.sort(key=lambda entry: entry['mtime'], reverse=True)
+        return files
+
+    def _bump(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self._stats)
+        settings = self.settings._asdict()
+        settings.update(stats)
+        settings['interval_ms'] = self.interval * 1000
+        settings['directory'] = self.directory
+        return settings
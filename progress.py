@@ -0,0 +1,174 @@
+# progress.py - 超分进度事件 (Server-Sent Events)
+#
+# 每个任务（或带 progress_id 的同步请求）对应一个进度通道，处理过程中的各个阶段
+# （已接收、排队、预处理、第 N 次尝试、等待模型加载、分块 k/n、编码、完成）写入通道，
+# 客户端通过 SSE 订阅。处理代码不需要层层传递通道：当前通道保存在 contextvar 中，
+# 调用 emit() 即可；没有绑定通道时 emit() 什么也不做。
+
+import os
+import re
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", "600"))                    # 进度通道保留时间(秒)
+PROGRESS_MAX_EVENTS = int(os.getenv("PROGRESS_MAX_EVENTS", "200"))      # 每个通道保留的最近事件数
+PROGRESS_MAX_PENDING = int(os.getenv("PROGRESS_MAX_PENDING", "100"))    # 提交请求前先订阅、尚未有事件的通道数上限
+PROGRESS_PENDING_TTL = int(os.getenv("PROGRESS_PENDING_TTL", "60"))     # 尚未有事件的通道保留时间(秒)
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))                  # 没有事件时发送心跳的间隔(秒)
+SSE_MAX_SECONDS = float(os.getenv("SSE_MAX_SECONDS", "20"))              # WSGI 模式下单个 SSE 响应占用请求线程的最长时间(秒)，到期后浏览器带 Last-Event-ID 重连
+
+# 结束事件，发送后通道关闭
+DONE = 'done'
+FAILED = 'failed'
+
+_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+_current = contextvars.ContextVar('progress_channel', default=None)
+
+
+class ProgressChannel:
+    """单个请求或任务的事件序列，线程安全，支持多个订阅者和断线续订 (Last-Event-ID)"""
+
+    def __init__(self, channel_id, max_events=PROGRESS_MAX_EVENTS):
+        self.id = channel_id
+        self.max_events = max_events
+        self._cond = threading.Condition()
+        self._events = []
+        self._next_id = 1
+        self.closed = False
+        self.updated_at = time.time()
+
+    @property
+    def pending(self):
+        """还没有任何事件：只有订阅者，处理尚未开始"""
+        return self._next_id == 1
+
+    def emit(self, stage, **data):
+        with self._cond:
+            if self.closed:
+                return
+            event = {'id': self._next_id, 'stage': stage, 'time': round(time.time(), 3)}
+            event.update(data)
+            self._next_id += 1
+            self._events.append(event)
+            if len(self._events) > self.max_events:
+                del self._events[0]
+            if stage in (DONE, FAILED):
+                self.closed = True
+            self.updated_at = time.time()
+            self._cond.notify_all()
+
+    def events_after(self, last_id):
+        with self._cond:
+            return [event for event in self._events if event['id'] > last_id]
+
+    def wait(self, last_id, timeout):
+        """等待 last_id 之后的新事件，超时返回空列表"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.closed or self._next_id - 1 > last_id, timeout)
+            return [event for event in self._events if event['id'] > last_id]
+
+
+class ProgressRegistry:
+    """按 ID 管理进度通道；订阅者可能先于处理开始连接
+
+    处理请求一侧用 get_or_create；订阅一侧用 subscribe，ID 由客户端任意选择，
+    因此订阅者创建的、还没有事件的通道数量受 max_pending 限制，并且只保留 pending_ttl 秒。
+    """
+
+    def __init__(self, ttl=PROGRESS_TTL, max_pending=PROGRESS_MAX_PENDING, pending_ttl=PROGRESS_PENDING_TTL):
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.pending_ttl = pending_ttl
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def get_or_create(self, channel_id):
+        if not valid_id(channel_id):
+            return None
+        with self._lock:
+            self._purge_expired()
+            channel = self._channels.get(channel_id)
+            if channel is None:
+                channel = self._channels[channel_id] = ProgressChannel(channel_id)
+            return channel
+
+    def subscribe(self, channel_id):
+        """订阅一侧取得通道；通道不存在且等待中的通道已满时返回 None"""
+        if not valid_id(channel_id):
+            return None
+        with self._lock:
+            self._purge_expired()
+            channel = self._channels.get(channel_id)
+            if channel is None:
+                if sum(1 for existing in self._channels.values() if existing.pending) >= self.max_pending:
+                    return None
+                channel = self._channels[channel_id] = ProgressChannel(channel_id)
+            return channel
+
+    def get(self, channel_id):
+        with self._lock:
+            return self._channels.get(channel_id)
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [key for key, channel in self._channels.items()
+                   if channel.updated_at < now - (self.pending_ttl if channel.pending else self.ttl)]
+        for key in expired:
+            del self._channels[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._channels)
+
+
+def valid_id(channel_id):
+    return bool(channel_id) and bool(_ID_PATTERN.match(channel_id))
+
+
+@contextmanager
+def bind(channel):
+    """在当前上下文（线程或协程）中绑定进度通道"""
+    token = _current.set(channel)
+    try:
+        yield channel
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def emit(stage, **data):
+    """向当前绑定的通道写入一个阶段事件"""
+    channel = _current.get()
+    if channel is not None:
+        channel.emit(stage, **data)
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def sse_stream(channel, last_id=0, heartbeat=SSE_HEARTBEAT, max_seconds=None):
+    """生成 SSE 文本，通道关闭且事件发送完后结束；设置 max_seconds 时到期也结束，由客户端重连续传"""
+    yield 'retry: 2000\n\n'
+    deadline = None if max_seconds is None else time.monotonic() + max_seconds
+    while True:
+        timeout = heartbeat
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                return
+        events = channel.wait(last_id, timeout)
+        for event in events:
+            last_id = event['id']
+            yield format_event(event)
+        if channel.closed and not channel.events_after(last_id):
+            return
+        if not events:
+            yield ': keep-alive\n\n'
@@ -0,0 +1,470 @@
+# rate_limit.py - 按客户端限流与上游调用的加权公平调度
+#
+# 两层控制：
+# 1. 请求入口按客户端（API Key，否则按 IP）使用令牌桶限流，超出时返回 429 和准确的 Retry-After；
+#    桶状态默认保存在进程内，设置 RATE_LIMIT_DB 后保存在 SQLite 中，多个进程/机器共享同一份额。
+# 2. 每一次对上游模型的调用都要经过 FairScheduler：限制同时在途的上游请求数，按模型使用令牌桶
+#    控制调用速率，排队时按加权公平队列 (WFQ) 的虚拟完成时间出队——交互式的单图请求权重更高，
+#    不会被批量用户的大量分块/任务饿死。上游返回 429 时该模型暂停调度，避免重试放大限流。
+
+import os
+import math
+import time
+import heapq
+import sqlite3
+import hashlib
+import asyncio
+import threading
+import contextvars
+import logging
+from collections import namedtuple
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))   # 每个客户端每分钟允许的图片数，0 表示不限
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "30"))             # 客户端令牌桶容量（允许的突发量）
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "")                             # 设置后令牌桶保存在该 SQLite 文件中，多进程共享
+RATE_LIMIT_KEY_WEIGHTS = os.getenv("RATE_LIMIT_KEY_WEIGHTS", "")           # 按 API Key 调整份额，如 "key1:4,key2:0.5"
+API_KEYS = os.getenv("API_KEYS", "")                                       # 已分配的 API Key（逗号分隔），与上一项中的 Key 一起作为独立客户端限流
+MODEL_RATE_PER_MINUTE = float(os.getenv("MODEL_RATE_PER_MINUTE", "0"))     # 每个上游模型每分钟的调用数，0 表示不限
+MODEL_RATE_BURST = float(os.getenv("MODEL_RATE_BURST", "10"))              # 上游模型令牌桶容量
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "16"))        # 同时在途的上游请求数
+INTERACTIVE_WEIGHT = float(os.getenv("INTERACTIVE_WEIGHT", "4"))           # 同步单图请求相对批量请求的调度权重
+FAIR_QUEUE_TIMEOUT = float(os.getenv("FAIR_QUEUE_TIMEOUT", "30"))          # 同步请求排队等待上游的最长时间(秒)
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+RATE_LIMITED = Counter(
+    'rate_limited_total', 'Requests rejected by the client limiter or the upstream queue', ['scope'])
+QUEUE_WAIT_SECONDS = Histogram(
+    'upstream_queue_wait_seconds', 'Time spent waiting in the fair queue before an upstream call', ['class'])
+
+
+class RateLimitedError(Exception):
+    """超出限流或排队超时，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, retry_after, scope='client'):
+        super().__init__(f"Rate limited ({scope}), retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.scope = scope
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def _refill(tokens, updated, now, rate, capacity):
+    return min(capacity, tokens + max(now - updated, 0) * rate)
+
+
+def _take(tokens, cost, rate, capacity):
+    """返回 (新的令牌数, 需要等待的秒数)；满桶时允许一次性透支，超大批量也能被接受"""
+    if tokens >= cost or tokens >= capacity:
+        return tokens - cost, 0.0
+    return tokens, (min(cost, capacity) - tokens) / rate
+
+
+class MemoryBucketStore:
+    """进程内的令牌桶状态"""
+
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, capacity):
+        with self._lock:
+            now = self._clock()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens, wait = _take(_refill(tokens, updated, now, rate, capacity), cost, rate, capacity)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._evict(now, rate, capacity)
+            return wait
+
+    def _evict(self, now, rate, capacity):
+        # 已经回满的桶与新建的桶等价，可以丢弃
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if _refill(tokens, updated, now, rate, capacity) >= capacity]
+        for key in full:
+            del self._buckets[key]
+
+
+class SQLiteBucketStore:
+    """保存在 SQLite 中的令牌桶，多个 Web 进程（或共享磁盘的多台机器）共用同一份额"""
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self._clock = clock  # 跨进程共享，必须使用墙钟时间
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        # 建表用的连接不保留：限流器可能在 gunicorn master 中创建，SQLite 连接不能跨 fork 使用
+        self.close()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """关闭当前线程的连接，之后的调用会重新连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def take(self, key, cost, rate, capacity):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = self._clock()
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens, wait = _take(_refill(tokens, updated, now, rate, capacity), cost, rate, capacity)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+def parse_key_weights(value):
+    """解析 "key1:4,key2:0.5"，返回 {key 的摘要: 权重}"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        key, _, weight = item.rpartition(':')
+        try:
+            weights[client_key_digest(key)] = float(weight)
+        except ValueError:
+            logger.warning(f"忽略无效的限流权重配置: {item}")
+    return weights
+
+
+def parse_api_keys(value):
+    """解析逗号分隔的 API Key，返回摘要集合"""
+    return {client_key_digest(key) for key in filter(None, (part.strip() for part in value.split(',')))}
+
+
+def client_key_digest(api_key):
+    # 日志和共享存储中只出现 API Key 的摘要
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class RateLimiter:
+    """按客户端的令牌桶限流；客户端权重同时放大速率和容量"""
+
+    def __init__(self, per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST, store=None, weights=None, keys=None):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.store = store or MemoryBucketStore()
+        self.weights = weights or {}
+        # 只有配置过的 Key 才是独立的客户端，否则随机 Key 每次都能拿到一个满的令牌桶
+        self.keys = set(keys or ()) | set(self.weights)
+
+    @property
+    def enabled(self):
+        return self.per_minute > 0
+
+    def knows(self, key_digest):
+        return key_digest in self.keys
+
+    def weight(self, client):
+        return self.weights.get(client.split(':', 1)[-1], 1.0)
+
+    def check(self, client, cost=1):
+        """扣除 cost 个令牌，超出份额时抛出 RateLimitedError"""
+        if not self.enabled:
+            return
+        weight = self.weight(client)
+        wait = self.store.take(f"client:{client}", cost, self.per_minute / 60 * weight, self.burst * weight)
+        if wait > 0:
+            RATE_LIMITED.labels('client').inc()
+            logger.info(f"客户端 {client} 超出限流，{wait:.1f} 秒后可重试")
+            raise RateLimitedError(wait, 'client')
+
+    def stats(self):
+        return {
+            'per_minute': self.per_minute,
+            'burst': self.burst,
+            'shared': isinstance(self.store, SQLiteBucketStore),
+        }
+
+
+# 当前上下文（请求、任务、批量中的单张图片）对应的调度流
+Flow = namedtuple('Flow', ['key', 'weight', 'timeout', 'kind'])
+DEFAULT_FLOW = Flow('default', 1.0, FAIR_QUEUE_TIMEOUT, BATCH)
+
+_current_flow = contextvars.ContextVar('fair_queue_flow', default=DEFAULT_FLOW)
+
+
+def make_flow(client, kind, weight=1.0):
+    """交互式请求权重更高且有排队超时；批量和异步任务不设超时，按份额等待"""
+    if kind == INTERACTIVE:
+        return Flow(f"{client}/{kind}", weight * INTERACTIVE_WEIGHT, FAIR_QUEUE_TIMEOUT, kind)
+    return Flow(f"{client}/{kind}", weight, None, kind)
+
+
+@contextmanager
+def bind_flow(flow):
+    token = _current_flow.set(flow)
+    try:
+        yield flow
+    finally:
+        _current_flow.reset(token)
+
+
+def current_flow():
+    return _current_flow.get()
+
+
+class _Waiter:
+    __slots__ = ('flow', 'model', 'tag', 'seq', 'wake', 'granted', 'enqueued_at')
+
+    def __init__(self, flow, model, tag, seq, wake, enqueued_at):
+        self.flow = flow
+        self.model = model
+        self.tag = tag
+        self.seq = seq
+        self.wake = wake
+        self.granted = False
+        self.enqueued_at = enqueued_at
+
+    def __lt__(self, other):
+        return (self.tag, self.seq) < (other.tag, other.seq)
+
+
+class FairScheduler:
+    """上游调用的加权公平队列
+
+    每个调度流 (客户端 + 请求类型) 维护虚拟完成时间：tag = max(虚拟时钟, 该流上次的 tag) + 1/weight，
+    空出并发槽位时总是放行 tag 最小且所属模型有令牌的等待者。权重为 4 的流在拥塞时获得 4 倍的调用份额。
+    """
+
+    def __init__(self, concurrency=UPSTREAM_CONCURRENCY, model_per_minute=MODEL_RATE_PER_MINUTE,
+                 model_burst=MODEL_RATE_BURST, clock=time.monotonic):
+        self.concurrency = max(concurrency, 1)
+        self.model_rate = model_per_minute / 60
+        self.model_burst = model_burst
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._finish_tags = {}
+        self._vtime = 0.0
+        self._seq = 0
+        self._in_flight = 0
+        self._buckets = {}        # model -> (tokens, updated)
+        self._paused_until = {}   # model -> 上游要求的暂停截止时间
+        self._avg_service = 5.0   # 上游调用平均耗时估计，用于计算 Retry-After
+        self.granted = 0
+        self.rejected = 0
+
+    # -- 调度 --
+
+    def _enqueue(self, flow, model, wake):
+        with self._lock:
+            start = max(self._vtime, self._finish_tags.get(flow.key, 0.0))
+            tag = start + 1.0 / max(flow.weight, 1e-6)
+            self._finish_tags[flow.key] = tag
+            self._seq += 1
+            waiter = _Waiter(flow, model, tag, self._seq, wake, self._clock())
+            heapq.heappush(self._waiters, waiter)
+            wait = self._dispatch()
+            return waiter, wait
+
+    def _model_wait(self, model, now):
+        """该模型还需等待多久才能发起调用，0 表示可以立即调用"""
+        paused = self._paused_until.get(model, 0.0) - now
+        if paused > 0:
+            return paused
+        if self.model_rate <= 0:
+            return 0.0
+        tokens, updated = self._buckets.get(model, (self.model_burst, now))
+        tokens = _refill(tokens, updated, now, self.model_rate, self.model_burst)
+        self._buckets[model] = (tokens, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.model_rate
+
+    def _dispatch(self):
+        """在持有锁时调用：按 tag 顺序放行等待者，返回被限速的模型最早可用的等待时间"""
+        now = self._clock()
+        retry = None
+        blocked = []
+        while self._waiters and self._in_flight < self.concurrency:
+            waiter = heapq.heappop(self._waiters)
+            wait = self._model_wait(waiter.model, now)
+            if wait > 0:
+                # 该模型暂时没有令牌，让其他模型的请求先走
+                blocked.append(waiter)
+                retry = wait if retry is None else min(retry, wait)
+                continue
+            if self.model_rate > 0:
+                tokens, updated = self._buckets[waiter.model]
+                self._buckets[waiter.model] = (tokens - 1, updated)
+            self._vtime = max(self._vtime, waiter.tag - 1.0 / max(waiter.flow.weight, 1e-6))
+            self._in_flight += 1
+            self.granted += 1
+            waiter.granted = True
+            waiter.wake()
+        for waiter in blocked:
+            heapq.heappush(self._waiters, waiter)
+        if not self._waiters:
+            self._finish_tags = {key: tag for key, tag in self._finish_tags.items() if tag > self._vtime}
+        return retry
+
+    def _poll(self, waiter):
+        with self._lock:
+            if waiter.granted:
+                return 0.0
+            return self._dispatch()
+
+    def _abandon(self, waiter, rejected=True):
+        with self._lock:
+            if waiter.granted:
+                # 超时与放行同时发生：已经拿到槽位，照常执行
+                return
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            if rejected:
+                self.rejected += 1
+
+    def _cancelled(self, waiter):
+        """等待中的协程被取消 (如客户端断开)：撤回排队；已经被放行的要归还槽位，否则 _in_flight 永远不会减少"""
+        self._abandon(waiter, rejected=False)
+        if waiter.granted:
+            self.release()
+
+    def release(self, elapsed=None):
+        with self._lock:
+            self._in_flight -= 1
+            if elapsed is not None:
+                self._avg_service = 0.8 * self._avg_service + 0.2 * elapsed
+            self._dispatch()
+
+    def estimate_wait(self, model=None):
+        with self._lock:
+            queued = len(self._waiters) + 1
+            wait = self._avg_service * queued / self.concurrency
+            if model is not None:
+                wait = max(wait, self._model_wait(model, self._clock()))
+            return wait
+
+    def _timed_out(self, waiter):
+        self._abandon(waiter)
+        if waiter.granted:
+            return None
+        RATE_LIMITED.labels('upstream_queue').inc()
+        error = RateLimitedError(self.estimate_wait(waiter.model), 'upstream_queue')
+        logger.warning(f"上游调用排队超时 ({waiter.flow.key})，建议 {error.retry_after:.1f} 秒后重试")
+        return error
+
+    def acquire(self, model, flow=None):
+        """阻塞直到获得上游调用槽位；交互式请求排队超时时抛出 RateLimitedError"""
+        flow = flow or current_flow()
+        event = threading.Event()
+        waiter, wait = self._enqueue(flow, model, event.set)
+        deadline = None if flow.timeout is None else waiter.enqueued_at + flow.timeout
+        while not waiter.granted:
+            timeout = wait
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    error = self._timed_out(waiter)
+                    if error is not None:
+                        raise error
+                    break
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            event.wait(timeout)
+            event.clear()
+            wait = self._poll(waiter)
+        QUEUE_WAIT_SECONDS.labels(flow.kind).observe(self._clock() - waiter.enqueued_at)
+
+    async def acquire_async(self, model, flow=None):
+        """acquire 的异步版本：等待时不占用线程"""
+        flow = flow or current_flow()
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter, wait = self._enqueue(flow, model, lambda: loop.call_soon_threadsafe(event.set))
+        deadline = None if flow.timeout is None else waiter.enqueued_at + flow.timeout
+        while not waiter.granted:
+            timeout = wait
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    error = self._timed_out(waiter)
+                    if error is not None:
+                        raise error
+                    break
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                # CancelledError 在 Python 3.8 起不再是 Exception 的子类
+                self._cancelled(waiter)
+                raise
+            event.clear()
+            wait = self._poll(waiter)
+        QUEUE_WAIT_SECONDS.labels(flow.kind).observe(self._clock() - waiter.enqueued_at)
+
+    @contextmanager
+    def slot(self, model, flow=None):
+        self.acquire(model, flow)
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.release(self._clock() - start)
+
+    @asynccontextmanager
+    async def slot_async(self, model, flow=None):
+        await self.acquire_async(model, flow)
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.release(self._clock() - start)
+
+    def pause(self, model, seconds):
+        """上游返回 429 时暂停该模型的调度，所有请求一起等待而不是各自重试"""
+        with self._lock:
+            until = self._clock() + max(seconds, 0)
+            if until > self._paused_until.get(model, 0.0):
+                self._paused_until[model] = until
+                logger.warning(f"上游模型 {model} 限流，暂停调度 {seconds:.1f} 秒")
+
+    def stats(self):
+        with self._lock:
+            now = self._clock()
+            waiting = {}
+            for waiter in self._waiters:
+                waiting[waiter.flow.key] = waiting.get(waiter.flow.key, 0) + 1
+            return {
+                'concurrency': self.concurrency,
+                'in_flight': self._in_flight,
+                'waiting': waiting,
+                'granted': self.granted,
+                'rejected': self.rejected,
+                'model_per_minute': self.model_rate * 60,
+                'paused_models': {model: round(until - now, 1)
+                                  for model, until in self._paused_until.items() if until > now},
+            }
+
+
+def create_rate_limiter():
+    store = SQLiteBucketStore(RATE_LIMIT_DB) if RATE_LIMIT_DB else MemoryBucketStore()
+    return RateLimiter(store=store, weights=parse_key_weights(RATE_LIMIT_KEY_WEIGHTS), keys=parse_api_keys(API_KEYS))
+
+
+# 进程级共享的上游调度器，所有远程推理后端共用
+upstream_scheduler = FairScheduler()
@@ -0,0 +1,268 @@
+# result_cache.py - 超分结果的内容寻址缓存（内存 LRU + 磁盘两级）
+
+import os
+import hashlib
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MEMORY_MB = int(os.getenv("RESULT_CACHE_MEMORY_MB", "64"))
+RESULT_CACHE_DISK_MB = int(os.getenv("RESULT_CACHE_DISK_MB", "512"))  # 0 表示关闭磁盘层
+RESULT_CACHE_DIR = os.getenv(
+    "RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "super-resolution-cache")
+)
+
+
+def make_cache_key(image_data, model_url, **params):
+    """根据输入图片内容、模型地址和处理参数生成缓存键"""
+    digest = hashlib.sha256()
+    digest.update(image_data)
+    digest.update(b'\0' + model_url.encode('utf-8'))
+    for name in sorted(params):
+        digest.update(f'\0{name}={params[name]}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class MemoryTier:
+    """按字节数限制容量的 LRU 内存缓存"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """写入并返回被淘汰的条目数"""
+        if len(value) > self.max_bytes:
+            return 0
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._items[key] = value
+        self.size += len(value)
+        evicted = 0
+        while self.size > self.max_bytes:
+            _, dropped = self._items.popitem(last=False)
+            self.size -= len(dropped)
+            evicted += 1
+        return evicted
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskTier:
+    """按字节预算淘汰最久未访问文件的磁盘缓存
+
+    锁只保护内存中的索引，文件读写、替换和删除都在锁外进行。索引与文件可能短暂不一致
+    (例如读到一半的文件被淘汰)，读取失败的条目按未命中处理并从索引中移除。
+    索引是每个进程各自的：索引中没有的键仍会按路径查找，其他进程写入的文件读到后加入本进程的索引。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # key -> 文件大小，按访问顺序排列
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.loaded = False
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def load_index(self):
+        """扫描已有文件，按修改时间恢复访问顺序
+
+        文件很多时扫描较慢，不在启动时进行：首次读写时才扫描，或由 gunicorn master 预加载。
+        """
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            found = []
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.startswith('.'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, name, stat.st_size))
+            with self._lock:
+                # 扫描期间写入的条目比磁盘上已有的文件更新，排在后面
+                entries = OrderedDict((key, size) for _, key, size in sorted(found) if key not in self._entries)
+                entries.update(self._entries)
+                self._entries = entries
+                self.size = sum(entries.values())
+            self.loaded = True
+
+    def _forget(self, key):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self.size -= size
+
+    def _add(self, key, size):
+        """在持有锁时调用：登记条目并按预算淘汰，返回被淘汰的键"""
+        if key in self._entries:
+            self.size -= self._entries.pop(key)
+        self._entries[key] = size
+        self.size += size
+        evicted = []
+        while self.size > self.max_bytes and self._entries:
+            old_key, old_size = self._entries.popitem(last=False)
+            self.size -= old_size
+            evicted.append(old_key)
+        return evicted
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        self.load_index()
+        with self._lock:
+            indexed = key in self._entries
+        path = self._path(key)
+        if not indexed and not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+        except OSError:
+            self._forget(key)
+            return None
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # 其他 worker 进程写入的文件，加入本进程的索引
+                evicted = self._add(key, len(value))
+        self._remove(evicted)
+        return value
+
+    def put(self, key, value):
+        """写入并返回被淘汰的文件数"""
+        if len(value) > self.max_bytes:
+            return 0
+        self.load_index()
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，避免读到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            evicted = self._add(key, len(value))
+        self._remove(evicted)
+        return len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResultCache:
+    """两级结果缓存：先查内存，再查磁盘，磁盘命中后提升到内存
+
+    self._lock 只保护内存层和计数器；磁盘层的文件读写在锁外进行，慢盘不会阻塞内存命中。
+    """
+
+    def __init__(self, memory_bytes, disk_dir=None, disk_bytes=0, enabled=True):
+        self.enabled = enabled
+        self.memory = MemoryTier(memory_bytes)
+        self.disk = DiskTier(disk_dir, disk_bytes) if enabled and disk_dir and disk_bytes > 0 else None
+        self._lock = threading.Lock()
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.counters['memory_hits'] += 1
+                return value
+        value = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if value is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self.counters['memory_evictions'] += self.memory.put(key, value)
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters['stores'] += 1
+            self.counters['memory_evictions'] += self.memory.put(key, value)
+        if self.disk is not None:
+            try:
+                evicted = self.disk.put(key, value)
+            except OSError as e:
+                logger.warning(f"写入磁盘缓存失败: {str(e)}")
+                return
+            with self._lock:
+                self.counters['disk_evictions'] += evicted
+
+    def load_index(self):
+        if self.disk is not None:
+            self.disk.load_index()
+
+    def stats(self):
+        self.load_index()
+        with self._lock:
+            data = dict(self.counters)
+            memory_entries, memory_bytes = len(self.memory), self.memory.size
+        lookups = data['memory_hits'] + data['disk_hits'] + data['misses']
+        data.update({
+            'enabled': self.enabled,
+            'hit_rate': round((lookups - data['misses']) / lookups, 4) if lookups else 0.0,
+            'memory_entries': memory_entries,
+            'memory_bytes': memory_bytes,
+            'memory_max_bytes': self.memory.max_bytes,
+            'disk_entries': len(self.disk) if self.disk else 0,
+            'disk_bytes': self.disk.size if self.disk else 0,
+            'disk_max_bytes': self.disk.max_bytes if self.disk else 0,
+        })
+        return data
+
+
+def create_result_cache():
+    """按环境变量配置创建结果缓存"""
+    return ResultCache(
+        memory_bytes=RESULT_CACHE_MEMORY_MB * 1024 * 1024,
+        disk_dir=RESULT_CACHE_DIR,
+        disk_bytes=RESULT_CACHE_DISK_MB * 1024 * 1024,
+        enabled=RESULT_CACHE_ENABLED,
+    )
@@ -0,0 +1,286 @@
+# retry_policy.py - 统一的重试策略与熔断器
+#
+# 代替原来 urllib3 Retry 与外层固定等待叠加的两套重试：
+# - 指数退避 + 全抖动 (full jitter)
+# - 优先遵循上游给出的 Retry-After 头和 503 响应中的 estimated_time
+# - 每个请求有总截止时间，超过后不再重试
+# - 熔断器：上游连续失败时直接快速失败，冷却后放行一次试探请求
+
+import os
+import time
+import random
+import asyncio
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+
+import progress
+
+logger = logging.getLogger(__name__)
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))          # 每个请求最多尝试次数
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))          # 退避基数(秒)
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))             # 单次等待上限(秒)
+RETRY_DEADLINE = float(os.getenv("RETRY_DEADLINE", "240"))              # 单个请求总截止时间(秒)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # 连续失败多少次后熔断
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))      # 熔断后多久放行试探请求(秒)
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，请求被快速拒绝"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Upstream {name} is unavailable")
+        self.retry_after = max(1, int(retry_after + 0.5))
+
+
+class Outcome:
+    """一次尝试的结果
+
+    result         成功时的返回值
+    retryable      失败后是否值得重试
+    delay_hint     上游建议的等待秒数 (Retry-After / estimated_time)
+    failure        是否计入熔断器的失败（上游故障，而不是模型加载或限流）
+    """
+
+    def __init__(self, result=None, retryable=False, delay_hint=None, failure=False, reason=''):
+        self.result = result
+        self.retryable = retryable
+        self.delay_hint = delay_hint
+        self.failure = failure
+        self.reason = reason
+
+    @property
+    def ok(self):
+        return self.result is not None
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryMetrics:
+    """重试相关计数（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            'calls': 0,
+            'attempts': 0,
+            'retries': 0,
+            'successes': 0,
+            'failures': 0,
+            'deadline_exceeded': 0,
+            'breaker_rejections': 0,
+        }
+        self.backoff_seconds = 0.0
+
+    def add(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def add_backoff(self, seconds):
+        with self._lock:
+            self.backoff_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.counters)
+            data['backoff_seconds'] = round(self.backoff_seconds, 2)
+            return data
+
+
+class CircuitBreaker:
+    """closed -> (连续失败达到阈值) -> open -> (冷却结束) -> half_open -> 成功则 closed，失败则 open"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def before_call(self):
+        """请求前调用；熔断时抛出 CircuitOpenError"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True  # 只放行一个试探请求
+                return
+            remaining = self.reset_timeout - (self._clock() - self._opened_at)
+            raise CircuitOpenError(self.name, max(remaining, 1))
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"熔断器 {self.name} 恢复为关闭状态")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._trial_in_flight = False
+                self.times_opened += 1
+                logger.warning(f"熔断器 {self.name} 打开，{self.reset_timeout} 秒内快速失败")
+
+    def release_trial(self):
+        """试探请求既没有成功也没有失败（例如 4xx），允许下一个请求继续试探"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'times_opened': self.times_opened,
+            }
+
+
+class RetryPolicy:
+    """重试策略：决定是否重试以及下一次等待多久"""
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY, deadline=RETRY_DEADLINE):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt):
+        """第 attempt 次失败后的等待时间（全抖动指数退避）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def next_delay(self, attempt, outcome, remaining):
+        """返回下一次重试前的等待秒数；不应再重试时返回 None"""
+        if not outcome.retryable or attempt + 1 >= self.max_attempts:
+            return None
+        if outcome.delay_hint is not None:
+            # 上游明确给出了等待时间，加少量抖动避免同时醒来
+            delay = min(outcome.delay_hint, self.max_delay) * random.uniform(1.0, 1.1)
+        else:
+            delay = self.backoff(attempt)
+        if delay >= remaining:
+            return None
+        return delay
+
+
+def _attempt_timeout(remaining, read_timeout):
+    return max(1.0, min(read_timeout, remaining))
+
+
+def _after_attempt(policy, breaker, metrics, attempt, outcome, remaining):
+    """记录一次尝试的结果，返回等待秒数，或 None 表示结束"""
+    if outcome.ok:
+        metrics.add('successes')
+        if breaker:
+            breaker.record_success()
+        return None
+    if breaker:
+        if outcome.failure:
+            breaker.record_failure()
+        else:
+            breaker.release_trial()
+    delay = policy.next_delay(attempt, outcome, remaining)
+    if delay is None:
+        if outcome.retryable and attempt + 1 < policy.max_attempts:
+            metrics.add('deadline_exceeded')
+        metrics.add('failures')
+        logger.error(f"请求最终失败 (共 {attempt + 1} 次尝试): {outcome.reason}")
+        return None
+    metrics.add('retries')
+    metrics.add_backoff(delay)
+    progress.emit('retry_wait', seconds=round(delay, 1), reason=outcome.reason)
+    logger.info(f"第 {attempt + 1} 次尝试失败 ({outcome.reason})，等待 {delay:.1f} 秒后重试...")
+    return delay
+
+
+def call_with_retry(attempt_fn, policy, breaker=None, metrics=None, read_timeout=180,
+                    max_attempts=None, sleep=time.sleep, clock=time.monotonic):
+    """按策略调用 attempt_fn(timeout) -> Outcome，成功返回结果，失败返回 None"""
+    metrics = metrics or RetryMetrics()
+    metrics.add('calls')
+    if max_attempts:
+        policy = RetryPolicy(max_attempts, policy.base_delay, policy.max_delay, policy.deadline)
+    deadline = clock() + policy.deadline
+
+    for attempt in range(policy.max_attempts):
+        if breaker:
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                metrics.add('breaker_rejections')
+                raise
+        metrics.add('attempts')
+        progress.emit('attempt', attempt=attempt + 1, max_attempts=policy.max_attempts)
+        outcome = attempt_fn(_attempt_timeout(deadline - clock(), read_timeout))
+        delay = _after_attempt(policy, breaker, metrics, attempt, outcome, deadline - clock())
+        if delay is None:
+            return outcome.result
+        sleep(delay)
+    return None
+
+
+async def call_with_retry_async(attempt_fn, policy, breaker=None, metrics=None, read_timeout=180,
+                                max_attempts=None, clock=time.monotonic):
+    """call_with_retry 的异步版本：attempt_fn 为协程函数，等待使用 asyncio.sleep"""
+    metrics = metrics or RetryMetrics()
+    metrics.add('calls')
+    if max_attempts:
+        policy = RetryPolicy(max_attempts, policy.base_delay, policy.max_delay, policy.deadline)
+    deadline = clock() + policy.deadline
+
+    for attempt in range(policy.max_attempts):
+        if breaker:
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                metrics.add('breaker_rejections')
+                raise
+        metrics.add('attempts')
+        progress.emit('attempt', attempt=attempt + 1, max_attempts=policy.max_attempts)
+        outcome = await attempt_fn(_attempt_timeout(deadline - clock(), read_timeout))
+        delay = _after_attempt(policy, breaker, metrics, attempt, outcome, deadline - clock())
+        if delay is None:
+            return outcome.result
+        await asyncio.sleep(delay)
+    return None
@@ -0,0 +1,126 @@
+# singleflight.py - 相同请求合并：同一时刻相同输入只执行一次推理
+#
+# 第一个到达的请求（leader）执行推理，其余相同键的并发请求（follower）等待并共享结果；
+# leader 失败时，所有 follower 收到同样的失败，不会各自再发起一次推理。
+
+import asyncio
+import threading
+
+
+class FlightStats:
+    """合并请求计数（线程安全），同步与异步两种实现共用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.leader_failures = 0
+        self.followers_failed = 0
+        self.in_flight = 0
+
+    def add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def snapshot(self):
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'leader_failures': self.leader_failures,
+                'followers_failed': self.followers_failed,
+                'in_flight': self.in_flight,
+                'coalesced_rate': round(self.coalesced / total, 4) if total else 0.0,
+            }
+
+
+def _failed(result):
+    return result is None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """线程版本：do(key, fn) 返回 (结果, 是否为合并得到的结果)"""
+
+    def __init__(self, stats=None):
+        self.stats = stats or FlightStats()
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self.stats.add(coalesced=1)
+            if not call.done.wait(timeout):
+                raise TimeoutError('Timed out waiting for in-flight request')
+            if call.error is not None or _failed(call.result):
+                self.stats.add(followers_failed=1)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self.stats.add(leaders=1, in_flight=1)
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            if call.error is not None or _failed(call.result):
+                self.stats.add(leader_failures=1)
+            with self._lock:
+                del self._calls[key]
+            self.stats.add(in_flight=-1)
+            call.done.set()
+
+    def snapshot(self):
+        return self.stats.snapshot()
+
+
+class AsyncSingleFlight:
+    """asyncio 版本：推理放在独立任务中执行，leader 的请求被取消也不影响 follower"""
+
+    def __init__(self, stats=None):
+        self.stats = stats or FlightStats()
+        self._tasks = {}
+
+    async def do(self, key, coro_fn):
+        task = self._tasks.get(key)
+        leader = task is None
+        if leader:
+            self.stats.add(leaders=1, in_flight=1)
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.stats.add(coalesced=1)
+
+        try:
+            result = await asyncio.shield(task)
+        except Exception:
+            if not leader:
+                self.stats.add(followers_failed=1)
+            raise
+        if not leader and _failed(result):
+            self.stats.add(followers_failed=1)
+        return result, not leader
+
+    def _finish(self, key, task):
+        self._tasks.pop(key, None)
+        self.stats.add(in_flight=-1)
+        if task.cancelled() or task.exception() is not None or _failed(task.result()):
+            self.stats.add(leader_failures=1)
@@ -6,15 +6,43 @@ class SuperResolutionApp {
         this.resultPlaceholder = document.getElementById('resultPlaceholder');
         this.imageInput = document.getElementById('imageInput');
         this.upscaleBtn = document.getElementById('upscaleBtn');
+        this.backendSelect = document.getElementById('backendSelect');
         this.loading = document.getElementById('loading');
+        this.loadingText = this.loading.querySelector('.loading-text');
+        this.loadingSubtext = this.loading.querySelector('.loading-subtext');
+        this.defaultLoadingText = this.loadingText.textContent;
+        this.defaultLoadingSubtext = this.loadingSubtext.textContent;
         this.message = document.getElementById('message');
         this.fileInfo = document.getElementById('fileInfo');
         this.originalSize = document.getElementById('originalSize');
         this.resultSize = document.getElementById('resultSize');
         
         this.currentFile = null;
+        this.pollInterval = 1000;
+        this.maxUploadMB = 100;
+        this.chunkSize = 4 * 1024 * 1024;  // 超过一个分块大小的图片使用可续传的分块上传
+        this.maxChunkRetries = 5;
+        this.resultObjectUrl = null;
+        this.originalObjectUrl = null;
         this.initEventListeners();
         this.checkHealth();
+        this.loadLimits();
+    }
+    
+    async loadLimits() {
+        // 以服务端配置的上传上限和分块大小为准
+        try {
+            const response = await fetch('/info');
+            const info = await response.json();
+            if (info.max_chunked_upload_mb) {
+                this.maxUploadMB = info.max_chunked_upload_mb;
+            }
+            if (info.chunk_size) {
+                this.chunkSize = Math.min(this.chunkSize, info.chunk_size);
+            }
+        } catch (error) {
+            console.warn('⚠️ Failed to load upload limits:', error);
+        }
     }
     
     initEventListeners() {
@@ -35,9 +63,9 @@ class SuperResolutionApp {
             return;
         }
         
-        // 验证文件大小 (限制为5MB)
-        if (file.size > 5 * 1024 * 1024) {
-            this.showMessage('图片大小不能超过5MB', 'error');
+        // 验证文件大小 (大图由服务端分块处理)
+        if (file.size > this.maxUploadMB * 1024 * 1024) {
+            this.showMessage(`图片大小不能超过${this.maxUploadMB}MB`, 'error');
             this.resetFileInput();
             return;
         }
@@ -46,25 +74,24 @@ class SuperResolutionApp {
         const fileSize = (file.size / 1024 / 1024).toFixed(2);
         this.fileInfo.textContent = `${file.name} (${fileSize} MB)`;
         
-        const reader = new FileReader();
-        reader.onload = (e) => {
-            this.originalImage.src = e.target.result;
-            this.originalImage.style.display = 'block';
-            this.originalPlaceholder.style.display = 'none';
-            this.upscaleBtn.disabled = false;
-            this.resultImage.style.display = 'none';
-            this.resultPlaceholder.style.display = 'flex';
-            this.resultSize.textContent = '';
-            this.clearMessage();
-            
+        // 使用 object URL 预览，避免把整个文件读成 base64 data URL
+        if (this.originalObjectUrl) {
+            URL.revokeObjectURL(this.originalObjectUrl);
+        }
+        this.originalObjectUrl = URL.createObjectURL(file);
+        
+        this.originalImage.onload = () => {
             // 显示原始图片尺寸
-            const img = new Image();
-            img.onload = () => {
-                this.originalSize.textContent = `${img.width}×${img.height}`;
-            };
-            img.src = e.target.result;
+            this.originalSize.textContent = `${this.originalImage.naturalWidth}×${this.originalImage.naturalHeight}`;
         };
-        reader.readAsDataURL(file);
+        this.originalImage.src = this.originalObjectUrl;
+        this.originalImage.style.display = 'block';
+        this.originalPlaceholder.style.display = 'none';
+        this.upscaleBtn.disabled = false;
+        this.resultImage.style.display = 'none';
+        this.resultPlaceholder.style.display = 'flex';
+        this.resultSize.textContent = '';
+        this.clearMessage();
     }
     
     async handleUpscale() {
@@ -78,18 +105,30 @@ class SuperResolutionApp {
         this.upscaleBtn.querySelector('.btn-text').textContent = '⏳ 处理中...';
         
         try {
-            const formData = new FormData();
-            formData.append('image', this.currentFile);
+            // 提交异步任务，然后轮询任务状态，避免长时间占用一个请求
+            const submitResponse = this.currentFile.size > this.chunkSize
+                ? await this.submitChunkedUpload(this.currentFile)
+                : await this.submitFormUpload(this.currentFile);
             
-            const response = await fetch('/upscale', {
-                method: 'POST',
-                body: formData
-            });
+            const job = await submitResponse.json();
+            if (submitResponse.status === 429) {
+                const retryAfter = submitResponse.headers.get('Retry-After');
+                throw new Error(`服务器繁忙，请在 ${retryAfter || '几'} 秒后重试`);
+            }
+            if (!submitResponse.ok) {
+                throw new Error(job.error || '提交任务失败');
+            }
             
-            const data = await response.json();
+            await this.waitForJobEvents(job);
+            
+            // 优先以二进制 WebP 获取结果（比模型输出的 PNG 小得多），服务端不支持时回退到 JSON
+            const response = await fetch(job.result_url, {
+                headers: { 'Accept': 'image/webp,image/*;q=0.8' }
+            });
+            const data = await this.readUpscaleResult(response);
             
             if (data.success) {
-                this.resultImage.src = data.upscaled_image;
+                this.setResultImage(data.upscaled_image);
                 this.resultImage.style.display = 'block';
                 this.resultPlaceholder.style.display = 'none';
                 
@@ -112,6 +151,10 @@ class SuperResolutionApp {
             }
         } catch (error) {
             console.error('Error:', error);
+            // 失败时不保留预览图，避免误以为是最终结果
+            this.resultImage.style.display = 'none';
+            this.resultPlaceholder.style.display = 'block';
+            this.resultSize.textContent = '';
             this.showMessage(`❌ 处理失败: ${error.message}`, 'error');
         } finally {
             this.showLoading(false);
@@ -120,8 +163,207 @@ class SuperResolutionApp {
         }
     }
     
+    submitFormUpload(file) {
+        const formData = new FormData();
+        formData.append('image', file);
+        formData.append('backend', this.backendSelect.value);
+        formData.append('preview', '1');
+        return fetch('/jobs', {
+            method: 'POST',
+            body: formData
+        });
+    }
+    
+    async submitChunkedUpload(file) {
+        // 创建上传会话，逐块上传（断线后从服务端记录的偏移量续传），完成后提交任务
+        const initResponse = await fetch('/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ size: file.size, filename: file.name })
+        });
+        const upload = await initResponse.json();
+        if (!initResponse.ok) {
+            throw new Error(upload.error || '创建上传失败');
+        }
+        
+        let offset = 0;
+        let retries = 0;
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + this.chunkSize);
+            try {
+                const headers = { 'Upload-Offset': String(offset) };
+                const checksum = await this.sha256Hex(chunk);
+                if (checksum) {
+                    headers['X-Chunk-SHA256'] = checksum;
+                }
+                const response = await fetch(upload.upload_url, {
+                    method: 'PATCH',
+                    headers,
+                    body: chunk
+                });
+                if (!response.ok && response.status !== 409) {
+                    const data = await response.json();
+                    throw new Error(data.error || '上传失败');
+                }
+                // 409 表示偏移量不一致，以服务端返回的偏移量为准继续
+                offset = parseInt(response.headers.get('Upload-Offset'), 10);
+                retries = 0;
+                this.upscaleBtn.querySelector('.btn-text').textContent =
+                    `⏳ 上传中 ${Math.floor(offset / file.size * 100)}%`;
+            } catch (error) {
+                if (++retries > this.maxChunkRetries) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                offset = await this.fetchUploadOffset(upload.upload_url, offset);
+            }
+        }
+        
+        this.upscaleBtn.querySelector('.btn-text').textContent = '⏳ 处理中...';
+        const formData = new FormData();
+        formData.append('backend', this.backendSelect.value);
+        formData.append('preview', '1');
+        return fetch(`${upload.upload_url}/complete`, {
+            method: 'POST',
+            body: formData
+        });
+    }
+    
+    async fetchUploadOffset(uploadUrl, fallback) {
+        try {
+            const response = await fetch(uploadUrl, { method: 'HEAD' });
+            if (response.ok) {
+                return parseInt(response.headers.get('Upload-Offset'), 10);
+            }
+        } catch (error) {
+            console.warn('⚠️ Failed to query upload offset:', error);
+        }
+        return fallback;
+    }
+    
+    async sha256Hex(blob) {
+        // crypto.subtle 只在 HTTPS 或 localhost 下可用，不可用时不带校验
+        if (!window.crypto || !window.crypto.subtle) {
+            return null;
+        }
+        const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+    
+    async readUpscaleResult(response) {
+        // 二进制结果转为 object URL；JSON 结果按原格式返回
+        const contentType = response.headers.get('Content-Type') || '';
+        if (response.ok && contentType.startsWith('image/')) {
+            const blob = await response.blob();
+            return {
+                success: true,
+                upscaled_image: URL.createObjectURL(blob),
+                processing_time: response.headers.get('X-Processing-Time')
+            };
+        }
+        return response.json();
+    }
+    
+    setResultImage(src) {
+        // 释放上一次结果占用的 object URL
+        if (this.resultObjectUrl) {
+            URL.revokeObjectURL(this.resultObjectUrl);
+            this.resultObjectUrl = null;
+        }
+        if (src.startsWith('blob:')) {
+            this.resultObjectUrl = src;
+        }
+        this.resultImage.src = src;
+    }
+    
+    waitForJobEvents(job) {
+        // 通过 SSE 接收处理进度；服务端只在 ASGI 模式下提供 events_url，没有该地址、浏览器不支持或无法连接时回退到轮询
+        if (!window.EventSource || !job.events_url) {
+            return this.waitForJob(job.status_url);
+        }
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(job.events_url);
+            let settled = false;
+            const finish = (callback) => {
+                settled = true;
+                source.close();
+                callback();
+            };
+            
+            const stages = ['queued', 'started', 'cache_hit', 'preprocessed', 'inference', 'attempt',
+                'retry_wait', 'model_loading', 'tiling', 'tile', 'encoding'];
+            stages.forEach(stage => {
+                source.addEventListener(stage, (e) => this.showProgress(JSON.parse(e.data)));
+            });
+            source.addEventListener('preview', (e) => this.showPreview(JSON.parse(e.data)));
+            // 失败时同样结束等待，由获取结果的请求给出错误信息
+            source.addEventListener('done', () => finish(resolve));
+            source.addEventListener('failed', () => finish(resolve));
+            source.onerror = () => {
+                // 连接断开时 EventSource 会自动重连；连接被拒绝 (CLOSED) 时改为轮询
+                if (!settled && source.readyState === EventSource.CLOSED) {
+                    finish(() => this.waitForJob(job.status_url).then(resolve, reject));
+                }
+            };
+        });
+    }
+    
+    showPreview(event) {
+        // 完整结果出来之前先显示低分辨率预览
+        this.setResultImage(event.image);
+        this.resultImage.style.display = 'block';
+        this.resultPlaceholder.style.display = 'none';
+        this.resultSize.textContent = `预览 ${event.width}×${event.height}`;
+    }
+    
+    showProgress(event) {
+        const texts = {
+            queued: () => event.position > 0
+                ? [`排队中，前面还有 ${event.position} 个任务`, `预计等待 ${event.eta} 秒`]
+                : ['已进入处理队列', null],
+            started: () => ['开始处理', null],
+            cache_hit: () => ['命中缓存，直接返回结果', null],
+            preprocessed: () => ['预处理完成', `${event.width}×${event.height}`],
+            inference: () => ['AI正在处理您的图像', `模型: ${event.model}`],
+            attempt: () => event.attempt > 1
+                ? ['AI正在处理您的图像', `第 ${event.attempt}/${event.max_attempts} 次尝试`]
+                : ['AI正在处理您的图像', null],
+            retry_wait: () => ['请求未成功，稍后自动重试', `${event.seconds} 秒后重试 (${event.reason})`],
+            model_loading: () => ['模型正在冷启动', event.eta ? `预计还需 ${Math.ceil(event.eta)} 秒` : null],
+            tiling: () => [`大图分为 ${event.tiles} 块处理`, null],
+            tile: () => ['分块处理中', `已完成 ${event.done}/${event.total}`],
+            encoding: () => ['正在生成结果', null]
+        };
+        const text = texts[event.stage];
+        if (!text) return;
+        const [main, sub] = text();
+        this.loadingText.textContent = main;
+        if (sub !== null) {
+            this.loadingSubtext.textContent = sub;
+        }
+    }
+    
+    async waitForJob(statusUrl) {
+        // 轮询任务状态直到完成或失败
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, this.pollInterval));
+            const response = await fetch(statusUrl);
+            const status = await response.json();
+            if (!response.ok) {
+                throw new Error(status.error || '查询任务状态失败');
+            }
+            if (status.status === 'succeeded' || status.status === 'failed') {
+                return status;
+            }
+        }
+    }
+    
     showLoading(show) {
         this.loading.style.display = show ? 'block' : 'none';
+        if (show) {
+            this.loadingText.textContent = this.defaultLoadingText;
+            this.loadingSubtext.textContent = this.defaultLoadingSubtext;
+        }
     }
     
     showMessage(text, type) {
@@ -137,7 +379,7 @@ class SuperResolutionApp {
     
     resetFileInput() {
         this.imageInput.value = '';
-        this.fileInfo.textContent = '支持 JPG, PNG 格式 (最大5MB)';
+        this.fileInfo.textContent = `支持 JPG, PNG 格式 (最大${this.maxUploadMB}MB)`;
         this.currentFile = null;
     }
     
@@ -0,0 +1,6 @@
+# conftest.py - 让 test/ 下的测试可以直接导入项目根目录的模块
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
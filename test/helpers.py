@@ -0,0 +1,17 @@
+# helpers.py - 测试共用的辅助函数 (pytest 收集测试时会把 test/ 目录加入导入路径)
+
+import io
+import os
+
+from PIL import Image
+
+
+def image_bytes(size=(8, 8), color='red', mode='RGB', format='PNG', noise=False):
+    """生成测试图片的字节；noise 为 True 时填充随机像素，每次内容不同，不会命中结果缓存"""
+    if noise:
+        image = Image.frombytes(mode, size, os.urandom(size[0] * size[1] * len(mode)))
+    else:
+        image = Image.new(mode, size, color)
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# test_animation.py - 测试动图逐帧超分：重复帧合并、按序重组和在途帧窗口
+
+import io
+import time
+import random
+import threading
+
+import pytest
+from PIL import Image, ImageDraw
+
+from animation import check_limits, dedup_frames, upscale_animation, upscale_frames
+
+COLORS = [(255, 0, 0), (0, 160, 0), (0, 0, 255), (200, 200, 0), (0, 200, 200), (160, 0, 160)]
+
+
+def _frame(color, size=(40, 30), mode='RGB', background=(255, 255, 255)):
+    image = Image.new(mode, size, background + (0,) if mode == 'RGBA' else background)
+    ImageDraw.Draw(image).rectangle((5, 5, 30, 22), fill=color)
+    return image
+
+
+def _animation(frames, durations, fmt='GIF'):
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format=fmt, save_all=True, append_images=frames[1:], duration=durations, loop=0)
+    buffer.seek(0)
+    return buffer
+
+
+def _double(data):
+    """放大两倍的假推理，随机延迟让完成顺序与提交顺序不同"""
+    time.sleep(random.random() * 0.02)
+    with Image.open(io.BytesIO(data)) as image:
+        buffer = io.BytesIO()
+        image.resize((image.width * 2, image.height * 2)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _read_frames(data):
+    image = Image.open(io.BytesIO(data) if isinstance(data, bytes) else data)
+    frames = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        image.load()
+        frames.append((image.convert('RGBA').getpixel((30, 30)), image.info.get('duration')))
+    return image, frames
+
+
+def test_dedup_merges_repeated_and_near_identical_frames():
+    base = _frame(COLORS[0])
+    nudged = base.copy()
+    nudged.putpixel((0, 0), (250, 250, 250))  # 一个像素的差异
+    frames = [(base.copy(), 40), (base.copy(), 40), (nudged.copy(), 40),
+              (_frame(COLORS[1]), 60), (_frame(COLORS[1]), 60)]
+
+    merged = [(duration, count) for _, duration, count in dedup_frames(iter(frames), max_diff=1.0)]
+    assert merged == [(120, 3), (120, 2)]
+
+    frames = [(base.copy(), 40), (base.copy(), 40), (nudged.copy(), 40)]
+    exact = [(duration, count) for _, duration, count in dedup_frames(iter(frames), max_diff=0)]
+    assert exact == [(80, 2), (40, 1)]
+
+
+def test_gif_frames_keep_order_and_timing():
+    durations = [30, 40, 50, 60, 70, 80]
+    source = _animation([_frame(color) for color in COLORS], durations)
+
+    output, stats = upscale_animation(source, _double, concurrency=4)
+    image, frames = _read_frames(output.read())
+    assert image.format == 'GIF' and image.size == (80, 60)
+    assert stats['frames'] == stats['unique_frames'] == 6
+    assert [duration for _, duration in frames] == durations
+    for (pixel, _), color in zip(frames, COLORS):
+        assert all(abs(a - b) <= 8 for a, b in zip(pixel[:3], color))
+
+
+def test_frames_in_flight_are_bounded_by_window():
+    lock = threading.Lock()
+    state = {'submitted': 0, 'yielded': 0, 'max_ahead': 0}
+
+    def frames():
+        for index in range(20):
+            with lock:
+                state['submitted'] += 1
+                state['max_ahead'] = max(state['max_ahead'], state['submitted'] - state['yielded'])
+            yield _frame(COLORS[index % len(COLORS)]), 10, 1
+
+    results = []
+    for result, _, _, _ in upscale_frames(frames(), _double, concurrency=2, window=3):
+        with lock:
+            state['yielded'] += 1
+        results.append(Image.open(io.BytesIO(result)).getpixel((30, 30)))
+    assert state['max_ahead'] <= 3
+    assert results == [COLORS[index % len(COLORS)] for index in range(20)]
+
+
+def test_webp_output_keeps_transparency_and_timing():
+    frames = [_frame(color + (255,), mode='RGBA') for color in COLORS[:3]]
+    source = _animation(frames, [100, 200, 300], 'WEBP')
+
+    output, stats = upscale_animation(source, _double, output_format='WEBP')
+    image, decoded = _read_frames(output.read())
+    assert image.format == 'WEBP' and stats['unique_frames'] == 3
+    assert [duration for _, duration in decoded] == [100, 200, 300]
+    image.seek(0)
+    assert image.convert('RGBA').getpixel((1, 1))[3] == 0
+
+
+def test_animation_endpoint():
+    import app as app_module
+
+    client = app_module.app.test_client()
+    background = tuple(random.randrange(256) for _ in range(3))  # 避免命中之前运行留下的缓存
+    frames = [_frame(color, background=background) for color in COLORS[:3] + COLORS[2:3]]
+    source = _animation(frames, [50, 50, 50, 50])
+    response = client.post('/upscale/animation', data={'image': (source, 'a.gif'), 'backend': 'local'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/gif'
+    assert response.headers['X-Unique-Frames'] == '3'
+    _, frames = _read_frames(response.data)
+    assert [duration for _, duration in frames] == [50, 50, 100]
+
+    png = io.BytesIO()
+    _frame(COLORS[0]).save(png, format='PNG')
+    png.seek(0)
+    response = client.post('/upscale/animation', data={'image': (png, 'a.png'), 'backend': 'local'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 415
+
+
+def test_animation_is_charged_per_frame_and_capped_before_inference(monkeypatch):
+    import app as app_module
+    from rate_limit import RateLimiter
+
+    limiter = RateLimiter(per_minute=60, burst=10)
+    charged = []
+    monkeypatch.setattr(limiter, 'check', lambda client, cost=1: charged.append(cost))
+    monkeypatch.setattr(app_module, 'rate_limiter', limiter)
+    monkeypatch.setattr(app_module, 'upscale_image', lambda *args, **kwargs: pytest.fail('inference started'))
+    client = app_module.app.test_client()
+
+    def post(source):
+        return client.post('/upscale/animation', data={'image': (source, 'a.gif'), 'backend': 'local'},
+                           content_type='multipart/form-data')
+
+    # 40x30 × 6 帧 × 4² (本地后端) = 115200 输出像素
+    monkeypatch.setattr(app_module, 'check_limits',
+                        lambda *args: check_limits(*args, max_output_pixels=20000))
+    response = post(_animation([_frame(color) for color in COLORS], [10] * 6))
+    assert response.status_code == 413 and charged == []
+
+    monkeypatch.setattr(app_module, 'check_limits', lambda *args: check_limits(*args, max_frames=5))
+    assert post(_animation([_frame(color) for color in COLORS], [10] * 6)).status_code == 413
+
+    monkeypatch.setattr(app_module, 'check_limits', check_limits)
+    monkeypatch.setattr(app_module, 'upscale_animation', lambda *args, **kwargs: (None, {}))
+    assert post(_animation([_frame(color) for color in COLORS], [10] * 6)).status_code == 500
+    assert charged == [6]
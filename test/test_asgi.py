@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# test_asgi.py - 测试异步 (ASGI) 服务模式
+
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+import asgi
+from backends import HFBackend
+from inference_client import close_async_inference_client
+from helpers import image_bytes
+
+
+class _SlowModelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(0.3)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_async_inference_calls_overlap():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowModelHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    backend = HFBackend(f"http://127.0.0.1:{server.server_address[1]}/", 'token')
+
+    async def run():
+        try:
+            start = time.time()
+            results = await asyncio.gather(*(backend.upscale_async(b'img%d' % i) for i in range(20)))
+            return results, time.time() - start
+        finally:
+            await close_async_inference_client()
+
+    try:
+        results, elapsed = asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert results == [b'img%d' % i for i in range(20)]
+    assert elapsed < 3  # 串行需要 6 秒
+
+
+def test_asgi_app_serves_upscale_and_flask_routes():
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            upscale = await client.post(
+                '/upscale?response=binary',
+                files={'image': ('a.png', image_bytes(), 'image/png')},
+                data={'backend': 'local'},
+            )
+            health = await client.get('/health')
+            index = await client.get('/')
+            return upscale, health, index
+
+    upscale, health, index = asyncio.run(run())
+    assert upscale.status_code == 200
+    assert upscale.headers['content-type'] == 'image/png'
+    assert health.json()['status'] == 'healthy'
+    assert index.status_code == 200
+
+
+def test_asgi_upload_parsing_runs_off_the_event_loop(monkeypatch):
+    import app as app_module
+
+    threads = {}
+    read_uploaded_image = app_module.read_uploaded_image
+
+    def recording_read():
+        threads['read'] = threading.current_thread()
+        return read_uploaded_image()
+
+    monkeypatch.setattr(app_module, 'read_uploaded_image', recording_read)
+
+    async def run():
+        threads['loop'] = threading.current_thread()
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            return await client.post('/upscale', files={'image': ('a.png', image_bytes(), 'image/png')},
+                                     data={'backend': 'local'})
+
+    response = asyncio.run(run())
+    assert response.status_code == 200 and response.json()['success']
+    assert threads['read'] is not threads['loop']
+
+
+def test_asgi_rejects_oversized_chunked_upload(monkeypatch):
+    monkeypatch.setattr(asgi, 'MAX_REQUEST_BYTES', 64 * 1024)
+    sent = []
+
+    async def receive():
+        # 没有 Content-Length 的分块上传，持续发送直到服务端停止读取
+        return {'type': 'http.request', 'body': b'x' * 16 * 1024, 'more_body': True}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/upscale', 'headers': [], 'query_string': b''}
+    asyncio.run(asgi.handle_upscale(scope, receive, send))
+    assert sent[0]['status'] == 413
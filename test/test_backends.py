@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# test_backends.py - 测试本地 CPU 超分后端（无需网络）
+
+import io
+
+from PIL import Image
+
+from backends import LocalBackend
+from helpers import image_bytes
+
+
+def test_local_backend_upscales_by_scale():
+    result = LocalBackend(scale=4).upscale(image_bytes((16, 12), 'blue'))
+    with Image.open(io.BytesIO(result)) as img:
+        assert img.size == (64, 48)
+        assert img.format == 'PNG'
+
+
+def test_local_backend_caps_output_pixels():
+    result = LocalBackend(scale=4, max_output_pixels=16 * 12 * 4).upscale(image_bytes((16, 12), 'blue'))
+    with Image.open(io.BytesIO(result)) as img:
+        assert img.size == (32, 24)
+
+
+def test_local_backend_rejects_invalid_image():
+    assert LocalBackend().upscale(b'not an image') is None
+
+
+def test_model_id_reflects_settings():
+    assert LocalBackend(scale=2).model_id != LocalBackend(scale=4).model_id
+
+
+def test_upscale_route_with_local_backend():
+    import app as app_module
+
+    client = app_module.app.test_client()
+    response = client.post('/upscale', data={
+        'image': (io.BytesIO(image_bytes((16, 12), 'blue')), 'a.png'),
+        'backend': 'local',
+    })
+    assert response.status_code == 200
+    assert response.json['success'] is True
+
+    response = client.post('/upscale', data={
+        'image': (io.BytesIO(image_bytes((16, 12), 'blue')), 'a.png'),
+        'backend': 'missing',
+    })
+    assert response.status_code == 400
+
+
+def test_upscale_route_binary_response():
+    import app as app_module
+
+    client = app_module.app.test_client()
+    response = client.post('/upscale?response=binary', data={
+        'image': (io.BytesIO(image_bytes((16, 12), 'blue')), 'a.png'),
+        'backend': 'local',
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert 'X-Processing-Time' in response.headers
+    with Image.open(io.BytesIO(response.data)) as img:
+        assert img.size == (64, 48)
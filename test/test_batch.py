@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# test_batch.py - 测试批量超分接口
+
+import io
+import json
+import time
+import zipfile
+
+from batch import run_batch
+from helpers import image_bytes
+
+
+def test_run_batch_is_concurrent_and_reports_each_item():
+    def runner(data, info):
+        time.sleep(0.2)
+        return None if data == b'bad' else data
+
+    items = [('a', b'1'), ('b', b'bad'), ('c', b'3'), ('d', b'4')]
+    start = time.time()
+    results = list(run_batch(items, runner, concurrency=4))
+    assert time.time() - start < 0.6  # 接近最慢的一张，而不是总和
+
+    by_name = {r['filename']: r for r in results}
+    assert by_name['b']['status'] == 'failed'
+    assert by_name['c']['status'] == 'succeeded'
+    assert sorted(r['index'] for r in results) == [0, 1, 2, 3]
+
+
+def test_batch_endpoint_ndjson_and_zip():
+    import app as app_module
+
+    client = app_module.app.test_client()
+    response = client.post('/upscale/batch', data={
+        'images': [(io.BytesIO(image_bytes(color='red')), 'a.png'), (io.BytesIO(b'broken'), 'b.png')],
+        'backend': 'local',
+    })
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    items = {line['filename']: line for line in lines if line['type'] == 'item'}
+    assert items['a.png']['status'] == 'succeeded'
+    assert items['b.png']['status'] == 'failed'
+    assert lines[-1] == dict(lines[-1], type='summary', succeeded=1, failed=1)
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('photos/one.png', image_bytes(color='blue'))
+        zf.writestr('photos/two.png', image_bytes(color='green'))
+    response = client.post('/upscale/batch?format=zip', data={
+        'archive': (io.BytesIO(archive.getvalue()), 'photos.zip'),
+        'backend': 'local',
+    })
+    assert response.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        manifest = json.loads(zf.read('manifest.json'))
+        assert [entry['status'] for entry in manifest] == ['succeeded', 'succeeded']
+        assert all(entry['output'] in zf.namelist() for entry in manifest)
+
+
+def test_batch_endpoint_requires_images():
+    import app as app_module
+
+    response = app_module.app.test_client().post('/upscale/batch', data={})
+    assert response.status_code == 400
+
+
+def test_batch_items_are_size_checked_up_front_and_read_in_workers(monkeypatch):
+    import threading
+    import app as app_module
+
+    client = app_module.app.test_client()
+    monkeypatch.setattr(app_module, 'MAX_UPLOAD_MB', 0)
+    response = client.post('/upscale/batch', data={'images': [(io.BytesIO(image_bytes()), 'a.png')], 'backend': 'local'})
+    assert response.status_code == 400 and 'too large' in response.get_json()['error']
+
+    monkeypatch.undo()
+    readers = []
+
+    def recording_run_batch(items, runner, concurrency):
+        def reader(source):
+            def read():
+                readers.append(threading.current_thread())
+                return source()
+            return read
+        # 请求线程只交出读取函数，不读入图片内容
+        assert all(callable(source) for _, source in items)
+        return run_batch([(name, reader(source)) for name, source in items], runner, concurrency)
+
+    monkeypatch.setattr(app_module, 'run_batch', recording_run_batch)
+    response = client.post('/upscale/batch', data={
+        'images': [(io.BytesIO(image_bytes(color='red')), 'a.png'), (io.BytesIO(image_bytes(color='blue')), 'b.png')], 'backend': 'local',
+    })
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert lines[-1]['succeeded'] == 2
+    assert len(readers) == 2 and threading.current_thread() not in readers
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# test_bench.py - 测试压测工具和模拟推理服务（无需网络）
+
+import os
+import sys
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+import mock_server  # noqa: E402
+from load_test import percentile, summarize  # noqa: E402
+from startup import summarize_runs  # noqa: E402
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7], 95) == 7
+    assert percentile([], 50) is None
+
+
+def test_summarize_startup_runs():
+    assert summarize_runs([0.5, 0.3, 0.4]) == {'runs': 3, 'min_ms': 300.0, 'p50_ms': 400.0, 'max_ms': 500.0}
+
+
+def test_summarize_counts_statuses():
+    report = summarize([(200, 0.1), (200, 0.3), (500, 0.05), ('error', 1.0)], duration=2.0)
+    assert report['statuses'] == {'200': 2, '500': 1, 'error': 1}
+    assert report['rps'] == 1.0
+    assert report['latency_ms']['p50'] == 100.0
+
+
+def test_hf_backend_rides_out_mock_cold_start():
+    from backends import HFBackend
+
+    server, config = mock_server.serve(0, latency=0.01, cold_start=0.3, estimated_time=0.1, output_kb=4)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/models/mock'
+        assert requests.post(url, data=b'x', timeout=5).status_code == 503
+
+        result = HFBackend(url, 'token', max_retries=10).upscale(b'image')
+        assert result.startswith(b'\x89PNG')
+        assert config.counts['loading'] >= 1
+        assert config.counts['ok'] == 1
+    finally:
+        server.shutdown()
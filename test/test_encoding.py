@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# test_encoding.py - 测试输出格式协商、重新编码和预览图
+
+import io
+import base64
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import MIMEAccept
+
+from encoding import OutputEncoder, available_formats, encode_image, make_preview, negotiate
+from helpers import image_bytes
+
+
+def test_negotiate_prefers_explicit_format_then_accept():
+    assert negotiate('jpg') == 'jpeg'
+    assert negotiate('original') is None
+    with pytest.raises(ValueError):
+        negotiate('bmp')
+
+    assert negotiate(None, MIMEAccept([('image/webp', 1), ('image/*', 0.8)])) == 'webp'
+    assert negotiate(None, MIMEAccept([('image/png', 1), ('image/webp', 0.5)])) == 'png'
+    # 只有通配符时保持模型输出，不做额外编码
+    assert negotiate(None, MIMEAccept([('image/*', 1)])) is None
+    assert negotiate(None, MIMEAccept([('*/*', 1), ('image/webp', 0.5)])) is None
+    # 同质量时具体类型优先于通配符，与书写顺序无关 (不依赖 MIMEAccept 自身的排序)
+    assert negotiate(None, [('image/*', 1), ('image/webp', 1)]) == 'webp'
+    assert negotiate(None, [('*/*', 1), ('image/*', 1), ('image/png', 1)]) == 'png'
+
+
+@pytest.mark.parametrize('name', available_formats())
+def test_encode_image_formats(name):
+    data, mimetype = encode_image(image_bytes((64, 48), mode='RGBA', noise=True), name, quality=70)
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == (64, 48)
+        assert img.get_format_mimetype() == mimetype
+
+
+def test_lossy_encoding_is_smaller_than_png():
+    buffer = io.BytesIO()
+    Image.effect_noise((256, 256), 40).convert('RGB').save(buffer, format='PNG')
+    source = buffer.getvalue()
+    encoded, _ = OutputEncoder(workers=1).encode(source, 'jpeg', 80)
+    assert len(encoded) < len(source)
+
+
+def test_preview_is_small_and_scaled():
+    image, width, height = make_preview(image_bytes((200, 100), noise=True), scale=4, max_edge=160)
+    assert (width, height) == (160, 80)
+    header, payload = image.split(',', 1)
+    assert header.startswith('data:image/')
+    with Image.open(io.BytesIO(base64.b64decode(payload))) as img:
+        assert img.size == (160, 80)
+
+
+def test_upscale_endpoint_negotiates_output_format():
+    import app as app_module
+
+    client = app_module.app.test_client()
+    response = client.post(
+        '/upscale',
+        data={'image': (io.BytesIO(image_bytes((16, 16), noise=True)), 'a.png'), 'backend': 'local'},
+        headers={'Accept': 'image/webp,image/*;q=0.8'},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert response.headers['Vary'] == 'Accept'
+
+    response = client.post('/upscale', data={'image': (io.BytesIO(image_bytes((16, 16), noise=True)), 'a.png'),
+                                             'backend': 'local', 'format': 'jpeg', 'quality': '60'})
+    assert response.get_json()['upscaled_image'].startswith('data:image/jpeg;base64,')
+
+    response = client.post('/upscale', data={'image': (io.BytesIO(image_bytes((16, 16), noise=True)), 'a.png'), 'format': 'tiff'})
+    assert response.status_code == 400
+
+
+def test_preview_event_sent_before_result():
+    import uuid
+    import app as app_module
+
+    progress_id = uuid.uuid4().hex
+    client = app_module.app.test_client()
+    response = client.post('/upscale', data={'image': (io.BytesIO(image_bytes((16, 16), noise=True)), 'a.png'), 'backend': 'local',
+                                             'preview': '1', 'progress_id': progress_id})
+    assert response.status_code == 200
+    stages = [event['stage'] for event in app_module.progress_registry.get(progress_id).events_after(0)]
+    assert stages.index('preview') < stages.index('inference')
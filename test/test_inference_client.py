@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# test_inference_client.py - 测试推理客户端连接池复用
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from inference_client import InferenceClient
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_connection_reused_across_requests():
+    """连续请求应复用同一个连接"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    client = InferenceClient(pool_maxsize=2)
+    try:
+        for i in range(5):
+            response = client.post(url, data=b'x' * i, timeout=5)
+            assert response.status_code == 200
+            assert response.content == b'x' * i
+
+        stats = client.stats()
+        assert stats['requests'] == 5
+        assert stats['misses'] == 1
+        assert stats['hits'] == 4
+        assert stats['pool_maxsize'] == 2
+    finally:
+        client.close()
+        server.shutdown()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# test_ingest.py - 测试只读文件头的上传校验
+
+import io
+import zlib
+import struct
+import tracemalloc
+
+import pytest
+
+import ingest
+from ingest import ImageTooLargeError, IngestError, MemoryProbe, UnsupportedFormatError, check_image, sniff
+from helpers import image_bytes
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def _bomb_png(width=30000, height=30000):
+    """文件头声明超大尺寸、实际只有几十字节的 PNG"""
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header)
+            + _png_chunk(b'IDAT', zlib.compress(b'\x00' * 16)) + _png_chunk(b'IEND', b''))
+
+
+def test_sniff_reads_header_and_restores_position():
+    stream = io.BytesIO(image_bytes((40, 30)))
+    header = check_image(stream)
+    assert (header.format, header.width, header.height) == ('PNG', 40, 30)
+    assert header.decoded_bytes == 40 * 30 * 3
+    assert stream.tell() == 0
+
+
+def test_rejects_decompression_bomb_from_header():
+    data = _bomb_png()
+    assert len(data) < 100
+    with pytest.raises(ImageTooLargeError):
+        check_image(data)
+    with pytest.raises(ImageTooLargeError):
+        check_image(image_bytes((200, 200)), max_pixels=10000)
+
+
+def test_rejects_unsupported_and_invalid_formats():
+    with pytest.raises(UnsupportedFormatError) as excinfo:
+        sniff(image_bytes((40, 30), format='PPM'))
+    assert 'PPM' in str(excinfo.value)
+    with pytest.raises(IngestError) as excinfo:
+        sniff(b'not an image at all')
+    assert excinfo.value.status_code == 400
+
+
+def test_memory_probe_reports_peak(monkeypatch):
+    monkeypatch.setattr(ingest, 'MEMORY_TRACE', True)
+    try:
+        probe = MemoryProbe()
+        block = bytearray(8 * 1024 * 1024)
+        del block
+        assert probe.peak() >= 8 * 1024 * 1024
+    finally:
+        tracemalloc.stop()
+
+
+def test_upscale_rejects_bomb_before_processing():
+    import app as app_module
+
+    client = app_module.app.test_client()
+    response = client.post('/upscale', data={'image': (io.BytesIO(_bomb_png()), 'a.png'), 'backend': 'local'})
+    assert response.status_code == 413
+    response = client.post('/upscale', data={'image': (io.BytesIO(image_bytes((40, 30), format='PPM')), 'a.ppm'), 'backend': 'local'})
+    assert response.status_code == 415
+
+
+def test_memory_probe_traces_one_request_at_a_time(monkeypatch):
+    monkeypatch.setattr(ingest, 'MEMORY_TRACE', True)
+    try:
+        first = MemoryProbe()
+        second = MemoryProbe()  # 并发的请求不跟踪，也不会重置第一个请求的峰值
+        block = bytearray(4 * 1024 * 1024)
+        del block
+        assert second.peak() is None
+        assert first.peak() >= 4 * 1024 * 1024
+        third = MemoryProbe()
+        assert third.peak() is not None
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# test_job_queue.py - 测试持久化任务队列与租约
+
+import os
+import time
+import tempfile
+
+import pytest
+
+from jobs import QueueFullError
+from job_queue import DurableJobManager, FileJobStorage, SQLiteJobQueue, Worker, check_shared_paths
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), max_attempts=2, clock=clock)
+
+
+def test_expired_lease_is_reclaimed_until_max_attempts(queue, clock):
+    queue.enqueue('job-1', {'backend': 'hf'})
+
+    first = queue.claim('worker-a', lease_seconds=30)
+    assert first['id'] == 'job-1' and first['attempts'] == 1
+    assert queue.claim('worker-b', lease_seconds=30) is None
+
+    # worker-a 失联，租约过期后由 worker-b 接手
+    clock.now += 31
+    second = queue.claim('worker-b', lease_seconds=30)
+    assert second['id'] == 'job-1' and second['attempts'] == 2
+    assert not queue.extend_lease('job-1', 'worker-a', 30)
+    assert not queue.complete('job-1', 'worker-a', {})
+
+    # 达到最大尝试次数后不再重试
+    clock.now += 31
+    assert queue.claim('worker-c', lease_seconds=30) is None
+    job = queue.get('job-1')
+    assert job['status'] == 'failed'
+    assert 'worker lost' in job['error']
+
+
+def test_heartbeat_keeps_lease_and_release_requeues(queue, clock):
+    queue.enqueue('job-1', {'backend': 'hf'})
+    queue.claim('worker-a', lease_seconds=30)
+    clock.now += 20
+    assert queue.extend_lease('job-1', 'worker-a', 30)
+    clock.now += 20
+    assert queue.claim('worker-b', lease_seconds=30) is None
+
+    assert queue.release('job-1', 'worker-a')
+    assert queue.claim('worker-b', lease_seconds=30)['id'] == 'job-1'
+
+
+def test_worker_processes_job_end_to_end(tmp_path, queue):
+    storage = FileJobStorage(str(tmp_path / 'storage'))
+    manager = DurableJobManager(queue, storage)
+    seen = []
+
+    def runner(image_data, backend_name, info):
+        seen.append((image_data, backend_name))
+        info['model'] = backend_name
+        return image_data[::-1]
+
+    job = manager.submit({'image_data': b'abc', 'backend': 'local'})
+    assert job.status == 'queued'
+
+    worker = Worker(queue, storage, runner, worker_id='w1', lease_seconds=30)
+    assert worker.run_once()
+    assert not worker.run_once()
+
+    job = manager.get(job.id)
+    assert seen == [(b'abc', 'local')]
+    assert job.status == 'succeeded'
+    assert job.result == b'cba'
+    assert job.to_dict()['model'] == 'local'
+    assert storage.get('inputs', job.id) is None
+
+
+def test_worker_failures(tmp_path, queue):
+    storage = FileJobStorage(str(tmp_path / 'storage'))
+    manager = DurableJobManager(queue, storage)
+
+    def invalid(image_data, backend_name, info):
+        raise ValueError('Invalid image')
+
+    job = manager.submit({'image_data': b'abc', 'backend': 'hf'})
+    Worker(queue, storage, invalid, worker_id='w1').run_once()
+    assert manager.get(job.id).error == 'Invalid image'
+
+    # 其他异常视为暂时性故障，任务回到队列
+    def crash(image_data, backend_name, info):
+        raise RuntimeError('boom')
+
+    job = manager.submit({'image_data': b'abc', 'backend': 'hf'})
+    Worker(queue, storage, crash, worker_id='w2').run_once()
+    assert manager.get(job.id).status == 'queued'
+
+
+def test_transient_failures_back_off_and_keep_the_real_error(tmp_path, clock):
+    from retry_policy import CircuitOpenError
+
+    queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), max_attempts=2, max_retries=2, clock=clock)
+    storage = FileJobStorage(str(tmp_path / 'storage'))
+    job = DurableJobManager(queue, storage).submit({'image_data': b'abc', 'backend': 'hf'})
+
+    def unavailable(image_data, backend_name, info):
+        raise CircuitOpenError('hf', 30)
+
+    worker = Worker(queue, storage, unavailable, worker_id='w1', retry_base=1, retry_max=10)
+    assert worker.run_once()
+    # 退避期间不会被立即重新领取，熔断器剩余的打开时间优先于更短的退避
+    assert not worker.run_once()
+    clock.now += 29
+    assert not worker.run_once()
+
+    for _ in range(2):
+        clock.now += 31
+        assert worker.run_once()
+    row = queue.get(job.id)
+    assert row['status'] == 'failed' and row['attempts'] == 3  # 主动释放不计入 max_attempts
+    assert row['error'] == 'Upstream hf is unavailable'
+
+
+def test_submit_rejects_when_full(tmp_path, queue):
+    manager = DurableJobManager(queue, FileJobStorage(str(tmp_path / 'storage')), max_pending=1)
+    manager.submit({'image_data': b'a', 'backend': 'hf'})
+    with pytest.raises(QueueFullError) as excinfo:
+        manager.submit({'image_data': b'b', 'backend': 'hf'})
+    assert excinfo.value.retry_after >= 1
+
+
+def test_poll_events_reports_progress(tmp_path, queue):
+    storage = FileJobStorage(str(tmp_path / 'storage'))
+    manager = DurableJobManager(queue, storage)
+
+    def runner(image_data, backend_name, info):
+        import progress
+        progress.emit('inference', model=backend_name)
+        return b'result'
+
+    job = manager.submit({'image_data': b'abc', 'backend': 'hf'})
+    Worker(queue, storage, runner, worker_id='w1').run_once()
+    events = [e for e in manager.poll_events(job.id, interval=0.01, timeout=1) if e]
+    assert [e['stage'] for e in events] == ['done']
+
+    job = manager.submit({'image_data': b'abc', 'backend': 'hf'})
+    stream = manager.poll_events(job.id, interval=0.01, timeout=1)
+    assert next(stream)['stage'] == 'queued'
+    claimed = queue.claim('w2', 30)
+    queue.set_progress(job.id, 'w2', {'stage': 'inference', 'time': time.time()})
+    assert claimed['id'] == job.id
+    stages = []
+    for event in stream:
+        if event:
+            stages.append(event['stage'])
+        if len(stages) == 2:
+            break
+    assert stages == ['started', 'inference']
+
+
+def test_temp_dir_paths_are_flagged_as_not_shared():
+    temp = tempfile.gettempdir()
+    warning = check_shared_paths(os.path.join(temp, 'jobs.sqlite3'), os.path.join(temp, 'jobs'))
+    assert 'JOB_QUEUE_DB / JOB_STORAGE_DIR' in warning
+    assert check_shared_paths('/srv/shared/jobs.sqlite3', '/srv/shared/jobs') is None
+
+
+def test_reconnect_with_last_event_id_still_gets_the_final_event(tmp_path, queue, monkeypatch):
+    import app as app_module
+
+    manager = DurableJobManager(queue, FileJobStorage(str(tmp_path / 'storage')))
+    monkeypatch.setattr(app_module, 'job_manager', manager)
+    monkeypatch.setattr(app_module.progress, 'SSE_MAX_SECONDS', 0.2)
+    job = manager.submit({'image_data': b'abc', 'backend': 'hf'})
+    queue.claim('w1', 30)
+    queue.set_progress(job.id, 'w1', {'stage': 'inference'})
+
+    # 第一个连接在任务结束前到达时长上限
+    first = [e for e in manager.poll_events(job.id, interval=0.01, timeout=0.1) if e]
+    assert [e['stage'] for e in first] == ['started', 'inference']
+    last_id = first[-1]['id']
+
+    queue.complete(job.id, 'w1', {})
+    body = ''.join(app_module.durable_events_stream(job.id, last_id))
+    assert '"stage": "done"' in body
+    assert '"stage": "started"' not in body  # 已收到的事件不重复发送
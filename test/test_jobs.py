@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# test_jobs.py - 测试异步任务管理与 /jobs 接口
+
+import io
+import threading
+import time
+
+import pytest
+
+from jobs import JobManager, QueueFullError, SUCCEEDED, FAILED
+from helpers import image_bytes
+
+
+def _wait(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.done and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_job_runs_in_background():
+    manager = JobManager(lambda data, info: data[::-1], max_workers=1, max_queue=1)
+    job = _wait(manager.submit(b'abc'))
+    assert job.status == SUCCEEDED
+    assert job.result == b'cba'
+    manager.shutdown()
+
+
+def test_failed_job_reports_error():
+    manager = JobManager(lambda data, info: None, max_workers=1, max_queue=1)
+    job = _wait(manager.submit(b'abc'))
+    assert job.status == FAILED
+    assert job.error
+    manager.shutdown()
+
+
+def test_invalid_input_error_is_reported():
+    def runner(data, info):
+        raise ValueError('Invalid image file')
+
+    manager = JobManager(runner, max_workers=1, max_queue=1)
+    job = _wait(manager.submit(b'abc'))
+    assert job.status == FAILED
+    assert job.error == 'Invalid image file'
+    manager.shutdown()
+
+
+def test_queue_full_rejects_submission():
+    release = threading.Event()
+    manager = JobManager(lambda data, info: release.wait(5) and data, max_workers=1, max_queue=1)
+    manager.submit(b'1')
+    manager.submit(b'2')
+    with pytest.raises(QueueFullError) as excinfo:
+        manager.submit(b'3')
+    assert excinfo.value.retry_after >= 1
+    release.set()
+    manager.shutdown()
+
+
+def test_jobs_api_roundtrip(monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module.job_manager, 'runner', lambda data, info: b'upscaled')
+    client = app_module.app.test_client()
+
+    response = client.post('/jobs', data={'image': (io.BytesIO(image_bytes(color='blue')), 'a.png')})
+    assert response.status_code == 202
+    job_id = response.json['job_id']
+
+    _wait(app_module.job_manager.get(job_id))
+    assert client.get(f'/jobs/{job_id}').json['status'] == SUCCEEDED
+    result = client.get(f'/jobs/{job_id}/result').json
+    assert result['success'] is True
+    assert client.get('/jobs/unknown').status_code == 404
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# test_metrics.py - 测试 Prometheus 指标
+
+import io
+
+from metrics import Counter, Gauge, Histogram, Registry
+from helpers import image_bytes
+
+
+def test_render_text_format():
+    registry = Registry()
+    counter = Counter('demo_total', 'Demo counter', ['kind'], registry=registry)
+    gauge = Gauge('demo_in_flight', 'Demo gauge', registry=registry)
+    histogram = Histogram('demo_seconds', 'Demo histogram', buckets=(0.1, 1), registry=registry)
+    counter.labels('a').inc()
+    counter.labels(kind='a').inc(2)
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    text = registry.render()
+    assert '# TYPE demo_total counter' in text
+    assert 'demo_total{kind="a"} 3.0' in text
+    assert 'demo_in_flight 1.0' in text
+    assert 'demo_seconds_bucket{le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{le="1.0"} 2' in text
+    assert 'demo_seconds_bucket{le="+Inf"} 3' in text
+    assert 'demo_seconds_count 3' in text
+    assert 'demo_seconds_sum 5.55' in text
+
+
+def test_collectors_are_read_at_scrape_time():
+    registry = Registry()
+    state = {'value': 1}
+    registry.register_collector(lambda: [('demo_pending', 'gauge', 'Pending', [({}, state['value'])])])
+    state['value'] = 7
+    assert 'demo_pending 7' in registry.render()
+
+
+def test_metrics_endpoint_reports_upscale_stages():
+    from app import app
+
+    client = app.test_client()
+    response = client.post('/upscale', data={
+        'image': (io.BytesIO(image_bytes((16, 12), 'blue')), 'test.png'),
+        'backend': 'local',
+        'response': 'binary',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    response.close()
+
+    text = client.get('/metrics').get_data(as_text=True)
+    for stage in ('read', 'validate', 'cache_lookup', 'encode', 'write'):
+        assert f'upscale_stage_seconds_count{{stage="{stage}"}}' in text
+    assert 'upscale_bytes_total{direction="in"}' in text
+    assert 'http_requests_total{endpoint="upscale",status="200"}' in text
+    assert 'http_requests_in_flight{endpoint="upscale"} 0.0' in text
+    assert 'result_cache_events_total' in text
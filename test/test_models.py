@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# test_models.py - 测试模型注册表和自动路由（无需网络）
+
+import io
+import json
+
+from PIL import Image
+
+from backends import HFBackend, get_backend
+from models import ModelRouter, ModelSpec, load_model_specs, register_models
+
+
+def _backend(name, scale=4, expected_latency=5, max_input_pixels=None):
+    return HFBackend(f'http://example.invalid/models/{name}', 'token', scale=scale, name=name,
+                     expected_latency=expected_latency, max_input_pixels=max_input_pixels)
+
+
+def test_spec_builds_url_from_repo():
+    spec = ModelSpec('demo', repo='org/model', scale=2)
+    assert spec.url.endswith('/models/org/model')
+    assert spec.to_dict()['scale'] == 2
+
+
+def test_config_file_overrides_and_adds_models(tmp_path):
+    config = tmp_path / 'models.json'
+    config.write_text(json.dumps([
+        {'name': 'sd-x4', 'repo': 'stabilityai/stable-diffusion-x4-upscaler', 'scale': 4, 'timeout': 60},
+        {'name': 'custom', 'url': 'http://127.0.0.1:8500/models/mock', 'scale': 3},
+    ]))
+    specs = {spec.name: spec for spec in load_model_specs(str(config))}
+    assert specs['sd-x4'].timeout == 60
+    assert specs['custom'].scale == 3
+    assert 'real-esrgan' in specs
+
+
+def test_register_models_creates_backends():
+    specs = [ModelSpec('test-registered', url='http://example.invalid/models/registered', scale=2, timeout=30)]
+    backend, = register_models(specs, 'token')
+    assert get_backend('test-registered') is backend
+    assert backend.read_timeout == 30
+    assert backend.scale == 2
+
+
+def test_router_prefers_fastest_model_for_scale():
+    fast, slow, double = _backend('fast', expected_latency=2), _backend('slow', expected_latency=20), \
+        _backend('double', scale=2, expected_latency=1)
+    router = ModelRouter([fast, slow, double])
+    assert router.choose() is double
+    assert router.choose(scale=4) is fast
+    assert router.choose(scale=3) is None
+
+    # 实测耗时和错误率会改变选择
+    for _ in range(20):
+        fast.latency.record(60, True)
+    assert router.choose(scale=4) is slow
+    for _ in range(20):
+        slow.latency.record(1, False)
+    assert router.choose(scale=4) is fast
+
+
+def test_router_accounts_for_tiling_and_open_breakers():
+    small = _backend('small', expected_latency=2, max_input_pixels=256 * 256)
+    large = _backend('large', expected_latency=5, max_input_pixels=2048 * 2048)
+    router = ModelRouter([small, large])
+    assert router.choose(pixels=128 * 128) is small
+    assert router.choose(pixels=1024 * 1024) is large
+
+    for _ in range(large.breaker.failure_threshold):
+        large.breaker.record_failure()
+    assert router.choose(pixels=1024 * 1024) is small
+
+
+def test_router_normalizes_latency_by_pixels():
+    fast, slow = _backend('per-pixel-fast', expected_latency=1), _backend('per-pixel-slow', expected_latency=1)
+    router = ModelRouter([fast, slow])
+    # fast 处理的都是大图，单次耗时更长，但每百万像素更快
+    for _ in range(20):
+        fast.latency.record(8, True, pixels=4_000_000)
+        slow.latency.record(1, True, pixels=250_000)
+    assert fast.latency.snapshot()['seconds_per_megapixel'] == 2.0
+    assert router.choose(pixels=1_000_000) is fast
+
+
+def test_warmup_pings_are_not_recorded():
+    from backends import untracked
+
+    backend = _backend('untracked')
+    buffer = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(buffer, format='PNG')
+    with untracked():
+        backend._record_result(buffer.getvalue(), {'seconds': 30}, b'ok')
+    assert backend.latency.samples == 0 and backend.last_success_at is not None
+
+    backend._record_result(buffer.getvalue(), {'seconds': 1}, b'ok')
+    assert backend.latency.snapshot()['seconds_per_megapixel'] == 10000.0
+
+
+def test_auto_keeps_default_scale(monkeypatch):
+    import app as app_module
+
+    double, quad = _backend('auto-x2', scale=2, expected_latency=1), _backend('auto-x4', scale=4, expected_latency=5)
+    monkeypatch.setattr(app_module, 'model_router', ModelRouter([double, quad]))
+    with app_module.app.test_request_context('/upscale', method='POST', data={'model': 'auto'}):
+        assert app_module.resolve_backend()[0] is quad
+    with app_module.app.test_request_context('/upscale', method='POST', data={'model': 'auto', 'scale': '2'}):
+        assert app_module.resolve_backend()[0] is double
+
+
+def test_upscale_route_rejects_unsupported_scale():
+    from app import app
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, format='PNG')
+    client = app.test_client()
+
+    response = client.post('/upscale', data={
+        'image': (io.BytesIO(buffer.getvalue()), 'test.png'), 'model': 'auto', 'scale': '3',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+    response = client.post('/upscale', data={
+        'image': (io.BytesIO(buffer.getvalue()), 'test.png'), 'backend': 'local', 'scale': '2',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_info_lists_models():
+    from app import app
+
+    data = app.test_client().get('/info').get_json()
+    assert {'real-esrgan', 'swin2sr-x2', 'sd-x4'} <= {model['name'] for model in data['models']}
+    assert get_backend('real-esrgan') is get_backend('hf')
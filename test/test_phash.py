@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# test_phash.py - 测试感知哈希近似重复查找
+
+import io
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+import phash
+from phash import BKTree, NearDuplicateIndex, fingerprint, hamming
+
+
+def _photo(seed, size=(160, 120)):
+    """带渐变和色块的图片，近似真实照片的低频结构"""
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + rng.randrange(20, 60), y + rng.randrange(20, 60)),
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    return image
+
+
+def _encode(image, fmt='PNG', **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def _upscaled(image, scale=2):
+    return _encode(image.resize((image.width * scale, image.height * scale)))
+
+
+def test_reencoded_and_resized_copies_stay_close():
+    image = _photo(1)
+    original = fingerprint(_encode(image))
+    recompressed = fingerprint(_encode(image, 'JPEG', quality=60))
+    resized = fingerprint(_encode(image.resize((157, 118))))
+    other = fingerprint(_encode(_photo(2)))
+
+    assert hamming(original.hash, recompressed.hash) <= 4
+    assert hamming(original.hash, resized.hash) <= phash.NEAR_DUPLICATE_DISTANCE
+    assert hamming(original.hash, other.hash) > phash.NEAR_DUPLICATE_DISTANCE
+    assert (resized.width, resized.height) == (157, 118)
+    assert fingerprint(b'not an image') is None
+
+
+def test_exif_orientation_is_applied_like_preprocessing():
+    image = _photo(3)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 需要顺时针旋转 90 度
+    tagged = fingerprint(_encode(image.transpose(Image.Transpose.ROTATE_90), 'JPEG', quality=95, exif=exif))
+    upright = fingerprint(_encode(image, 'JPEG', quality=95))
+    assert (tagged.width, tagged.height) == (upright.width, upright.height)
+    assert hamming(tagged.hash, upright.hash) <= 4
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for value in values:
+        tree.add(value)
+    query = values[0] ^ 0b10110
+    found = {node.hash for _, node in tree.search(query, 12)}
+    assert found == {value for value in values if hamming(value, query) <= 12}
+
+
+def test_index_reuses_verified_near_duplicates():
+    image = _photo(4)
+    results = {'key-1': _upscaled(image)}
+    index = NearDuplicateIndex(enabled=True)
+    index.add('model', 'key-1', fingerprint(_encode(image)))
+
+    result, match = index.lookup('model', fingerprint(_encode(image.resize((158, 119)), 'JPEG', quality=70)),
+                                 results.get)
+    assert Image.open(io.BytesIO(result)).size == (316, 238)
+    assert match['distance'] <= index.max_distance
+
+    assert index.lookup('model', fingerprint(_encode(_photo(5))), results.get) == (None, None)
+    assert index.lookup('other-model', fingerprint(_encode(image)), results.get) == (None, None)
+
+    strict = NearDuplicateIndex(enabled=True, max_diff=0)
+    strict.add('model', 'key-1', fingerprint(_encode(image)))
+    assert strict.lookup('model', fingerprint(_encode(image, 'JPEG', quality=40)), results.get) == (None, None)
+    assert strict.stats()['rejected'] == 1
+
+    results.clear()
+    assert index.lookup('model', fingerprint(_encode(image)), results.get) == (None, None)
+    stats = index.stats()
+    assert stats['stale'] == 1 and stats['entries'] == 0
+    assert stats['hits'] == 1 and stats['hit_rate'] == 0.25
+
+
+def test_index_evicts_oldest_entries():
+    index = NearDuplicateIndex(enabled=True, max_entries=2)
+    for seed in range(3):
+        index.add('model', f'key-{seed}', fingerprint(_encode(_photo(seed))))
+    assert index.stats()['entries'] == 2
+    assert [entry.cache_key for _, entry in index.candidates('model', fingerprint(_encode(_photo(0))))] == []
+
+
+def test_upscale_reuses_result_for_recompressed_upload(monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, 'near_index', NearDuplicateIndex(enabled=True))
+    client = app_module.app.test_client()
+    image = _photo(os.urandom(8))  # 每次内容不同，避免命中之前运行留下的磁盘缓存
+
+    first = client.post('/upscale', data={'image': (io.BytesIO(_encode(image)), 'a.png'), 'backend': 'local'},
+                        content_type='multipart/form-data').get_json()
+    assert first['cached'] is False
+
+    second = client.post('/upscale', data={
+        'image': (io.BytesIO(_encode(image, 'JPEG', quality=80)), 'a.jpg'), 'backend': 'local',
+    }, content_type='multipart/form-data').get_json()
+    assert second['cached'] is True
+    assert second['near_duplicate']['distance'] <= phash.NEAR_DUPLICATE_DISTANCE
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# test_preprocess.py - 测试推理前的图片规范化
+
+import io
+import struct
+
+import pytest
+from PIL import Image, ImageCms, PngImagePlugin
+
+from preprocess import InvalidImageError, normalize_image
+
+
+def _encode(img, fmt, **params):
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def test_opaque_alpha_is_dropped():
+    data = _encode(Image.new('RGBA', (32, 16), (10, 20, 30, 255)), 'PNG')
+    output, metrics = normalize_image(data)
+    with Image.open(io.BytesIO(output)) as img:
+        assert img.mode == 'RGB'
+    assert 'drop_alpha' in metrics['actions']
+    assert metrics['pixels_in'] == metrics['pixels_out'] == 32 * 16
+
+
+def test_exif_orientation_applied_and_metadata_stripped():
+    img = Image.new('RGB', (40, 20), 'red')
+    exif = img.getexif()
+    exif[0x0112] = 6  # 顺时针旋转 90 度
+    data = _encode(img, 'JPEG', exif=exif.tobytes())
+    output, metrics = normalize_image(data)
+    with Image.open(io.BytesIO(output)) as result:
+        assert result.size == (20, 40)
+        assert not result.info.get('exif')
+    assert 'exif_orientation' in metrics['actions']
+
+
+def _swapped_profile():
+    """红、蓝原色互换的 RGB 配置文件 (由内置 sRGB 修改而来，描述中不再含 sRGB)"""
+    data = bytearray(ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes())
+    entries = {bytes(data[132 + 12 * i:136 + 12 * i]): 132 + 12 * i
+               for i in range(struct.unpack('>I', data[128:132])[0])}
+    red, blue = entries[b'rXYZ'], entries[b'bXYZ']
+    data[red + 4:red + 12], data[blue + 4:blue + 12] = data[blue + 4:blue + 12], data[red + 4:red + 12]
+    return bytes(data).replace(b'\x00s\x00R\x00G\x00B', b'\x00t\x00e\x00s\x00t')
+
+
+def test_icc_profile_is_converted_to_srgb_before_stripping():
+    data = _encode(Image.new('RGB', (8, 8), (200, 100, 50)), 'PNG', icc_profile=_swapped_profile())
+    output, metrics = normalize_image(data)
+    with Image.open(io.BytesIO(output)) as result:
+        assert not result.info.get('icc_profile')
+        assert result.getpixel((0, 0)) == (50, 100, 200)
+    assert 'icc_to_srgb' in metrics['actions'] and 'strip_metadata' in metrics['actions']
+
+
+def test_metadata_is_stripped_without_reencoding_jpeg():
+    img = Image.new('RGB', (40, 20), 'red')
+    exif = img.getexif()
+    exif[0x010F] = 'camera'
+    exif[0x8825] = {2: (1.0, 2.0, 3.0)}  # GPS
+    data = _encode(img, 'JPEG', quality=70, exif=exif.tobytes(), comment=b'secret')
+    output, metrics = normalize_image(data)
+    assert len(output) < len(data) and metrics['actions'] == ['strip_metadata']
+    with Image.open(io.BytesIO(output)) as result:
+        assert not result.info.get('exif') and not result.getexif()
+        assert not result.info.get('comment')
+    # 压缩数据原样保留
+    assert output[output.index(b'\xff\xda'):] == data[data.index(b'\xff\xda'):]
+
+    # 需要重新编码时沿用原图的量化表，而不是固定的 quality=95
+    exif[0x0112] = 6
+    data = _encode(img, 'JPEG', quality=70, exif=exif.tobytes(), comment=b'secret')
+    output, _ = normalize_image(data)
+    with Image.open(io.BytesIO(data)) as source, Image.open(io.BytesIO(output)) as result:
+        assert result.quantization == source.quantization
+        assert not result.getexif() and not result.info.get('comment')
+
+
+def test_png_text_and_exif_chunks_are_dropped_losslessly():
+    img = Image.new('RGB', (16, 16), (1, 2, 3))
+    info = PngImagePlugin.PngInfo()
+    info.add_text('Comment', 'secret')
+    exif = img.getexif()
+    exif[0x010F] = 'camera'
+    data = _encode(img, 'PNG', pnginfo=info, exif=exif.tobytes())
+    output, metrics = normalize_image(data)
+    assert metrics['actions'] == ['strip_metadata'] and metrics['format_out'] == 'PNG'
+    with Image.open(io.BytesIO(output)) as result:
+        assert 'Comment' not in result.info and not result.getexif()
+        assert result.tobytes() == img.tobytes()
+
+
+def test_input_capped_for_target_scale():
+    data = _encode(Image.new('RGB', (100, 100), 'blue'), 'PNG')
+    output, metrics = normalize_image(data, scale=4, max_output_pixels=200 * 200)
+    assert (metrics['width_out'], metrics['height_out']) == (50, 50)
+    assert metrics['bytes_in'] == len(data)
+    assert metrics['bytes_out'] == len(output)
+
+
+def test_unchanged_image_keeps_smaller_original():
+    data = _encode(Image.new('RGB', (16, 16), 'white'), 'PNG', optimize=True)
+    output, metrics = normalize_image(data)
+    assert len(output) <= len(data)
+    assert metrics['actions'] == []
+
+
+def test_invalid_image_raises():
+    with pytest.raises(InvalidImageError):
+        normalize_image(b'definitely not an image')
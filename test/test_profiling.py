@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# test_profiling.py - 测试请求阶段计时与慢请求采样
+
+import io
+import time
+import pstats
+
+import pytest
+
+import profiling
+from metrics import time_stage
+from profiling import Profiler
+from helpers import image_bytes
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_stage_timer_collects_time_stage_only_while_bound(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, slow_ms=10000)
+    profile = profiler.begin('upscale')
+    with time_stage('preprocess'):
+        pass
+    with time_stage('preprocess'):
+        pass
+    assert profile.timer.server_timing().startswith('preprocess;dur=')
+    profiler.end(profile)
+    with time_stage('inference'):
+        pass
+    assert 'inference' not in profile.timer.stages
+    assert profiler.list_files() == []
+
+
+def test_disabled_profiler_does_nothing(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=False)
+    assert profiler.begin('upscale') is None
+    assert profiling.current_timer() is None
+
+
+def test_slow_request_writes_collapsed_stacks(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, mode='stack', slow_ms=0, interval_ms=1)
+    profile = profiler.begin('upscale')
+    _busy(0.05)
+    path = profiler.end(profile)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert any('test_profiling.py:_busy' in line for line in lines)
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+
+
+def test_cprofile_mode_and_rotation(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, mode='cprofile', slow_ms=0, max_files=2)
+    for _ in range(3):
+        path = profiler.end(profiler.begin('upscale'))
+    assert path.endswith('.prof')
+    pstats.Stats(path)
+    assert len(profiler.list_files()) == 2
+
+
+def test_settings_are_shared_through_the_settings_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'SETTINGS_RELOAD_SECONDS', 0)
+    first, second = Profiler(str(tmp_path)), Profiler(str(tmp_path))
+    first.update(enabled=True, mode='cprofile', slow_ms=5)
+    assert second.settings == profiling.ProfilerSettings(True, 'cprofile', 5)
+    with pytest.raises(ValueError):
+        first.update(mode='perf')
+
+    # 重新部署时改了环境变量，旧的设置文件不再覆盖它
+    redeployed = Profiler(str(tmp_path), enabled=True, slow_ms=100)
+    assert redeployed.settings == profiling.ProfilerSettings(True, 'stack', 100)
+
+
+def test_admin_endpoint_toggles_profiling(tmp_path, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(profiling, 'SETTINGS_RELOAD_SECONDS', 0)
+    monkeypatch.setattr(app_module, 'profiler', Profiler(str(tmp_path)))
+    client = app_module.app.test_client()
+    assert client.get('/admin/profiling').status_code == 404
+
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', 'secret')
+    assert client.get('/admin/profiling', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    response = client.post('/admin/profiling', json={'enabled': True, 'slow_ms': 0},
+                           headers={'X-Admin-Token': 'secret'})
+    assert response.get_json()['settings']['enabled'] is True
+    assert client.post('/admin/profiling', json={'mode': 'perf'},
+                       headers={'X-Admin-Token': 'secret'}).status_code == 400
+
+    response = client.post('/upscale', data={'image': (io.BytesIO(image_bytes(noise=True)), 'test.png'), 'backend': 'local'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert 'read;dur=' in response.headers['Server-Timing']
+    assert 'serialize;dur=' in response.headers['Server-Timing']
+
+    files = client.get('/admin/profiling', headers={'X-Admin-Token': 'secret'}).get_json()['files']
+    assert len(files) == 1
+    download = client.get(f"/admin/profiling/{files[0]['name']}", headers={'X-Admin-Token': 'secret'})
+    assert download.status_code == 200
+    assert client.get('/admin/profiling/settings.json', headers={'X-Admin-Token': 'secret'}).status_code == 404
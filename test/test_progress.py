@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# test_progress.py - 测试处理进度事件 (SSE)
+
+import io
+import json
+import time
+import uuid
+import asyncio
+import threading
+
+import httpx
+
+import progress
+from jobs import JobManager
+from progress import ProgressChannel, ProgressRegistry, sse_stream
+from retry_policy import Outcome, RetryPolicy, call_with_retry
+from helpers import image_bytes
+
+
+def _parse_sse(text):
+    events = []
+    for block in text.split('\n\n'):
+        for line in block.splitlines():
+            if line.startswith('data: '):
+                events.append(json.loads(line[len('data: '):]))
+    return events
+
+
+def test_emit_without_channel_is_noop():
+    progress.emit('anything', value=1)
+
+
+def test_stream_resumes_after_last_event_id_and_ends_on_done():
+    channel = ProgressChannel('channel-1')
+    channel.emit('received')
+    channel.emit('attempt', attempt=1)
+    channel.emit(progress.DONE)
+    channel.emit('ignored')  # 关闭后的事件被丢弃
+
+    stages = [event['stage'] for event in _parse_sse(''.join(sse_stream(channel)))]
+    assert stages == ['received', 'attempt', 'done']
+    resumed = _parse_sse(''.join(sse_stream(channel, last_id=2)))
+    assert [event['stage'] for event in resumed] == ['done']
+
+
+def test_subscriber_waits_for_new_events():
+    channel = ProgressChannel('channel-2')
+    received = []
+
+    def subscribe():
+        received.extend(_parse_sse(''.join(sse_stream(channel, heartbeat=0.05))))
+
+    thread = threading.Thread(target=subscribe)
+    thread.start()
+    time.sleep(0.1)
+    channel.emit('tile', done=1, total=2)
+    channel.emit(progress.FAILED, error='boom')
+    thread.join(timeout=2)
+    assert [event['stage'] for event in received] == ['tile', 'failed']
+
+
+def test_registry_rejects_invalid_ids():
+    registry = ProgressRegistry()
+    assert registry.get_or_create('../x') is None
+    assert registry.get_or_create(None) is None
+    assert registry.get_or_create('abcdefgh') is registry.get_or_create('abcdefgh')
+
+
+def test_retry_engine_reports_attempts():
+    channel = ProgressChannel('channel-3')
+    outcomes = [Outcome(retryable=True, delay_hint=0), Outcome(result=b'ok')]
+    with progress.bind(channel):
+        call_with_retry(lambda timeout: outcomes.pop(0), RetryPolicy(max_attempts=3), sleep=lambda s: None)
+    stages = [event['stage'] for event in channel.events_after(0)]
+    assert stages == ['attempt', 'retry_wait', 'attempt']
+
+
+def test_job_progress_from_queue_to_done():
+    registry = ProgressRegistry()
+
+    def runner(payload, info):
+        progress.emit('inference')
+        return b'result'
+
+    manager = JobManager(runner, max_workers=1, progress_registry=registry)
+    job = manager.submit({})
+    channel = registry.get(job.id)
+    events = _parse_sse(''.join(sse_stream(channel)))
+    manager.shutdown()
+    assert [event['stage'] for event in events] == ['queued', 'started', 'inference', 'done']
+    assert events[0]['position'] == 0
+
+
+def test_subscriber_created_channels_are_capped():
+    registry = ProgressRegistry(max_pending=2, pending_ttl=60)
+    assert registry.subscribe('a' * 8) is not None
+    assert registry.subscribe('b' * 8) is not None
+    assert registry.subscribe('c' * 8) is None
+    assert registry.subscribe('a' * 8) is not None  # 已有的通道照常订阅
+
+    # 处理一侧不受限制；有了事件的通道不再算作等待中
+    registry.get_or_create('d' * 8).emit('received')
+    registry.get('a' * 8).emit('received')
+    assert registry.subscribe('c' * 8) is not None
+
+    # 一直没有事件的通道很快过期
+    registry.get('b' * 8).updated_at -= 61
+    assert registry.subscribe('e' * 8) is not None
+    assert registry.get('b' * 8) is None
+
+
+def test_progress_subscription_returns_429_when_full(monkeypatch):
+    from app import app, progress_registry
+
+    monkeypatch.setattr(progress_registry, 'max_pending', 0)
+    response = app.test_client().get(f'/progress/{uuid.uuid4().hex}/events')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(progress_registry.pending_ttl)
+
+
+def test_upscale_request_progress_stream():
+    from app import app
+
+    client = app.test_client()
+    progress_id = uuid.uuid4().hex
+    response = client.post('/upscale', data={
+        'image': (io.BytesIO(image_bytes(noise=True)), 'test.png'),
+        'backend': 'local',
+        'progress_id': progress_id,
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+
+    stream = client.get(f'/progress/{progress_id}/events')
+    assert stream.mimetype == 'text/event-stream'
+    stages = [event['stage'] for event in _parse_sse(stream.get_data(as_text=True))]
+    assert stages[0] == 'received'
+    assert 'inference' in stages and 'encoding' in stages
+    assert stages[-1] == 'done'
+
+    assert client.get('/jobs/unknown/events').status_code == 404
+
+
+def test_asgi_streams_events_without_threads():
+    import asgi
+    from app import progress_registry
+
+    channel = progress_registry.get_or_create(uuid.uuid4().hex)
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            asyncio.get_running_loop().call_later(0.3, channel.emit, progress.DONE)
+            return await client.get(f'/progress/{channel.id}/events', timeout=5)
+
+    response = asyncio.run(run())
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert [event['stage'] for event in _parse_sse(response.text)] == ['done']
+
+
+def test_wsgi_jobs_do_not_advertise_events_and_streams_are_bounded(monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, 'EVENTS_ADVERTISED', False)
+    response = app_module.app.test_client().post('/jobs', data={
+        'image': (io.BytesIO(image_bytes(noise=True)), 'test.png'), 'backend': 'local',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 202
+    assert 'events_url' not in response.get_json()
+
+    # 通道一直没有结束时，响应在 max_seconds 后结束，由客户端重连
+    channel = ProgressChannel('bounded')
+    start = time.monotonic()
+    text = ''.join(sse_stream(channel, heartbeat=0.05, max_seconds=0.2))
+    assert 0.2 <= time.monotonic() - start < 1
+    assert text.startswith('retry:')
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# test_rate_limit.py - 测试客户端限流与上游公平调度
+
+import io
+import os
+import time
+import asyncio
+import threading
+
+import pytest
+from PIL import Image
+
+from rate_limit import (
+    BATCH, INTERACTIVE, FairScheduler, MemoryBucketStore, RateLimitedError, RateLimiter,
+    SQLiteBucketStore, make_flow,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_client_bucket_reports_exact_retry_after():
+    clock = FakeClock()
+    limiter = RateLimiter(per_minute=60, burst=2, store=MemoryBucketStore(clock=clock))
+    limiter.check('ip:1')
+    limiter.check('ip:1')
+    with pytest.raises(RateLimitedError) as excinfo:
+        limiter.check('ip:1')
+    assert excinfo.value.retry_after == pytest.approx(1.0)
+    assert excinfo.value.retry_after_header == '1'
+
+    limiter.check('ip:2')  # 其他客户端不受影响
+    clock.now += 1.0
+    limiter.check('ip:1')
+
+
+def test_full_bucket_accepts_oversized_batch_then_waits():
+    clock = FakeClock()
+    limiter = RateLimiter(per_minute=60, burst=2, store=MemoryBucketStore(clock=clock))
+    limiter.check('ip:1', cost=5)
+    with pytest.raises(RateLimitedError) as excinfo:
+        limiter.check('ip:1')
+    assert excinfo.value.retry_after == pytest.approx(4.0)
+
+
+def test_sqlite_buckets_are_shared(tmp_path):
+    path = str(tmp_path / 'buckets.sqlite3')
+    first = RateLimiter(per_minute=1, burst=1, store=SQLiteBucketStore(path))
+    second = RateLimiter(per_minute=1, burst=1, store=SQLiteBucketStore(path))
+    first.check('key:abc')
+    with pytest.raises(RateLimitedError):
+        second.check('key:abc')
+
+
+def test_interactive_flow_overtakes_queued_batch_work():
+    scheduler = FairScheduler(concurrency=1)
+    order = []
+    scheduler.acquire('m', make_flow('batch-user', BATCH))
+
+    def call(name, flow):
+        with scheduler.slot('m', flow):
+            order.append(name)
+
+    threads = []
+    for i in range(4):
+        threads.append(threading.Thread(target=call, args=(f'b{i}', make_flow('batch-user', BATCH))))
+        threads[-1].start()
+        while sum(scheduler.stats()['waiting'].values()) < i + 1:
+            time.sleep(0.001)
+    for i in range(2):
+        threads.append(threading.Thread(target=call, args=(f'i{i}', make_flow('web-user', INTERACTIVE))))
+        threads[-1].start()
+        while sum(scheduler.stats()['waiting'].values()) < 5 + i:
+            time.sleep(0.001)
+
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert order[:2] == ['i0', 'i1']
+    assert sorted(order[2:]) == ['b0', 'b1', 'b2', 'b3']
+
+
+def test_interactive_queue_timeout_raises_with_retry_after():
+    scheduler = FairScheduler(concurrency=1)
+    scheduler.acquire('m')
+    flow = make_flow('web-user', INTERACTIVE)._replace(timeout=0.05)
+    with pytest.raises(RateLimitedError) as excinfo:
+        scheduler.acquire('m', flow)
+    assert excinfo.value.scope == 'upstream_queue'
+    assert excinfo.value.retry_after > 0
+    assert scheduler.stats()['waiting'] == {}
+
+
+def test_cancelled_async_waiter_does_not_leak_a_slot():
+    scheduler = FairScheduler(concurrency=1)
+
+    async def run():
+        scheduler.acquire('m')
+        queued = asyncio.create_task(scheduler.acquire_async('m', make_flow('web-user', BATCH)))
+        while not scheduler.stats()['waiting']:
+            await asyncio.sleep(0.001)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert scheduler.stats()['waiting'] == {}
+
+        # 放行与取消同时发生：槽位已经分配给被取消的协程，应当归还
+        granted = asyncio.create_task(scheduler.acquire_async('m', make_flow('web-user', BATCH)))
+        while not scheduler.stats()['waiting']:
+            await asyncio.sleep(0.001)
+        scheduler.release()
+        granted.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await granted
+
+    asyncio.run(run())
+    stats = scheduler.stats()
+    assert stats['in_flight'] == 0 and stats['rejected'] == 0
+
+
+def test_model_rate_and_upstream_pause():
+    scheduler = FairScheduler(concurrency=4, model_per_minute=600, model_burst=1)
+    start = time.monotonic()
+    with scheduler.slot('m'):
+        pass
+    with scheduler.slot('m'):  # 令牌用完后等待补充 (0.1 秒一个)
+        pass
+    assert time.monotonic() - start >= 0.08
+
+    scheduler.pause('other', 0.1)
+    start = time.monotonic()
+
+    async def run():
+        async with scheduler.slot_async('other'):
+            pass
+
+    asyncio.run(run())
+    assert time.monotonic() - start >= 0.08
+
+
+def test_upscale_returns_429_with_retry_after(monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, 'rate_limiter', RateLimiter(per_minute=30, burst=1))
+    client = app_module.app.test_client()
+
+    def post():
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (8, 8), os.urandom(8 * 8 * 3)).save(buffer, format='PNG')
+        return client.post('/upscale', data={'image': (io.BytesIO(buffer.getvalue()), 'a.png'), 'backend': 'local'},
+                           headers={'X-API-Key': 'test-key'})
+
+    assert post().status_code == 200
+    response = post()
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert response.get_json()['retry_after'] == pytest.approx(2.0, abs=0.1)
+
+
+def test_only_configured_api_keys_get_their_own_bucket(monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, 'rate_limiter', RateLimiter(per_minute=30, burst=1, keys={'known'}))
+    monkeypatch.setattr(app_module, 'client_key_digest', lambda key: key)
+
+    def client(headers, remote_addr='10.0.0.1'):
+        with app_module.app.test_request_context('/', headers=headers, environ_base={'REMOTE_ADDR': remote_addr}):
+            return app_module.client_id()
+
+    assert client({'X-API-Key': 'known'}) == 'key:known'
+    # 随机的 Key 不能换来新的令牌桶
+    assert client({'X-API-Key': 'random-1'}) == client({'X-API-Key': 'random-2'}) == 'ip:10.0.0.1'
+
+
+def test_forwarded_client_ip_is_trusted_only_for_configured_hops(monkeypatch):
+    import app as app_module
+
+    def remote_addr(hops):
+        monkeypatch.setattr(app_module, 'TRUSTED_PROXY_HOPS', hops)
+        wsgi = app_module.proxy_fix(lambda environ, start_response: environ['REMOTE_ADDR'])
+        return wsgi({'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': '1.2.3.4, 5.6.7.8'}, None)
+
+    assert remote_addr(0) == '10.0.0.1'
+    assert remote_addr(1) == '5.6.7.8'
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# test_result_cache.py - 测试超分结果两级缓存
+
+import threading
+
+import result_cache
+from result_cache import ResultCache, make_cache_key
+
+
+def test_cache_key_depends_on_params():
+    key = make_cache_key(b'img', 'https://model', scale=4)
+    assert key == make_cache_key(b'img', 'https://model', scale=4)
+    assert key != make_cache_key(b'img', 'https://model', scale=2)
+    assert key != make_cache_key(b'img', 'https://other', scale=4)
+    assert key != make_cache_key(b'img2', 'https://model', scale=4)
+
+
+def test_memory_lru_eviction():
+    cache = ResultCache(memory_bytes=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'12345')
+    assert cache.get('a') == b'12345'  # a 变为最近使用
+    cache.put('c', b'12345')           # 淘汰最久未使用的 b
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    stats = cache.stats()
+    assert stats['memory_evictions'] == 1
+    assert stats['misses'] == 1
+
+
+def test_disk_tier_survives_restart_and_respects_budget(tmp_path):
+    cache = ResultCache(memory_bytes=4, disk_dir=str(tmp_path), disk_bytes=10)
+    cache.put('a', b'123456')
+    assert cache.get('a') == b'123456'
+    assert cache.stats()['disk_hits'] == 1
+
+    cache.put('b', b'123456')
+    stats = cache.stats()
+    assert stats['disk_evictions'] == 1
+    assert stats['disk_bytes'] <= 10
+
+    reopened = ResultCache(memory_bytes=4, disk_dir=str(tmp_path), disk_bytes=10)
+    assert reopened.get('b') == b'123456'
+    assert reopened.get('a') is None
+
+
+def test_disk_entry_written_by_another_process_is_found(tmp_path):
+    # 两个 worker 进程各自在启动后建立了索引
+    first = ResultCache(memory_bytes=4, disk_dir=str(tmp_path), disk_bytes=100)
+    second = ResultCache(memory_bytes=4, disk_dir=str(tmp_path), disk_bytes=100)
+    assert first.get('a') is None and second.get('a') is None
+
+    first.put('a', b'123456')
+    assert second.get('a') == b'123456'
+    assert second.stats()['disk_hits'] == 1
+    assert len(second.disk) == 1
+
+
+def test_disabled_cache_never_stores():
+    cache = ResultCache(memory_bytes=100, enabled=False)
+    cache.put('a', b'1')
+    assert cache.get('a') is None
+
+
+def test_slow_disk_read_does_not_block_memory_hits(tmp_path, monkeypatch):
+    cache = ResultCache(memory_bytes=4, disk_dir=str(tmp_path), disk_bytes=100)
+    cache.put('cold', b'123456')  # 超过内存层容量，只在磁盘上
+    cache.put('hot', b'1234')
+    reading, release = threading.Event(), threading.Event()
+
+    def slow_open(*args, **kwargs):
+        reading.set()
+        release.wait(5)
+        return open(*args, **kwargs)
+
+    monkeypatch.setattr(result_cache, 'open', slow_open, raising=False)
+    results = []
+    reader = threading.Thread(target=lambda: results.append(cache.get('cold')))
+    reader.start()
+    assert reading.wait(5)
+    # 磁盘读取进行中，内存命中和写入不需要等待
+    assert cache.get('hot') == b'1234'
+    cache.put('new', b'12')
+    release.set()
+    reader.join(5)
+    assert results == [b'123456']
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# test_retry_policy.py - 测试重试策略与熔断器
+
+import asyncio
+
+import pytest
+
+from retry_policy import (
+    CircuitBreaker, CircuitOpenError, Outcome, RetryMetrics, RetryPolicy,
+    call_with_retry, call_with_retry_async, parse_retry_after,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _scripted(outcomes, clock=None, cost=0.0):
+    """按顺序返回预设结果的 attempt 函数，记录每次收到的超时"""
+    timeouts = []
+
+    def attempt(timeout):
+        timeouts.append(timeout)
+        if clock:
+            clock.now += cost
+        return outcomes.pop(0)
+
+    return attempt, timeouts
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('5') == 5.0
+    assert parse_retry_after('-3') == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    for attempt in range(8):
+        for _ in range(50):
+            assert 0 <= policy.backoff(attempt) <= min(5.0, 2 ** attempt)
+
+
+def test_delay_hint_is_honoured():
+    policy = RetryPolicy(max_attempts=3, max_delay=30)
+    delay = policy.next_delay(0, Outcome(retryable=True, delay_hint=10), remaining=100)
+    assert 10 <= delay <= 11
+    # 等待时间超过剩余截止时间时不再重试
+    assert policy.next_delay(0, Outcome(retryable=True, delay_hint=10), remaining=5) is None
+    assert policy.next_delay(0, Outcome(retryable=False), remaining=100) is None
+    assert policy.next_delay(2, Outcome(retryable=True), remaining=100) is None
+
+
+def test_retries_until_success():
+    clock = FakeClock()
+    attempt, _ = _scripted([
+        Outcome(retryable=True, failure=True),
+        Outcome(retryable=True, delay_hint=2),
+        Outcome(result=b'ok'),
+    ])
+    metrics = RetryMetrics()
+    result = call_with_retry(attempt, RetryPolicy(max_attempts=4), metrics=metrics,
+                             sleep=clock.sleep, clock=clock)
+    assert result == b'ok'
+    stats = metrics.snapshot()
+    assert stats['attempts'] == 3
+    assert stats['retries'] == 2
+    assert stats['successes'] == 1
+
+
+def test_non_retryable_stops_immediately():
+    clock = FakeClock()
+    attempt, timeouts = _scripted([Outcome(reason='HTTP 400')])
+    metrics = RetryMetrics()
+    assert call_with_retry(attempt, RetryPolicy(), metrics=metrics, sleep=clock.sleep, clock=clock) is None
+    assert len(timeouts) == 1
+    assert metrics.snapshot()['failures'] == 1
+
+
+def test_deadline_limits_attempt_timeout_and_retries():
+    clock = FakeClock()
+    outcomes = [Outcome(retryable=True, failure=True) for _ in range(10)]
+    attempt, timeouts = _scripted(outcomes, clock=clock, cost=40)
+    metrics = RetryMetrics()
+    policy = RetryPolicy(max_attempts=10, base_delay=1, max_delay=1, deadline=100)
+    assert call_with_retry(attempt, policy, metrics=metrics, read_timeout=180,
+                           sleep=clock.sleep, clock=clock) is None
+    assert timeouts[0] == 100
+    assert all(t <= 100 for t in timeouts)
+    assert clock.now <= 100 + 40
+    assert metrics.snapshot()['deadline_exceeded'] == 1
+
+
+def test_breaker_opens_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.retry_after == 10
+
+    clock.now += 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()  # 试探请求
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # 同一时间只放行一个试探
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_reopens_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.record_failure()
+    clock.now += 5
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.snapshot()['times_opened'] == 2
+
+
+def test_open_breaker_rejects_without_calling_upstream():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30, clock=clock)
+    metrics = RetryMetrics()
+    attempt, timeouts = _scripted([Outcome(retryable=True, failure=True) for _ in range(4)])
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(attempt, RetryPolicy(), breaker, metrics, sleep=clock.sleep, clock=clock)
+    assert len(timeouts) == 1
+    assert metrics.snapshot()['breaker_rejections'] == 1
+
+
+def test_loading_responses_do_not_trip_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30, clock=clock)
+    attempt, _ = _scripted([Outcome(retryable=True, delay_hint=1), Outcome(result=b'ok')])
+    assert call_with_retry(attempt, RetryPolicy(), breaker, sleep=clock.sleep, clock=clock) == b'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_async_retry():
+    outcomes = [Outcome(retryable=True, delay_hint=0), Outcome(result=b'ok')]
+
+    async def attempt(timeout):
+        return outcomes.pop(0)
+
+    result = asyncio.run(call_with_retry_async(attempt, RetryPolicy(max_attempts=2)))
+    assert result == b'ok'
+
+
+def test_hf_backend_classifies_responses():
+    from backends import HFBackend
+
+    backend = HFBackend('http://example.invalid/model', 'token')
+    loading = backend._classify(503, {}, b'{"error": "loading", "estimated_time": 12.5}')
+    assert loading.retryable and not loading.failure and loading.delay_hint == 12.5
+    limited = backend._classify(429, {'Retry-After': '7'}, b'')
+    assert limited.retryable and not limited.failure and limited.delay_hint == 7
+    broken = backend._classify(502, {}, b'bad gateway')
+    assert broken.retryable and broken.failure
+    rejected = backend._classify(400, {}, b'bad request')
+    assert not rejected.retryable and not rejected.failure
+    assert backend._classify(200, {}, b'img').result == b'img'
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# test_singleflight.py - 测试相同请求合并
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from singleflight import SingleFlight, AsyncSingleFlight
+
+
+def _run_concurrently(flight, fn, count=5):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(flight.do('key', fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        return b'result'
+
+    flight = SingleFlight()
+    results, errors = _run_concurrently(flight, fn)
+    assert not errors
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(result == b'result' for result, _ in results)
+    stats = flight.snapshot()
+    assert stats['leaders'] == 1 and stats['coalesced'] == 4 and stats['in_flight'] == 0
+
+
+def test_leader_failure_propagates_to_followers():
+    def fn():
+        time.sleep(0.2)
+        raise ValueError('boom')
+
+    flight = SingleFlight()
+    results, errors = _run_concurrently(flight, fn, count=3)
+    assert not results
+    assert len(errors) == 3
+    stats = flight.snapshot()
+    assert stats['leader_failures'] == 1 and stats['followers_failed'] == 2
+
+    # 失败后不残留，下一次调用重新执行
+    assert flight.do('key', lambda: b'ok') == (b'ok', False)
+
+
+def test_async_followers_survive_leader_cancellation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return b'result'
+
+    async def run():
+        flight = AsyncSingleFlight()
+        leader = asyncio.ensure_future(flight.do('key', compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('key', compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, flight.stats.snapshot()
+
+    (result, shared), stats = asyncio.run(run())
+    assert result == b'result' and shared is True
+    assert len(calls) == 1
+    assert stats['coalesced'] == 1 and stats['in_flight'] == 0
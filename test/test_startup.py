@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# test_startup.py - 测试导入时不做耗时或不能跨 fork 的初始化
+
+import os
+import sys
+import json
+import subprocess
+
+from job_queue import SQLiteJobQueue
+from rate_limit import SQLiteBucketStore
+from result_cache import ResultCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import sys, json, threading
+import app
+state = {'import': (threading.active_count(), 'requests' in sys.modules)}
+app.create_app(preload=True)
+state['preload'] = (threading.active_count(), 'requests' in sys.modules)
+app.start_background_tasks()
+state['started'] = app.warmup.running
+print(json.dumps(state))
+"""
+
+
+def test_import_is_lazy_and_preload_starts_no_threads(tmp_path):
+    env = dict(os.environ, WARMUP_ENABLED='true', HF_API_TOKEN='token',
+               HF_API_URL='http://127.0.0.1:9/models/none', RESULT_CACHE_DIR=str(tmp_path))
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                                     stderr=subprocess.DEVNULL, text=True)
+    state = json.loads(output.strip().splitlines()[-1])
+    assert state['import'] == [1, False]
+    assert state['preload'] == [1, True]
+    assert state['started'] is True
+
+
+def test_disk_cache_index_loads_on_first_use(tmp_path):
+    first = ResultCache(1024, str(tmp_path), 1 << 20)
+    first.put('ab' * 32, b'result')
+
+    cache = ResultCache(1024, str(tmp_path), 1 << 20)
+    assert cache.disk.loaded is False
+    assert cache.get('ab' * 32) == b'result'
+    assert cache.stats()['disk_entries'] == 1
+
+
+def test_sqlite_stores_do_not_keep_the_schema_connection(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / 'jobs.db'))
+    buckets = SQLiteBucketStore(str(tmp_path / 'buckets.db'))
+    assert queue._local.conn is None and buckets._local.conn is None
+    queue.enqueue('job-1', {})
+    assert queue.get('job-1') is not None
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# test_tiling.py - 测试大图分块超分与拼接
+
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from backends import LocalBackend
+from ingest import ImageTooLargeError
+from tiling import plan_tiles, upscale_tiled, should_tile
+
+
+def _image_bytes(size=(300, 200)):
+    img = Image.new('RGB', size, color='white')
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([20, 20, 180, 150], fill='blue', outline='red', width=3)
+    draw.ellipse([120, 60, 280, 190], fill='yellow')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_plan_tiles_covers_image_with_overlap():
+    boxes = plan_tiles(300, 200, tile_size=128, overlap=16)
+    covered = set()
+    for left, top, right, bottom in boxes:
+        assert right - left <= 128 and bottom - top <= 128
+        covered.update((x, y) for x in range(left, right) for y in range(top, bottom))
+    assert len(covered) == 300 * 200
+    assert boxes[1][0] < boxes[0][2]  # 相邻分块有重叠
+
+
+def test_tiled_result_matches_whole_image_upscale():
+    data = _image_bytes()
+    backend = LocalBackend(scale=2, sharpen=False)
+    tiled = Image.open(io.BytesIO(upscale_tiled(data, backend, tile_size=96, overlap=16, concurrency=3)))
+    whole = Image.open(io.BytesIO(backend.upscale(data)))
+    assert tiled.size == whole.size == (600, 400)
+
+    # 羽化拼接后不应出现明显接缝
+    diff = [abs(a - b) for a, b in zip(tiled.convert('L').getdata(), whole.convert('L').getdata())]
+    assert max(diff) < 64
+    assert sum(diff) / len(diff) < 2
+
+
+def test_tile_failure_fails_whole_image():
+    class FailingBackend(LocalBackend):
+        def upscale(self, image_data):
+            return None
+
+    assert upscale_tiled(_image_bytes(), FailingBackend(), tile_size=96, overlap=16) is None
+
+
+def test_should_tile_by_pixel_count():
+    assert should_tile(_image_bytes((300, 200)), threshold=1000)
+    assert not should_tile(_image_bytes((30, 20)), threshold=1000)
+    assert not should_tile(b'not an image')
+
+
+def test_output_limit_is_checked_before_any_tile_is_dispatched():
+    calls = []
+
+    class CountingBackend(LocalBackend):
+        def upscale(self, image_data):
+            calls.append(1)
+            return super().upscale(image_data)
+
+    # 300x200 × 4² = 960000 输出像素
+    with pytest.raises(ImageTooLargeError, match='inputs up to 0.06 megapixels at 4x'):
+        upscale_tiled(_image_bytes(), CountingBackend(scale=4), tile_size=96, overlap=16, max_output_pixels=900000)
+    assert calls == []
+
+
+def test_streamed_png_decodes_to_the_stitched_rows():
+    # 不分块时的结果就是各行直接拼接，分块流式编码后的像素应与之一致 (只差重叠带的羽化)
+    data = _image_bytes((250, 260))
+    backend = LocalBackend(scale=2, sharpen=False)
+    tiled = Image.open(io.BytesIO(upscale_tiled(data, backend, tile_size=96, overlap=16)))
+    assert tiled.format == 'PNG' and tiled.mode == 'RGB' and tiled.size == (500, 520)
+    tiled.load()
+    whole = Image.open(io.BytesIO(backend.upscale(data))).convert('RGB')
+    assert tiled.getpixel((0, 0)) == whole.getpixel((0, 0))
+    assert tiled.getpixel((499, 519)) == whole.getpixel((499, 519))
+
+
+def test_tiling_keeps_transparency():
+    img = Image.new('RGBA', (300, 200), (0, 0, 255, 0))
+    ImageDraw.Draw(img).rectangle([50, 50, 250, 150], fill=(255, 0, 0, 255))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+
+    tiled = Image.open(io.BytesIO(upscale_tiled(buffer.getvalue(), LocalBackend(scale=2, sharpen=False),
+                                                tile_size=96, overlap=16)))
+    assert tiled.mode == 'RGBA' and tiled.size == (600, 400)
+    assert tiled.getpixel((10, 10))[3] == 0
+    assert tiled.getpixel((300, 200))[3] == 255
+
+
+def test_upscale_rejects_oversized_output_at_admission(monkeypatch):
+    import functools
+
+    import app as app_module
+    from tiling import check_output_pixels
+
+    monkeypatch.setattr(app_module, 'check_output_pixels',
+                        functools.partial(check_output_pixels, max_output_pixels=10000))
+    client = app_module.app.test_client()
+    response = client.post('/upscale', data={'image': (io.BytesIO(_image_bytes((40, 30))), 'a.png'), 'backend': 'local'})
+    assert response.status_code == 413
+    assert 'inputs up to' in response.get_json()['error']
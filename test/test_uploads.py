@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# test_uploads.py - 测试可续传的分块上传
+
+import io
+import time
+import hashlib
+
+import pytest
+
+from uploads import (
+    OffsetMismatchError, TooManyUploadsError, UploadCapacityError, UploadError, UploadNotFoundError, UploadStore,
+)
+from helpers import image_bytes
+
+
+def test_chunks_resume_and_complete(tmp_path):
+    store = UploadStore(str(tmp_path))
+    data = bytes(range(256)) * 10
+    upload = store.create(len(data), 'a.bin', hashlib.sha256(data).hexdigest())
+    upload_id = upload['upload_id']
+
+    assert store.append(upload_id, 0, io.BytesIO(data[:1000]), 1000) == 1000
+    # 重发旧分块时提示正确的续传位置
+    with pytest.raises(OffsetMismatchError) as excinfo:
+        store.append(upload_id, 0, io.BytesIO(data[:1000]), 1000)
+    assert excinfo.value.offset == 1000
+
+    # 连接中断：只收到部分数据，没有校验时保留已收到的部分
+    assert store.append(upload_id, 1000, io.BytesIO(data[1000:1500]), 1000) == 1500
+    assert store.status(upload_id)['offset'] == 1500
+
+    with pytest.raises(OffsetMismatchError):
+        store.complete(upload_id)
+    rest = data[1500:]
+    store.append(upload_id, 1500, io.BytesIO(rest), len(rest), checksum=hashlib.sha256(rest).hexdigest())
+    store.complete(upload_id)
+    assert store.read(upload_id) == data
+
+    store.discard(upload_id)
+    with pytest.raises(UploadNotFoundError):
+        store.status(upload_id)
+
+
+def test_bad_chunk_checksum_is_discarded(tmp_path):
+    store = UploadStore(str(tmp_path))
+    upload_id = store.create(10)['upload_id']
+    with pytest.raises(UploadError):
+        store.append(upload_id, 0, io.BytesIO(b'0123456789'), 10, checksum='0' * 64)
+    assert store.status(upload_id)['offset'] == 0
+
+
+def test_whole_file_checksum_and_limits(tmp_path):
+    store = UploadStore(str(tmp_path), max_bytes=100, chunk_max_bytes=8)
+    with pytest.raises(UploadError):
+        store.create(101)
+    upload_id = store.create(8, sha256='f' * 64)['upload_id']
+    with pytest.raises(UploadError):
+        store.append(upload_id, 0, io.BytesIO(b'x' * 9), 9)
+    store.append(upload_id, 0, io.BytesIO(b'x' * 8), 8)
+    with pytest.raises(UploadError):
+        store.complete(upload_id)
+    with pytest.raises(UploadNotFoundError):
+        store.status('../../etc/passwd')
+
+
+def test_incomplete_uploads_are_capped_in_total(tmp_path):
+    store = UploadStore(str(tmp_path), total_max_bytes=100, max_sessions=2)
+    first = store.create(60)['upload_id']
+    with pytest.raises(UploadCapacityError) as excinfo:
+        store.create(50)
+    assert excinfo.value.status_code == 507
+
+    # 完成的上传不再占用预留
+    store.append(first, 0, io.BytesIO(b'x' * 60), 60)
+    store.complete(first)
+    store.create(50)
+    store.create(40)
+    with pytest.raises(TooManyUploadsError) as excinfo:
+        store.create(1)
+    assert excinfo.value.status_code == 429
+    assert store.pending() == (2, 90)
+
+
+def test_expired_uploads_are_purged(tmp_path):
+    store = UploadStore(str(tmp_path), ttl=0)
+    upload_id = store.create(4)['upload_id']
+    time.sleep(0.01)
+    store.purge_expired()
+    with pytest.raises(UploadNotFoundError):
+        store.status(upload_id)
+
+
+def test_submission_is_claimed_once(tmp_path):
+    store = UploadStore(str(tmp_path))
+    upload_id = store.create(4)['upload_id']
+    assert store.claim_submission(upload_id) is None
+    assert store.claim_submission(upload_id) == ''
+    store.record_submission(upload_id, 'job-1')
+    store.discard(upload_id)
+    assert store.claim_submission(upload_id) == 'job-1'
+
+    other = store.create(4)['upload_id']
+    assert store.claim_submission(other) is None
+    store.release_submission(other)  # 提交失败，可以重试
+    assert store.claim_submission(other) is None
+    with pytest.raises(UploadNotFoundError):
+        store.claim_submission('0' * 32)
+
+
+def test_chunked_upload_routes_feed_job_pipeline():
+    from app import app
+
+    client = app.test_client()
+    data = image_bytes((32, 24), 'green')
+    created = client.post('/uploads', json={'size': len(data), 'filename': 'test.png'})
+    assert created.status_code == 201
+    upload_url = created.get_json()['upload_url']
+
+    half = len(data) // 2
+    response = client.patch(upload_url, data=data[:half], headers={'Upload-Offset': '0'})
+    assert response.status_code == 204
+    assert client.head(upload_url).headers['Upload-Offset'] == str(half)
+
+    response = client.patch(upload_url, data=data[half:], headers={
+        'Upload-Offset': str(half),
+        'X-Chunk-SHA256': hashlib.sha256(data[half:]).hexdigest(),
+    })
+    assert response.headers['Upload-Offset'] == str(len(data))
+
+    submitted = client.post(f'{upload_url}/complete', data={'backend': 'local'})
+    assert submitted.status_code == 202
+    status_url = submitted.get_json()['status_url']
+    # 重试 /complete 不会再提交一个任务
+    repeated = client.post(f'{upload_url}/complete', data={'backend': 'local'})
+    assert repeated.status_code == 200
+    assert repeated.get_json()['job_id'] == submitted.get_json()['job_id']
+    for _ in range(100):
+        status = client.get(status_url).get_json()
+        if status['status'] in ('succeeded', 'failed'):
+            break
+        time.sleep(0.05)
+    assert status['status'] == 'succeeded'
+    assert client.head(upload_url).status_code == 404
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# test_warmup.py - 测试模型预热调度
+
+import io
+import threading
+
+from PIL import Image
+
+from warmup import COLD, FAILING, READY, WarmupScheduler, warmup_image
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBackend:
+    model_id = 'fake-model'
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = []
+
+    def upscale(self, image_data, max_retries=None):
+        self.calls.append(max_retries)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def test_warmup_image_is_small_png():
+    with Image.open(io.BytesIO(warmup_image())) as img:
+        assert img.size == (64, 64)
+        assert img.format == 'PNG'
+
+
+def test_readiness_follows_warmup_results():
+    clock = FakeClock()
+    backend = FakeBackend([None, b'ok', RuntimeError('boom')])
+    scheduler = WarmupScheduler(backend, interval=60, retry_interval=5, clock=clock)
+    assert scheduler.state == COLD
+
+    assert not scheduler.warm_once()
+    assert scheduler.state == COLD
+    assert scheduler.next_wait() == 5
+
+    assert scheduler.warm_once()
+    assert scheduler.ready
+    assert backend.calls == [1, 1]
+
+    clock.now += 60
+    assert not scheduler.warm_once()
+    assert scheduler.state == FAILING
+    snapshot = scheduler.snapshot()
+    assert snapshot['warmups'] == 3
+    assert snapshot['failures'] == 2
+    assert snapshot['last_error'] == 'boom'
+
+
+def test_recent_traffic_skips_keep_warm():
+    clock = FakeClock()
+    backend = FakeBackend([b'ok'])
+    scheduler = WarmupScheduler(backend, interval=60, clock=clock)
+    scheduler.warm_once()
+
+    clock.now = 50
+    backend.last_success_at = 50  # 真实请求成功
+    clock.now = 70
+    assert scheduler.next_wait() == 40
+    scheduler.tick()
+    assert scheduler.skipped == 1
+    assert len(backend.calls) == 1
+
+
+def test_startup_only_mode():
+    clock = FakeClock()
+    scheduler = WarmupScheduler(FakeBackend([b'ok']), interval=0, clock=clock)
+    scheduler.warm_once()
+    assert scheduler.state == READY
+    assert scheduler.next_wait() is None
+
+
+def test_health_reports_model_state():
+    from app import app
+
+    client = app.test_client()
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert 'state' in response.get_json()['model']
+
+
+def test_concurrent_start_launches_one_thread(monkeypatch):
+    import app as app_module
+
+    started = []
+    scheduler = WarmupScheduler(FakeBackend([b'ok'] * 10), interval=0)
+    monkeypatch.setattr(app_module, '_background_started', False)
+    monkeypatch.setattr(app_module, 'WARMUP_ENABLED', True)
+    monkeypatch.setattr(app_module, 'HF_API_TOKEN', 'token')
+    monkeypatch.setattr(app_module, 'warmup', scheduler)
+    barrier = threading.Barrier(8)
+
+    def start():
+        barrier.wait()
+        app_module.start_background_tasks()
+        scheduler.start()
+        started.append(scheduler._thread)
+
+    threads = [threading.Thread(target=start) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    scheduler._thread.join(5)
+    assert len(set(started)) == 1
+    assert scheduler.warmups == 1
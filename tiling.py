@@ -0,0 +1,243 @@
+# tiling.py - 大图分块超分：切成重叠的小块并发处理，再羽化拼接
+#
+# 拼接按光栅顺序进行：同一行的分块先拼成一条横向条带，条带再与上一行留下的重叠带线性过渡，
+# 不再与下一行重叠的部分立即交给流式 PNG 编码器写出，因此内存中只有一行分块的条带，而不是整张输出画布；
+# 同时在途的分块数受 TILE_CONCURRENCY 限制。解码后的整张原图和编码后的结果仍在内存中，
+# 输出像素数由 TILE_MAX_OUTPUT_PIXELS 限制，在提交任何分块之前检查。分块超分的结果统一为 PNG。
+
+import io
+import math
+import contextvars
+import os
+import struct
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops
+
+import progress
+from ingest import ImageTooLargeError
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = int(os.getenv("TILE_SIZE", "512"))                          # 分块边长(输入像素)
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", "32"))                     # 相邻分块重叠宽度
+TILE_CONCURRENCY = int(os.getenv("TILE_CONCURRENCY", "4"))              # 同时进行推理的分块数
+TILE_THRESHOLD_PIXELS = int(os.getenv("TILE_THRESHOLD_PIXELS", "1048576"))  # 超过该像素数才分块
+TILE_MAX_OUTPUT_PIXELS = int(os.getenv("TILE_MAX_OUTPUT_PIXELS", "256000000"))  # 拼接结果像素上限
+
+
+def check_output_pixels(pixels, scale, max_output_pixels=TILE_MAX_OUTPUT_PIXELS):
+    """放大后的像素数超过拼接上限时抛出 ImageTooLargeError (413)，错误信息中给出对应的输入上限"""
+    if not max_output_pixels or pixels <= max_output_pixels:
+        return
+    raise ImageTooLargeError(
+        f"Upscaled image would be {pixels / 1e6:.1f} megapixels; the maximum output is "
+        f"{max_output_pixels / 1e6:.1f} megapixels (inputs up to {max_output_pixels / scale ** 2 / 1e6:.2f} "
+        f"megapixels at {scale}x)")
+
+
+def image_size(image_data):
+    """只解析图片头部获取尺寸，失败时返回 None"""
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def tile_limits(backend):
+    """按后端单次推理的输入上限确定 (分块阈值, 分块边长)"""
+    limit = getattr(backend, 'max_input_pixels', None)
+    if not limit:
+        return TILE_THRESHOLD_PIXELS, TILE_SIZE
+    return min(TILE_THRESHOLD_PIXELS, limit), min(TILE_SIZE, math.isqrt(limit))
+
+
+def should_tile(image_data, threshold=TILE_THRESHOLD_PIXELS):
+    size = image_size(image_data)
+    return size is not None and size[0] * size[1] > threshold
+
+
+def _axis_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    step = tile_size - overlap
+    starts = list(range(0, length - tile_size, step))
+    starts.append(length - tile_size)
+    return starts
+
+
+def plan_tiles(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """按光栅顺序返回分块区域 (left, top, right, bottom)"""
+    if overlap >= tile_size:
+        raise ValueError("Tile overlap must be smaller than tile size")
+    boxes = []
+    for top in _axis_starts(height, tile_size, overlap):
+        for left in _axis_starts(width, tile_size, overlap):
+            boxes.append((left, top, min(left + tile_size, width), min(top + tile_size, height)))
+    return boxes
+
+
+def _ramp(length, size, horizontal):
+    """生成在 length 像素内从 0 过渡到 255 的羽化蒙版，其余部分为 255"""
+    mask = Image.new('L', size, 255)
+    if length <= 0:
+        return mask
+    gradient = Image.linear_gradient('L')  # 256x256，自上而下 0 -> 255
+    if horizontal:
+        band = gradient.rotate(90, expand=True).resize((length, size[1]))  # 自左向右 0 -> 255
+    else:
+        band = gradient.resize((size[0], length))
+    mask.paste(band, (0, 0))
+    return mask
+
+
+class _PNGStream:
+    """逐段写出 PNG：每次写入若干整行，压缩后作为 IDAT 块追加，不需要整张图片在内存中"""
+
+    def __init__(self, stream, width, height, mode):
+        self.stream = stream
+        self._compressor = zlib.compressobj(6)
+        stream.write(b'\x89PNG\r\n\x1a\n')
+        color_type = 6 if mode == 'RGBA' else 2
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.stream.write(struct.pack('>I', len(data)) + kind + data)
+        self.stream.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def write(self, rows):
+        # Sub 过滤：每个字节减去左侧像素同一通道的值 (模 256)，正好是 ImageChops.subtract_modulo
+        shifted = Image.new(rows.mode, rows.size)
+        if rows.width > 1:
+            shifted.paste(rows.crop((0, 0, rows.width - 1, rows.height)), (1, 0))
+        filtered = ImageChops.subtract_modulo(rows, shifted).tobytes()
+        stride = rows.width * len(rows.mode)
+        data = self._compressor.compress(
+            b''.join(b'\x01' + filtered[i:i + stride] for i in range(0, len(filtered), stride)))
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def close(self):
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+
+
+def _finish_row(writer, strip, carry, top, next_top, scale, alpha):
+    """把一行分块的条带与上一行留下的重叠带羽化拼接，写出之后不再变化的行，返回留给下一行的重叠带"""
+    if carry is not None:
+        # carry 是上一行条带中与本行重叠的部分，在这段内自上而下从上一行过渡到本行
+        carry.paste(strip.crop((0, 0, strip.width, carry.height)), (0, 0),
+                    _ramp(carry.height, carry.size, horizontal=False))
+        strip.paste(carry, (0, 0))
+        carry.close()
+    done = strip.height if next_top is None else (next_top - top) * scale
+    rows = strip.crop((0, 0, strip.width, done))
+    if alpha is not None:
+        # 透明通道按行区间单独放大，box 为原图坐标，滤波仍会参考区间外的像素，行与行之间不会有接缝
+        rows = rows.convert('RGBA')
+        rows.putalpha(alpha.resize(rows.size, Image.LANCZOS,
+                                   box=(0, top, alpha.width, top + done / scale)))
+    writer.write(rows)
+    rows.close()
+    if next_top is None:
+        return None
+    return strip.crop((0, done, strip.width, strip.height))
+
+
+def _encode_tile(img, box):
+    buffer = io.BytesIO()
+    img.crop(box).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _upscale_tile(backend, tile_data):
+    result = backend.upscale(tile_data)
+    if not result:
+        return None
+    with Image.open(io.BytesIO(result)) as tile:
+        return tile.convert('RGB')
+
+
+def upscale_tiled(image_data, backend, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                  concurrency=TILE_CONCURRENCY, max_output_pixels=TILE_MAX_OUTPUT_PIXELS):
+    """分块并发超分大图，成功返回 PNG 字节，任一分块失败时返回 None
+
+    放大后超过输出像素上限时抛出 ImageTooLargeError；放大倍数已知时在提交任何 (付费的) 推理之前检查。
+    """
+    with Image.open(io.BytesIO(image_data)) as source:
+        width, height = source.size
+        known_scale = getattr(backend, 'scale', None)
+        if known_scale:
+            check_output_pixels(width * height * known_scale ** 2, known_scale, max_output_pixels)
+        # 透明通道不送去推理，拼接时按行单独放大贴回，与不分块时一样保留透明度
+        alpha = None
+        if source.mode in ('RGBA', 'LA', 'PA') or 'transparency' in source.info:
+            alpha = source.convert('RGBA').getchannel('A')
+        img = source.convert('RGB')
+
+    boxes = plan_tiles(width, height, tile_size, overlap)
+    columns = len(_axis_starts(width, tile_size, overlap))
+    logger.info(f"图片 {width}x{height} 切分为 {len(boxes)} 个分块进行超分")
+    progress.emit('tiling', tiles=len(boxes))
+
+    buffer = io.BytesIO()
+    writer = None
+    scale = None
+    strip = None  # 当前这一行分块拼成的条带
+    carry = None  # 上一行条带中与当前行重叠、尚未写出的部分
+    window = max(concurrency, 1) * 2  # 已提交但尚未拼接的分块上限
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='upscale-tile') as executor:
+        pending = []
+        next_box = 0
+        for index, box in enumerate(boxes):
+            # 保持滑动窗口，控制在途分块占用的内存
+            while next_box < len(boxes) and next_box < index + window:
+                tile_data = _encode_tile(img, boxes[next_box])
+                # 分块在线程池中执行，复制上下文以沿用当前请求的进度通道和调度流
+                context = contextvars.copy_context()
+                pending.append(executor.submit(context.run, _upscale_tile, backend, tile_data))
+                next_box += 1
+
+            tile = pending.pop(0).result()
+            if tile is None:
+                logger.error(f"分块 {index + 1}/{len(boxes)} 超分失败")
+                for future in pending:
+                    future.cancel()
+                return None
+
+            left, top, right, bottom = box
+            if scale is None:
+                scale = max(1, round(tile.width / (right - left)))
+                try:
+                    check_output_pixels(width * height * scale * scale, scale, max_output_pixels)
+                except ImageTooLargeError:
+                    for future in pending:
+                        future.cancel()
+                    raise
+                writer = _PNGStream(buffer, width * scale, height * scale, 'RGB' if alpha is None else 'RGBA')
+            expected = ((right - left) * scale, (bottom - top) * scale)
+            if tile.size != expected:
+                tile = tile.resize(expected, Image.LANCZOS)
+
+            # 同一行内与左侧分块重叠的宽度
+            column = index % columns
+            if column == 0:
+                strip = Image.new('RGB', (width * scale, (bottom - top) * scale))
+            left_overlap = boxes[index - 1][2] - left if column else 0
+            strip.paste(tile, (left * scale, 0), _ramp(left_overlap * scale, tile.size, horizontal=True))
+            tile.close()
+            if column == columns - 1:
+                next_top = boxes[index + 1][1] if index + 1 < len(boxes) else None
+                carry = _finish_row(writer, strip, carry, top, next_top, scale, alpha)
+                strip.close()
+            progress.emit('tile', done=index + 1, total=len(boxes))
+
+    img.close()
+    if alpha is not None:
+        alpha.close()
+    writer.close()
+    return buffer.getvalue()
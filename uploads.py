@@ -0,0 +1,336 @@
+# uploads.py - 可续传的分块上传
+#
+# 大图不再通过一次 multipart 请求整体读入内存：客户端先创建上传会话，再按偏移量逐块追加，
+# 每块可带 SHA-256 校验；数据直接写入磁盘临时文件。连接中断后查询当前偏移量即可续传。
+# 上传完成后作为异步任务提交，任务开始执行时才从磁盘读取，排队期间不占用内存。
+#
+# 会话信息保存在磁盘上（数据文件 + JSON 元数据），同一台机器上的多个 worker 进程都能续传。
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+import logging
+
+try:
+    import fcntl  # 多进程写同一个上传时加文件锁（Windows 上没有，只使用线程锁）
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv(
+    "UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "super-resolution-uploads")
+)                                                                        # 分块上传的暂存目录
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "100"))                   # 分块上传的文件大小上限(MB)
+UPLOAD_CHUNK_MAX_MB = int(os.getenv("UPLOAD_CHUNK_MAX_MB", "8"))         # 单个分块大小上限(MB)
+UPLOAD_TTL = int(os.getenv("UPLOAD_TTL", "3600"))                        # 未完成的上传保留时间(秒)
+UPLOAD_TOTAL_MAX_MB = int(os.getenv("UPLOAD_TOTAL_MAX_MB", "2048"))      # 所有未完成上传声明大小的总和上限(MB)，0 表示不限制
+UPLOAD_MAX_SESSIONS = int(os.getenv("UPLOAD_MAX_SESSIONS", "100"))       # 同时存在的未完成上传数上限，0 表示不限制
+
+_BLOCK_SIZE = 64 * 1024
+_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(ValueError):
+    """上传请求无效，status_code 为返回给客户端的状态码"""
+
+    status_code = 400
+
+
+class UploadNotFoundError(UploadError):
+    status_code = 404
+
+    def __init__(self):
+        super().__init__('Upload not found')
+
+
+class OffsetMismatchError(UploadError):
+    """客户端给出的偏移量与服务端已接收的字节数不一致"""
+
+    status_code = 409
+
+    def __init__(self, offset):
+        super().__init__(f'Offset mismatch. Resume from offset {offset}.')
+        self.offset = offset
+
+
+class TooManyUploadsError(UploadError):
+    status_code = 429
+
+    def __init__(self):
+        super().__init__('Too many uploads in progress. Please retry later.')
+
+
+class UploadCapacityError(UploadError):
+    """未完成的上传预留的磁盘空间已达到总量上限"""
+
+    status_code = 507
+
+    def __init__(self):
+        super().__init__('Upload storage is full. Please retry later.')
+
+
+class UploadStore:
+    """磁盘上的上传会话
+
+    创建会话时按声明的大小预留空间：所有未完成上传的声明大小之和不超过 total_max_bytes，
+    会话数不超过 max_sessions，避免客户端创建大量会话后缓慢上传占满磁盘。
+    """
+
+    def __init__(self, directory=UPLOAD_DIR, max_bytes=UPLOAD_MAX_MB * 1024 * 1024,
+                 chunk_max_bytes=UPLOAD_CHUNK_MAX_MB * 1024 * 1024, ttl=UPLOAD_TTL,
+                 total_max_bytes=UPLOAD_TOTAL_MAX_MB * 1024 * 1024, max_sessions=UPLOAD_MAX_SESSIONS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_max_bytes = chunk_max_bytes
+        self.ttl = ttl
+        self.total_max_bytes = total_max_bytes
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._file_locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, upload_id):
+        if not _ID_PATTERN.match(upload_id or ''):
+            raise UploadNotFoundError()
+        base = os.path.join(self.directory, upload_id)
+        return base + '.part', base + '.json'
+
+    def _load_meta(self, upload_id):
+        data_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadNotFoundError()
+
+    def _save_meta(self, upload_id, meta):
+        _, meta_path = self._paths(upload_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _file_lock(self, upload_id):
+        with self._lock:
+            return self._file_locks.setdefault(upload_id, threading.Lock())
+
+    def create(self, size, filename=None, sha256=None):
+        """创建上传会话，返回会话状态"""
+        self.purge_expired()
+        if size <= 0:
+            raise UploadError('Upload size must be positive')
+        if size > self.max_bytes:
+            raise UploadError(f'Image size too large. Maximum {self.max_bytes // (1024 * 1024)}MB allowed.')
+        if sha256 is not None and not re.match(r'^[0-9a-fA-F]{64}$', sha256):
+            raise UploadError('sha256 must be a hex digest')
+
+        upload_id = uuid.uuid4().hex
+        data_path, _ = self._paths(upload_id)
+        meta = {
+            'upload_id': upload_id,
+            'size': size,
+            'filename': filename,
+            'sha256': sha256.lower() if sha256 else None,
+            'created_at': round(time.time(), 3),
+            'complete': False,
+        }
+        # 检查和登记在同一把锁内进行 (多进程时加文件锁)，并发创建不会一起越过上限
+        with self._lock, open(os.path.join(self.directory, '.create.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            sessions, reserved = self.pending()
+            if self.max_sessions and sessions >= self.max_sessions:
+                raise TooManyUploadsError()
+            if self.total_max_bytes and reserved + size > self.total_max_bytes:
+                logger.warning(f"未完成的上传已预留 {reserved} 字节，拒绝新的 {size} 字节上传")
+                raise UploadCapacityError()
+            open(data_path, 'wb').close()
+            self._save_meta(upload_id, meta)
+        return self.status(upload_id)
+
+    def pending(self):
+        """返回 (未完成的上传数, 声明大小之和)"""
+        sessions = reserved = 0
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0, 0
+        for name in names:
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.json' or not _ID_PATTERN.match(upload_id):
+                continue
+            try:
+                meta = self._load_meta(upload_id)
+            except UploadNotFoundError:
+                continue
+            if not meta['complete']:
+                sessions += 1
+                reserved += meta['size']
+        return sessions, reserved
+
+    def status(self, upload_id):
+        meta = self._load_meta(upload_id)
+        data_path, _ = self._paths(upload_id)
+        meta['offset'] = os.path.getsize(data_path)
+        return meta
+
+    def append(self, upload_id, offset, stream, length, checksum=None):
+        """从 stream 读取 length 字节追加到 offset 处，返回新的偏移量
+
+        带 checksum 时整块校验失败或读取不完整都会丢弃本块；不带时保留已收到的部分以便续传。
+        """
+        if length is None:
+            raise UploadError('Content-Length is required')
+        if length > self.chunk_max_bytes:
+            raise UploadError(f'Chunk too large. Maximum {self.chunk_max_bytes // (1024 * 1024)}MB allowed.')
+        data_path, _ = self._paths(upload_id)
+
+        with self._file_lock(upload_id):
+            meta = self._load_meta(upload_id)
+            if meta['complete']:
+                raise UploadError('Upload already completed')
+            with open(data_path, 'r+b') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                current = os.fstat(f.fileno()).st_size
+                if offset != current:
+                    raise OffsetMismatchError(current)
+                if offset + length > meta['size']:
+                    raise UploadError('Chunk exceeds declared upload size')
+
+                f.seek(offset)
+                digest = hashlib.sha256()
+                received = 0
+                while received < length:
+                    block = stream.read(min(_BLOCK_SIZE, length - received))
+                    if not block:
+                        break
+                    f.write(block)
+                    digest.update(block)
+                    received += len(block)
+
+                if checksum and (received < length or digest.hexdigest() != checksum.lower()):
+                    f.truncate(offset)
+                    raise UploadError('Chunk checksum mismatch' if received == length else 'Incomplete chunk')
+                f.flush()
+                return offset + received
+
+    def head(self, upload_id, length=256 * 1024):
+        """读取文件开头（用于只解析图片头部的场景）"""
+        data_path, _ = self._paths(upload_id)
+        with open(data_path, 'rb') as f:
+            return f.read(length)
+
+    def complete(self, upload_id):
+        """确认已接收全部数据并校验整体 SHA-256"""
+        with self._file_lock(upload_id):
+            meta = self.status(upload_id)
+            if meta['offset'] != meta['size']:
+                raise OffsetMismatchError(meta['offset'])
+            if meta['sha256'] and not meta['complete']:
+                data_path, _ = self._paths(upload_id)
+                digest = hashlib.sha256()
+                with open(data_path, 'rb') as f:
+                    for block in iter(lambda: f.read(_BLOCK_SIZE * 16), b''):
+                        digest.update(block)
+                if digest.hexdigest() != meta['sha256']:
+                    raise UploadError('Upload checksum mismatch')
+            meta['complete'] = True
+            self._save_meta(upload_id, {k: v for k, v in meta.items() if k != 'offset'})
+            return meta
+
+    def read(self, upload_id):
+        """读取已完成上传的全部内容"""
+        meta = self._load_meta(upload_id)
+        if not meta['complete']:
+            raise UploadError('Upload is not complete')
+        data_path, _ = self._paths(upload_id)
+        with open(data_path, 'rb') as f:
+            return f.read()
+
+    def data_path(self, upload_id):
+        """已完成上传的数据文件路径（交给持久化任务队列直接移入共享存储）"""
+        meta = self._load_meta(upload_id)
+        if not meta['complete']:
+            raise UploadError('Upload is not complete')
+        return self._paths(upload_id)[0]
+
+    def _submission_path(self, upload_id):
+        return self._paths(upload_id)[1][:-len('.json')] + '.job'
+
+    def claim_submission(self, upload_id):
+        """标记上传已提交为任务，只有第一个调用者返回 None
+
+        之后的调用返回第一次提交记录的任务 ID (提交尚未完成时为空字符串)。标记文件以 O_EXCL 创建，
+        多个进程同时完成同一个上传时也只有一个会提交；上传数据被删除后标记仍保留到过期清理。
+        """
+        path = self._submission_path(upload_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    return f.read().strip()
+            except FileNotFoundError:
+                return ''  # 第一次提交失败，标记刚被撤销
+        os.close(fd)
+        if not os.path.exists(self._paths(upload_id)[1]):
+            os.remove(path)
+            raise UploadNotFoundError()
+        return None
+
+    def record_submission(self, upload_id, job_id):
+        path = self._submission_path(upload_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(job_id)
+        os.replace(tmp_path, path)
+
+    def release_submission(self, upload_id):
+        """提交失败 (校验未通过、队列已满等) 时撤销标记，客户端可以重试"""
+        try:
+            os.remove(self._submission_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, upload_id):
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._file_locks.pop(upload_id, None)
+
+    def purge_expired(self):
+        """删除超过保留时间没有新数据的上传"""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            upload_id, ext = os.path.splitext(name)
+            if ext == '.job' and _ID_PATTERN.match(upload_id):
+                try:
+                    if os.path.getmtime(self._submission_path(upload_id)) < cutoff:
+                        self.release_submission(upload_id)
+                except FileNotFoundError:
+                    pass
+                continue
+            if ext != '.json' or not _ID_PATTERN.match(upload_id):
+                continue
+            data_path, meta_path = self._paths(upload_id)
+            try:
+                # 数据文件每次追加都会更新修改时间，正在进行的上传不会被清理
+                if max(os.path.getmtime(meta_path), os.path.getmtime(data_path)) < cutoff:
+                    self.discard(upload_id)
+                    logger.info(f"已清理过期上传 {upload_id}")
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,168 @@
+# warmup.py - 模型预热与保温
+#
+# 远程模型闲置一段时间后会被卸载，下一个请求要等待 503 "模型加载中" 的重试。
+# 预热调度器在应用启动时发送一次极小的推理请求，之后按间隔继续发送以保持模型常驻；
+# 最近有真实请求成功时跳过本轮，避免无谓的调用。模型就绪状态通过 /health 暴露。
+
+import io
+import os
+import time
+import threading
+import logging
+
+from PIL import Image, ImageDraw
+
+from backends import untracked
+from retry_policy import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"     # 是否启用预热
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "300"))             # 保温间隔(秒)，0 表示只在启动时预热
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "15"))  # 模型未就绪时的重试间隔(秒)
+
+# 就绪状态
+COLD = 'cold'          # 尚未成功推理过
+WARMING = 'warming'    # 正在发送预热请求
+READY = 'ready'
+FAILING = 'failing'    # 曾经就绪，但最近一次预热失败
+
+
+def warmup_image():
+    """64x64 的测试图，与 test/test_stable_diffusion_upscaler.py 中的一致"""
+    img = Image.new('RGB', (64, 64), color='white')
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([10, 10, 54, 54], fill='blue', outline='red', width=2)
+    draw.ellipse([20, 20, 44, 44], fill='yellow')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class WarmupScheduler:
+    """后台线程定时预热一个后端，并记录模型是否就绪"""
+
+    def __init__(self, backend, interval=WARMUP_INTERVAL, retry_interval=WARMUP_RETRY_INTERVAL,
+                 clock=time.monotonic):
+        self.backend = backend
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._image = warmup_image()
+        self.state = COLD
+        self.warmups = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_latency = None
+        self.last_error = None
+        self.last_warm_at = None
+
+    @property
+    def ready(self):
+        with self._lock:
+            self._sync_with_traffic()
+            return self.state == READY
+
+    def _sync_with_traffic(self):
+        # 真实请求成功同样说明模型已加载
+        last_success = getattr(self.backend, 'last_success_at', None)
+        if last_success is not None and (self.last_warm_at is None or last_success > self.last_warm_at):
+            self.state = READY
+            self.last_warm_at = last_success
+
+    def warm_once(self):
+        """发送一次预热推理，返回是否成功"""
+        with self._lock:
+            if self.state != READY:
+                self.state = WARMING
+        start = self._clock()
+        error = None
+        try:
+            # 只尝试一次：模型加载中时由下一轮预热再试，不长时间占用线程；预热不计入路由的耗时统计
+            with untracked():
+                result = self.backend.upscale(self._image, max_retries=1)
+            if not result:
+                error = 'upstream returned no result'
+        except CircuitOpenError as e:
+            error = str(e)
+        except Exception as e:
+            error = str(e)
+        elapsed = self._clock() - start
+
+        with self._lock:
+            self.warmups += 1
+            self.last_latency = round(elapsed, 3)
+            if error is None:
+                self.state = READY
+                self.last_error = None
+                self.last_warm_at = self._clock()
+                logger.info(f"模型预热成功，耗时 {elapsed:.2f} 秒")
+                return True
+            self.failures += 1
+            self.last_error = error
+            self.state = FAILING if self.last_warm_at is not None else COLD
+            logger.warning(f"模型预热失败: {error}")
+            return False
+
+    def next_wait(self):
+        """距离下一次预热的等待秒数；只在启动时预热且已就绪时返回 None"""
+        with self._lock:
+            self._sync_with_traffic()
+            if self.state != READY:
+                return self.retry_interval
+            if self.interval <= 0:
+                return None
+            idle = self._clock() - self.last_warm_at
+            return max(self.interval - idle, 0)
+
+    def tick(self):
+        """调度一轮：模型未就绪或闲置超过间隔时才预热"""
+        wait = self.next_wait()
+        if wait == 0 or not self.ready:
+            self.warm_once()
+        else:
+            with self._lock:
+                self.skipped += 1
+
+    def _loop(self):
+        self.warm_once()
+        while True:
+            wait = self.next_wait()
+            if wait is None or self._stop.wait(wait):
+                return
+            self.tick()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name='model-warmup', daemon=True)
+            self._thread.start()
+        logger.info(f"模型预热已启动: interval={self.interval}s, model={self.backend.model_id}")
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def snapshot(self):
+        with self._lock:
+            self._sync_with_traffic()
+            idle = None if self.last_warm_at is None else round(self._clock() - self.last_warm_at, 1)
+            return {
+                'model': self.backend.model_id,
+                'state': self.state,
+                'ready': self.state == READY,
+                'seconds_since_warm': idle,
+                'warmups': self.warmups,
+                'failures': self.failures,
+                'skipped': self.skipped,
+                'last_latency': self.last_latency,
+                'last_error': self.last_error,
+                'interval': self.interval,
+            }
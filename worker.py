@@ -0,0 +1,47 @@
+# worker.py - 持久化任务队列的 worker 进程
+#
+# 启动方式: JOB_BACKEND=sqlite python worker.py
+#
+# 从 JOB_QUEUE_DB 领取任务，使用与 Web 进程相同的处理流程（缓存、预处理、分块、推理），
+# 结果写入 JOB_STORAGE_DIR。可以同时运行多个 worker（多进程或多台共享磁盘的机器），
+# 任意一个 worker 崩溃或重启时，它正在处理的任务会在租约过期后由其他 worker 重新执行。
+
+import sys
+import signal
+import logging
+
+import app as web
+from backends import get_backend
+from job_queue import JOB_BACKEND, Worker, create_job_queue, create_job_storage
+
+logger = logging.getLogger(__name__)
+
+
+def run_task(image_data, backend_name, info):
+    backend = get_backend(backend_name)
+    if backend is None:
+        raise ValueError(f'Unknown backend: {backend_name}')
+    info['model'] = backend.name
+    return web.upscale_image(image_data, backend, info)
+
+
+def main():
+    if JOB_BACKEND != 'sqlite':
+        # Web 进程使用进程内队列时不会有任务写入持久化队列，worker 启动了也收不到任务
+        logger.error(f"JOB_BACKEND={JOB_BACKEND}，worker 需要与 Web 进程一起设置 JOB_BACKEND=sqlite")
+        sys.exit(1)
+    web.start_background_tasks()
+    worker = Worker(create_job_queue(), create_job_storage(), run_task)
+
+    def handle_signal(signum, frame):
+        # 收到停止信号后处理完当前任务再退出；被强制杀死时由租约过期兜底
+        logger.info(f"worker 收到信号 {signum}，处理完当前任务后退出")
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()